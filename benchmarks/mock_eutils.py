@@ -0,0 +1,369 @@
+"""Local stand-in for the NCBI E-utilities (esearch, esummary, efetch, elink).
+
+Serves deterministic synthetic records, or recorded fixtures when a matching
+file exists, with configurable latency, error rate and 429 behaviour. PMIDs from
+MISSING_PMID_MIN on do not exist: efetch leaves them out and esummary reports an
+error for them, as NCBI does for unknown IDs. WebEnvs the mock did not hand out
+(or that were dropped from state.webenvs) get NCBI's error document, like an
+expired History server session.
+
+    python benchmarks/mock_eutils.py --port 8765 --latency-ms 150 --jitter-ms 50 --max-rps 10
+
+Point the server at it with PUBMED_EUTILS_BASE_URL=http://127.0.0.1:8765/entrez/eutils.
+GET /stats returns request counts per endpoint, status and API key; POST /reset clears them.
+
+Fixture files are looked up as <fixtures>/<endpoint>-<key>.<json|xml>, where key is
+fixture_key(params) (sha1 of the sorted query parameters without api_key).
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import textwrap
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+JOURNALS = [
+    ("N Engl J Med", "The New England journal of medicine", "0028-4793"),
+    ("Lancet Neurol", "The Lancet. Neurology", "1474-4422"),
+    ("Neurology", "Neurology", "0028-3878"),
+    ("Mov Disord", "Movement disorders : official journal of the Movement Disorder Society", "0885-3185"),
+    ("Brain Res", "Brain research", "0006-8993"),
+    ("J Neurol Sci", "Journal of the neurological sciences", "0022-510X"),
+    ("Front Neurol", "Frontiers in neurology", "1664-2295"),
+    ("Sci Rep", "Scientific reports", "2045-2322"),
+]
+PUB_TYPES = [
+    ["Journal Article"],
+    ["Journal Article", "Randomized Controlled Trial"],
+    ["Journal Article", "Review"],
+    ["Journal Article", "Systematic Review", "Meta-Analysis"],
+    ["Case Reports", "Journal Article"],
+    ["Practice Guideline", "Journal Article"],
+]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+TOPICS = ["Parkinson disease", "epilepsy", "multiple sclerosis", "stroke", "migraine", "ALS", "dementia"]
+# Synthetic search results stay below this
+MISSING_PMID_MIN = 90000000
+
+def fixture_key(params: dict) -> str:
+    items = sorted((k, v) for k, v in params.items() if k != "api_key")
+    return hashlib.sha1(json.dumps(items).encode("utf-8")).hexdigest()
+
+def seed_of(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+def synthetic_article(pmid: str) -> dict:
+    """Deterministic fake record for a PMID"""
+    rng = random.Random(seed_of(pmid))
+    abbrev, title, issn = rng.choice(JOURNALS)
+    year = rng.randint(1995, 2025)
+    topic = rng.choice(TOPICS)
+    return {
+        "pmid": pmid,
+        "title": f"{topic.capitalize()} study {pmid}: outcomes in a cohort of {rng.randint(20, 5000)} patients",
+        "authors": [(f"Author{rng.randint(1, 999)}", rng.choice("ABCDEFGHJKLMNPRST")) for _ in range(rng.randint(1, 12))],
+        "journal": title,
+        "source": abbrev,
+        "issn": issn,
+        "year": year,
+        "month": rng.choice(MONTHS),
+        "pub_types": rng.choice(PUB_TYPES),
+        "abstract": " ".join(f"Sentence {i} about {topic} in record {pmid}." for i in range(rng.randint(3, 15))),
+        "doi": f"10.5555/mock.{pmid}",
+        "pmc": f"PMC{pmid}" if rng.random() < 0.3 else None,
+    }
+
+def search_ids(term: str, retstart: int, retmax: int) -> tuple:
+    seed = seed_of(term)
+    count = 50 + seed % 5000
+    end = min(count, retstart + retmax)
+    return count, [str(10000000 + (seed + i * 7919) % 30000000) for i in range(retstart, end)]
+
+def exists(pmid: str) -> bool:
+    return not pmid.isdigit() or int(pmid) < MISSING_PMID_MIN
+
+def esummary_json(pmids: list) -> dict:
+    result = {"uids": pmids}
+    for pmid in pmids:
+        if not exists(pmid):
+            result[pmid] = {"uid": pmid, "error": "cannot get document summary"}
+            continue
+        a = synthetic_article(pmid)
+        result[pmid] = {
+            "uid": pmid,
+            "title": a["title"],
+            "pubdate": f"{a['year']} {a['month']}",
+            "sortpubdate": f"{a['year']}/{MONTHS.index(a['month']) + 1:02d}/01 00:00",
+            "source": a["source"],
+            "fulljournalname": a["journal"],
+            "issn": a["issn"],
+            "essn": "",
+            "authors": [{"name": f"{last} {init}", "authtype": "Author", "clusterid": ""} for last, init in a["authors"]],
+            "pubtype": a["pub_types"],
+            "articleids": [{"idtype": "pubmed", "value": pmid}, {"idtype": "doi", "value": a["doi"]}],
+        }
+    return {"header": {"type": "esummary", "version": "0.3"}, "result": result}
+
+def article_xml(pmid: str) -> str:
+    a = synthetic_article(pmid)
+    authors = "".join(
+        f"<Author ValidYN=\"Y\"><LastName>{last}</LastName><ForeName>{init}name</ForeName><Initials>{init}</Initials></Author>"
+        for last, init in a["authors"]
+    )
+    pub_types = "".join(f"<PublicationType UI=\"D000000\">{pt}</PublicationType>" for pt in a["pub_types"])
+    pmc = f"<ArticleId IdType=\"pmc\">{a['pmc']}</ArticleId>" if a["pmc"] else ""
+    return (
+        f"<PubmedArticle><MedlineCitation Status=\"MEDLINE\" Owner=\"NLM\"><PMID Version=\"1\">{pmid}</PMID>"
+        f"<Article PubModel=\"Print\"><Journal><ISSN IssnType=\"Print\">{a['issn']}</ISSN><JournalIssue CitedMedium=\"Print\">"
+        f"<Volume>{a['year'] % 100}</Volume><Issue>1</Issue><PubDate><Year>{a['year']}</Year><Month>{a['month']}</Month></PubDate></JournalIssue>"
+        f"<Title>{a['journal']}</Title><ISOAbbreviation>{a['source']}</ISOAbbreviation></Journal>"
+        f"<ArticleTitle>{a['title']}</ArticleTitle><Pagination><MedlinePgn>1-10</MedlinePgn></Pagination>"
+        f"<Abstract><AbstractText>{a['abstract']}</AbstractText></Abstract>"
+        f"<AuthorList CompleteYN=\"Y\">{authors}</AuthorList><Language>eng</Language>"
+        f"<PublicationTypeList>{pub_types}</PublicationTypeList></Article>"
+        f"<MedlineJournalInfo><MedlineTA>{a['source']}</MedlineTA><ISSNLinking>{a['issn']}</ISSNLinking></MedlineJournalInfo>"
+        f"<MeshHeadingList><MeshHeading><DescriptorName UI=\"D000001\" MajorTopicYN=\"N\">Humans</DescriptorName></MeshHeading></MeshHeadingList>"
+        f"</MedlineCitation><PubmedData><ArticleIdList><ArticleId IdType=\"pubmed\">{pmid}</ArticleId>"
+        f"<ArticleId IdType=\"doi\">{a['doi']}</ArticleId>{pmc}</ArticleIdList></PubmedData></PubmedArticle>"
+    )
+
+def efetch_xml(pmids: list) -> str:
+    articles = "".join(article_xml(p) for p in pmids if exists(p))
+    return f"<?xml version=\"1.0\" ?>\n<PubmedArticleSet>{articles}</PubmedArticleSet>"
+
+def medline_record(pmid: str) -> str:
+    """efetch rettype=medline text; long values wrap onto six-space continuation lines"""
+    a = synthetic_article(pmid)
+    fields = [
+        ("PMID", pmid), ("OWN", "NLM"), ("STAT", "MEDLINE"),
+        ("IS", f"{a['issn']} (Print)"), ("VI", str(a["year"] % 100)), ("IP", "1"),
+        ("DP", f"{a['year']} {a['month']}"), ("TI", a["title"]), ("PG", "1-10"),
+        ("LID", f"{a['doi']} [doi]"), ("AB", a["abstract"]),
+    ]
+    for last, init in a["authors"]:
+        fields += [("FAU", f"{last}, {init}name"), ("AU", f"{last} {init}")]
+    fields += [("LA", "eng")] + [("PT", pt) for pt in a["pub_types"]]
+    fields += [("TA", a["source"]), ("JT", a["journal"]), ("MH", "Humans")]
+    if a["pmc"]:
+        fields.append(("PMC", a["pmc"]))
+    fields.append(("AID", f"{a['doi']} [doi]"))
+    lines = []
+    for tag, value in fields:
+        wrapped = textwrap.wrap(value, 82) or [""]
+        lines.append(f"{tag:<4}- {wrapped[0]}")
+        lines.extend("      " + part for part in wrapped[1:])
+    return "\n".join(lines)
+
+def efetch_medline(pmids: list) -> str:
+    return "\n" + "\n\n".join(medline_record(p) for p in pmids if exists(p)) + "\n"
+
+def elink_json(pmids: list, combined: bool) -> dict:
+    def links_for(pmid):
+        rng = random.Random(seed_of("elink" + pmid))
+        neighbors = [{"id": pmid, "score": "100000000"}]
+        score = 90000000
+        for _ in range(30):
+            score -= rng.randint(100000, 3000000)
+            neighbors.append({"id": str(10000000 + rng.randint(0, 30000000)), "score": str(max(score, 1))})
+        return neighbors
+
+    groups = [pmids] if combined else [[p] for p in pmids]
+    linksets = []
+    for group in groups:
+        links = []
+        for pmid in group:
+            links.extend(links_for(pmid))
+        linksets.append({
+            "dbfrom": "pubmed",
+            "ids": group,
+            "linksetdbs": [{"dbto": "pubmed", "linkname": "pubmed_pubmed", "links": links}]
+        })
+    return {"header": {"type": "elink", "version": "0.3"}, "linksets": linksets}
+
+class MockState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.key_counts = {}
+        self.webenvs = {}
+        self.window = []
+
+    def count(self, endpoint: str, status: int, api_key: str = None):
+        with self.lock:
+            key = f"{endpoint}:{status}"
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if api_key:
+                self.key_counts[api_key] = self.key_counts.get(api_key, 0) + 1
+
+    def over_rate_limit(self) -> bool:
+        """Sliding one-second window, like NCBI's per-key limit"""
+        if not self.args.max_rps:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            self.window = [t for t in self.window if now - t < 1.0]
+            if len(self.window) >= self.args.max_rps:
+                return True
+            self.window.append(now)
+            return False
+
+    def stats(self) -> dict:
+        with self.lock:
+            by_endpoint = {}
+            for key, n in self.counts.items():
+                endpoint = key.split(":")[0]
+                by_endpoint[endpoint] = by_endpoint.get(endpoint, 0) + n
+            return {"total": sum(self.counts.values()), "by_endpoint": by_endpoint, "by_status": dict(self.counts),
+                    "by_key": dict(self.key_counts)}
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+            self.key_counts.clear()
+
+def make_handler(state: MockState):
+    args = state.args
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *log_args):
+            if args.verbose:
+                super().log_message(format, *log_args)
+
+        def send_body(self, status: int, body: bytes, content_type: str, headers: dict = None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if urlparse(self.path).path == "/reset":
+                state.reset()
+                self.send_body(200, b"{}", "application/json")
+            else:
+                self.send_body(404, b"not found", "text/plain")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/stats":
+                self.send_body(200, json.dumps(state.stats()).encode(), "application/json")
+                return
+
+            endpoint = url.path.rsplit("/", 1)[-1].replace(".fcgi", "")
+            query = parse_qs(url.query, keep_blank_values=True)
+            params = {k: v[-1] for k, v in query.items()}
+            api_key = params.get("api_key")
+            id_values = query.get("id", [])
+
+            delay = max(0.0, random.gauss(args.latency_ms, args.jitter_ms)) / 1000
+            if random.random() < args.slow_rate:
+                delay += args.slow_ms / 1000
+            if delay:
+                time.sleep(delay)
+
+            if state.over_rate_limit() or random.random() < args.rate_429:
+                state.count(endpoint, 429, api_key)
+                body = json.dumps({"error": "API rate limit exceeded", "count": str(args.max_rps + 1)}).encode()
+                self.send_body(429, body, "application/json", {"Retry-After": str(args.retry_after)})
+                return
+            if random.random() < args.error_rate:
+                state.count(endpoint, 503, api_key)
+                self.send_body(503, b"Service unavailable", "text/plain")
+                return
+
+            try:
+                status, body, content_type = self.respond(endpoint, params, id_values)
+            except Exception as e:
+                status, body, content_type = 500, str(e).encode(), "text/plain"
+            state.count(endpoint, status, api_key)
+            self.send_body(status, body, content_type)
+
+        def respond(self, endpoint: str, params: dict, id_values: list) -> tuple:
+            if args.fixtures:
+                for ext, content_type in (("json", "application/json"), ("xml", "text/xml"), ("txt", "text/plain")):
+                    path = os.path.join(args.fixtures, f"{endpoint}-{fixture_key(params)}.{ext}")
+                    if os.path.exists(path):
+                        with open(path, "rb") as f:
+                            return 200, f.read(), content_type
+
+            retstart = int(params.get("retstart", 0) or 0)
+            retmax = int(params.get("retmax", 20) or 20)
+            pmids = [p for v in id_values for p in v.split(",") if p]
+            if not pmids and params.get("WebEnv") and endpoint != "esearch":
+                term = state.webenvs.get(params["WebEnv"])
+                if term is None:
+                    # Unknown (expired) WebEnv: NCBI answers with an error document
+                    if endpoint == "efetch":
+                        return 200, b"<eFetchResult><ERROR>Unable to obtain query #1</ERROR></eFetchResult>", "text/xml"
+                    body = {"header": {"type": endpoint, "version": "0.3"}, "error": "Unable to obtain query #1"}
+                    return 200, json.dumps(body).encode(), "application/json"
+                _, pmids = search_ids(term, retstart, retmax)
+
+            if endpoint == "esearch":
+                term = params.get("term", "")
+                count, ids = search_ids(term, retstart, retmax)
+                result = {"count": str(count), "retmax": str(len(ids)), "retstart": str(retstart), "idlist": ids}
+                if params.get("usehistory") == "y":
+                    webenv = f"MCID_mock_{seed_of(term)}"
+                    state.webenvs[webenv] = term
+                    result.update(webenv=webenv, querykey="1")
+                return 200, json.dumps({"esearchresult": result}).encode(), "application/json"
+            if endpoint == "esummary":
+                return 200, json.dumps(esummary_json(pmids)).encode(), "application/json"
+            if endpoint == "efetch" and params.get("rettype") == "medline":
+                return 200, efetch_medline(pmids).encode(), "text/plain"
+            if endpoint == "efetch":
+                return 200, efetch_xml(pmids).encode(), "text/xml"
+            if endpoint == "elink":
+                combined = len(id_values) == 1
+                return 200, json.dumps(elink_json(pmids, combined)).encode(), "application/json"
+            return 404, b"unknown endpoint", "text/plain"
+
+    return Handler
+
+def start_mock_server(args, host: str = "127.0.0.1", port: int = 0):
+    """Start the mock server in a background thread; returns (server, base_url, state)"""
+    state = MockState(args)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://{host}:{server.server_address[1]}/entrez/eutils"
+    return server, base_url, state
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Mean upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=30.0, help="Latency standard deviation")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of requests delayed by --slow-ms (tail latency)")
+    parser.add_argument("--slow-ms", type=float, default=2000.0, help="Extra latency of slow requests")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--max-rps", type=int, default=0, help="Answer 429 above this many requests per second (0 = off)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429")
+    parser.add_argument("--fixtures", help="Directory of recorded responses")
+    parser.add_argument("--verbose", action="store_true")
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock NCBI E-utilities server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    server, base_url, _ = start_mock_server(args, args.host, args.port)
+    print(f"Mock E-utilities listening at {base_url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
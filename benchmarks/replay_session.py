@@ -0,0 +1,132 @@
+"""Replay a recorded session against server_stdio.py without network access.
+
+Run the server with PUBMED_CASSETTE_MODE=record and PUBMED_CASSETTE=<dir> to
+record a session: every E-utilities exchange and every tool call is written to
+the cassette. This script starts the server in replay mode on that cassette and
+sends the recorded tool calls again:
+
+    python benchmarks/replay_session.py pubmed-cassette
+    python benchmarks/replay_session.py pubmed-cassette --time-scale 0 --pace 0
+
+Upstream responses arrive after their recorded time multiplied by --time-scale
+(0 leaves only parsing and dispatch overhead). Tool calls are sent at their
+recorded offsets multiplied by --pace; with --pace 0 they are sent back to back,
+--concurrency at a time. Reports p50/p95 per tool for the recording and the
+replay; --json writes the report.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run_benchmark import SERVER_PATH, STDOUT_LIMIT, StdioClient, percentile  # noqa: E402
+
+def load_calls(path: str) -> list:
+    calls = []
+    with open(os.path.join(path, "log.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if entry.get("type") == "call":
+                    calls.append(entry)
+    return sorted(calls, key=lambda entry: entry["t"])
+
+def latency_summary(values: list) -> dict:
+    return {"count": len(values), "p50": round(percentile(values, 50), 1), "p95": round(percentile(values, 95), 1)}
+
+async def run(args) -> dict:
+    calls = load_calls(args.cassette)
+    env = dict(os.environ)
+    env.update({
+        "PUBMED_CASSETTE_MODE": "replay",
+        "PUBMED_CASSETTE": args.cassette,
+        "PUBMED_REPLAY_TIME_SCALE": str(args.time_scale),
+    })
+    if args.rate_limit is not None:
+        env["PUBMED_RATE_LIMIT"] = str(args.rate_limit)
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, SERVER_PATH,
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+        stderr=None if args.show_server_log else asyncio.subprocess.DEVNULL,
+        env=env, limit=STDOUT_LIMIT,
+    )
+    client = StdioClient(proc)
+    await client.request("initialize", {"protocolVersion": "2024-11-05", "capabilities": {}})
+    await client.notify("notifications/initialized")
+
+    replayed = {}
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency if args.pace == 0 else len(calls) or 1)
+    started = time.perf_counter()
+
+    async def send(entry):
+        nonlocal errors
+        delay = entry["t"] * args.pace - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with semaphore:
+            t0 = time.perf_counter()
+            response = await client.request("tools/call", {"name": entry["name"], "arguments": entry["arguments"]})
+            replayed.setdefault(entry["name"], []).append((time.perf_counter() - t0) * 1000)
+        if "error" in response:
+            errors += 1
+
+    await asyncio.gather(*(send(entry) for entry in calls))
+    elapsed = time.perf_counter() - started
+    stats = await client.request("tools/call", {"name": "server_stats", "arguments": {}})
+    cassette_stats = json.loads(stats["result"]["content"][0]["text"]).get("cassette")
+
+    proc.stdin.close()
+    await proc.wait()
+    client.reader_task.cancel()
+
+    recorded = {}
+    for entry in calls:
+        recorded.setdefault(entry["name"], []).append(entry["ms"])
+    return {
+        "calls": len(calls),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "time_scale": args.time_scale,
+        "pace": args.pace,
+        "cassette": cassette_stats,
+        "latency_ms": {
+            tool: {"recorded": latency_summary(recorded[tool]), "replayed": latency_summary(replayed.get(tool, []))}
+            for tool in sorted(recorded)
+        },
+    }
+
+def print_report(report: dict):
+    print(f"{report['calls']} calls replayed in {report['elapsed_s']} s "
+          f"(time scale {report['time_scale']}, pace {report['pace']}), {report['errors']} errors")
+    if report["cassette"]:
+        print(f"upstream: {report['cassette']['replayed']} replayed, {report['cassette']['misses']} not in cassette")
+    print(f"{'tool':<26}{'count':>7}{'rec p50':>10}{'rec p95':>10}{'new p50':>10}{'new p95':>10}")
+    for tool, stats in report["latency_ms"].items():
+        rec, new = stats["recorded"], stats["replayed"]
+        print(f"{tool:<26}{rec['count']:>7}{rec['p50']:>10}{rec['p95']:>10}{new['p50']:>10}{new['p95']:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded session against server_stdio.py")
+    parser.add_argument("cassette", help="Cassette directory written with PUBMED_CASSETTE_MODE=record")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiplier for recorded upstream response times")
+    parser.add_argument("--pace", type=float, default=1.0, help="Multiplier for the recorded tool call offsets")
+    parser.add_argument("--concurrency", type=int, default=8, help="Tool calls kept in flight with --pace 0")
+    parser.add_argument("--rate-limit", type=float, help="PUBMED_RATE_LIMIT passed to the server")
+    parser.add_argument("--show-server-log", action="store_true")
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if report["errors"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""End-to-end latency/throughput benchmark for server_stdio.py.
+
+Starts the mock E-utilities server (or uses --eutils-url), launches
+server_stdio.py as a subprocess and drives it over stdio with a mixed JSON-RPC
+workload at a fixed concurrency level:
+
+    python benchmarks/run_benchmark.py --requests 200 --concurrency 8 --latency-ms 100
+
+Reports p50/p95/p99 latency per tool, requests per second, upstream calls per
+tool call and the server's peak RSS. --json writes the report for CI, and
+--max-p95-ms / --max-upstream-per-call make the run fail on regressions.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_eutils import add_mock_arguments, start_mock_server  # noqa: E402
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server_stdio.py")
+# Stream buffer for the server's stdout: one JSON-RPC response per line, and exports can exceed asyncio's 64 KiB default
+STDOUT_LIMIT = 16 * 1024 * 1024
+
+QUERIES = [
+    "parkinson disease levodopa", "epilepsy surgery outcome", "multiple sclerosis ocrelizumab",
+    "stroke thrombectomy", "migraine CGRP", "amyotrophic lateral sclerosis tofersen",
+    "alzheimer lecanemab", "deep brain stimulation", "essential tremor", "myasthenia gravis",
+]
+
+# Tool mix: (tool name, weight)
+DEFAULT_MIX = "search_pubmed=4,get_paper_details=4,advanced_search_pubmed=1,get_similar_articles=1,get_papers_details=1,export_citations=1"
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+class Workload:
+    """Generates tool calls; PMIDs repeat with the configured probability"""
+
+    def __init__(self, mix: str, repeat_rate: float, seed: int):
+        self.rng = random.Random(seed)
+        self.tools = []
+        self.weights = []
+        for part in mix.split(","):
+            name, _, weight = part.partition("=")
+            self.tools.append(name.strip())
+            self.weights.append(float(weight or 1))
+        self.repeat_rate = repeat_rate
+        self.seen_pmids = []
+
+    def pmid(self) -> str:
+        if self.seen_pmids and self.rng.random() < self.repeat_rate:
+            return self.rng.choice(self.seen_pmids)
+        pmid = str(10000000 + self.rng.randint(0, 30000000))
+        self.seen_pmids.append(pmid)
+        return pmid
+
+    def next_call(self) -> tuple:
+        tool = self.rng.choices(self.tools, self.weights)[0]
+        if tool == "search_pubmed":
+            args = {"query": self.rng.choice(QUERIES), "max_results": self.rng.choice([5, 10, 20])}
+        elif tool == "advanced_search_pubmed":
+            args = {"query": self.rng.choice(QUERIES), "pub_date_from": "2018/01/01", "max_results": 10}
+        elif tool == "batch_search":
+            args = {"queries": self.rng.sample(QUERIES, self.rng.randint(2, 5)), "max_results": 10}
+        elif tool == "get_paper_details":
+            args = {"pmid": self.pmid()}
+        elif tool == "get_papers_details":
+            args = {"pmids": [self.pmid() for _ in range(self.rng.randint(10, 50))]}
+        elif tool == "export_citations":
+            args = {"pmids": [self.pmid() for _ in range(self.rng.randint(10, 50))],
+                    "citation_format": self.rng.choice(["ris", "bibtex", "csl-json", "medline"])}
+        elif tool == "get_similar_articles":
+            args = {"pmid": self.pmid(), "max_results": 5, "high_impact_only": self.rng.random() < 0.5}
+        else:
+            args = {}
+        return tool, args
+
+class StdioClient:
+    """Minimal JSON-RPC client for a server subprocess; responses are matched by id"""
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.next_id = 0
+        self.pending = {}
+        self.reader_task = asyncio.create_task(self._read())
+
+    async def _read(self):
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            future = self.pending.pop(message.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(message)
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("server exited"))
+
+    async def request(self, method: str, params: dict = None) -> dict:
+        self.next_id += 1
+        msg_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[msg_id] = future
+        message = {"jsonrpc": "2.0", "id": msg_id, "method": method, "params": params or {}}
+        self.proc.stdin.write((json.dumps(message) + "\n").encode())
+        await self.proc.stdin.drain()
+        return await future
+
+    async def notify(self, method: str, params: dict = None):
+        message = {"jsonrpc": "2.0", "method": method, "params": params or {}}
+        self.proc.stdin.write((json.dumps(message) + "\n").encode())
+        await self.proc.stdin.drain()
+
+def mock_stats(base_url: str) -> dict:
+    root = base_url.split("/entrez/")[0]
+    with urllib.request.urlopen(f"{root}/stats", timeout=5) as resp:
+        return json.load(resp)
+
+def mock_reset(base_url: str):
+    root = base_url.split("/entrez/")[0]
+    urllib.request.urlopen(urllib.request.Request(f"{root}/reset", method="POST"), timeout=5).close()
+
+async def run(args) -> dict:
+    server = None
+    if args.eutils_url:
+        base_url = args.eutils_url
+    else:
+        server, base_url, _ = start_mock_server(args)
+
+    env = dict(os.environ)
+    env.update({
+        "PUBMED_EUTILS_BASE_URL": base_url,
+        "PUBMED_CACHE_PATH": "",
+        "PUBMED_RATE_LIMIT": str(args.rate_limit),
+    })
+    env.update(dict(item.split("=", 1) for item in args.server_env))
+
+    started = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, SERVER_PATH,
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+        stderr=None if args.show_server_log else asyncio.subprocess.DEVNULL,
+        env=env, limit=STDOUT_LIMIT,
+    )
+    client = StdioClient(proc)
+    await client.request("initialize", {"protocolVersion": "2024-11-05", "capabilities": {}})
+    initialize_ms = (time.perf_counter() - started) * 1000
+    await client.notify("notifications/initialized")
+
+    try:
+        mock_reset(base_url)
+    except OSError:
+        pass  # external upstream without /reset
+
+    workload = Workload(args.mix, args.repeat_rate, args.seed)
+    calls = [workload.next_call() for _ in range(args.requests)]
+    latencies = {}
+    errors = 0
+    queue = asyncio.Queue()
+    for call in calls:
+        queue.put_nowait(call)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            tool, tool_args = queue.get_nowait()
+            t0 = time.perf_counter()
+            response = await client.request("tools/call", {"name": tool, "arguments": tool_args})
+            latencies.setdefault(tool, []).append((time.perf_counter() - t0) * 1000)
+            if "error" in response:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    try:
+        upstream = mock_stats(base_url)
+    except OSError:
+        upstream = None
+
+    proc.stdin.close()
+    await proc.wait()
+    client.reader_task.cancel()
+    if server is not None:
+        server.shutdown()
+
+    # ru_maxrss of waited-for children: kilobytes on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+    all_latencies = [v for values in latencies.values() for v in values]
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(args.requests / elapsed, 2) if elapsed else 0.0,
+        "initialize_ms": round(initialize_ms, 1),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "latency_ms": {
+            tool: {
+                "count": len(values),
+                "p50": round(percentile(values, 50), 1),
+                "p95": round(percentile(values, 95), 1),
+                "p99": round(percentile(values, 99), 1),
+            }
+            for tool, values in sorted(latencies.items()) + [("all", all_latencies)]
+        },
+    }
+    if upstream is not None:
+        report["upstream"] = upstream
+        report["upstream_per_call"] = round(upstream["total"] / args.requests, 3)
+    return report
+
+def print_report(report: dict):
+    print(f"{report['requests']} calls at concurrency {report['concurrency']}: "
+          f"{report['requests_per_s']} req/s, {report['errors']} errors, "
+          f"initialize {report['initialize_ms']} ms, peak RSS {report['peak_rss_mb']} MB")
+    print(f"{'tool':<26}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for tool, stats in report["latency_ms"].items():
+        print(f"{tool:<26}{stats['count']:>7}{stats['p50']:>10}{stats['p95']:>10}{stats['p99']:>10}")
+    if "upstream" in report:
+        print(f"upstream calls: {report['upstream']['total']} "
+              f"({report['upstream_per_call']} per tool call) {report['upstream']['by_endpoint']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark server_stdio.py against a mock E-utilities server")
+    parser.add_argument("--requests", type=int, default=200, help="Tool calls to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="Tool calls kept in flight")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Comma-separated tool=weight list")
+    parser.add_argument("--repeat-rate", type=float, default=0.3, help="Probability a PMID is reused")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rate-limit", type=float, default=1000.0, help="PUBMED_RATE_LIMIT passed to the server")
+    parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra environment variable for the server (repeatable)")
+    parser.add_argument("--eutils-url", help="Use an already running upstream instead of the built-in mock")
+    parser.add_argument("--show-server-log", action="store_true")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--max-p95-ms", type=float, help="Fail if overall p95 latency exceeds this")
+    parser.add_argument("--max-upstream-per-call", type=float, help="Fail if upstream calls per tool call exceed this")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = []
+    if args.max_p95_ms is not None and report["latency_ms"]["all"]["p95"] > args.max_p95_ms:
+        failed.append(f"p95 {report['latency_ms']['all']['p95']} ms > {args.max_p95_ms} ms")
+    if args.max_upstream_per_call is not None and report.get("upstream_per_call", 0) > args.max_upstream_per_call:
+        failed.append(f"upstream/call {report['upstream_per_call']} > {args.max_upstream_per_call}")
+    if report["errors"]:
+        failed.append(f"{report['errors']} tool calls returned errors")
+    if failed:
+        print("FAILED: " + "; ".join(failed), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Cold-start benchmark for server_stdio.py.
+
+Launches the server repeatedly and measures, from process start, how long the
+first `initialize` and `tools/list` responses take:
+
+    python benchmarks/startup_benchmark.py --runs 20 [--module]
+
+--json writes the report for CI and --max-initialize-ms fails the run when the
+median time to `initialize` exceeds the limit. --importtime prints the slowest
+module imports of one extra launch (python -X importtime).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server_stdio.py")
+
+INITIALIZE = {"jsonrpc": "2.0", "id": 1, "method": "initialize",
+              "params": {"protocolVersion": "2024-11-05", "capabilities": {}}}
+INITIALIZED = {"jsonrpc": "2.0", "method": "notifications/initialized"}
+TOOLS_LIST = {"jsonrpc": "2.0", "id": 2, "method": "tools/list"}
+
+def send(proc, message: dict):
+    proc.stdin.write((json.dumps(message) + "\n").encode())
+    proc.stdin.flush()
+
+def launch_once(env: dict, module: bool = False) -> dict:
+    # `python -m server_stdio` reuses cached bytecode; a script path is recompiled on every launch
+    command = [sys.executable, "-m", "server_stdio"] if module else [sys.executable, SERVER_PATH]
+    started = time.perf_counter()
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            cwd=os.path.dirname(SERVER_PATH), env=env)
+    try:
+        send(proc, INITIALIZE)
+        json.loads(proc.stdout.readline())
+        initialize_ms = (time.perf_counter() - started) * 1000
+        send(proc, INITIALIZED)
+        t0 = time.perf_counter()
+        send(proc, TOOLS_LIST)
+        tools = json.loads(proc.stdout.readline())["result"]["tools"]
+        tools_list_ms = (time.perf_counter() - t0) * 1000
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    return {"initialize_ms": initialize_ms, "tools_list_ms": tools_list_ms, "tools": len(tools)}
+
+def summarize(values: list) -> dict:
+    ordered = sorted(values)
+    return {
+        "median": round(statistics.median(ordered), 2),
+        "p95": round(ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))], 2),
+        "max": round(ordered[-1], 2),
+    }
+
+def print_importtime(env: dict, top: int):
+    """Print the slowest cumulative imports of one launch"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server_stdio"],
+                          cwd=os.path.dirname(SERVER_PATH), env=env, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative / 1000:>9.1f} ms  {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure server_stdio.py cold-start latency")
+    parser.add_argument("--runs", type=int, default=10, help="Server launches to measure")
+    parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Extra environment variable for the server (repeatable)")
+    parser.add_argument("--module", action="store_true", help="Launch with python -m server_stdio")
+    parser.add_argument("--importtime", action="store_true", help="Also show the slowest imports")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--max-initialize-ms", type=float, help="Fail if median time to initialize exceeds this")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.update(dict(item.split("=", 1) for item in args.server_env))
+
+    launch_once(env, args.module)  # warm the OS file cache and bytecode caches
+    samples = [launch_once(env, args.module) for _ in range(args.runs)]
+    report = {
+        "runs": args.runs,
+        "initialize_ms": summarize([s["initialize_ms"] for s in samples]),
+        "tools_list_ms": summarize([s["tools_list_ms"] for s in samples]),
+        "tools": samples[0]["tools"],
+    }
+    print(f"{args.runs} launches: initialize {report['initialize_ms']} ms from process start, "
+          f"tools/list {report['tools_list_ms']} ms ({report['tools']} tools)")
+    if args.importtime:
+        print_importtime(env, 15)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.max_initialize_ms is not None and report["initialize_ms"]["median"] > args.max_initialize_ms:
+        print(f"FAILED: median initialize {report['initialize_ms']['median']} ms > {args.max_initialize_ms} ms",
+              file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
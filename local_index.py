@@ -0,0 +1,408 @@
+"""Offline PubMed index built from NLM baseline/update XML dumps.
+
+Build or update an index (files are applied in the order given; already
+applied files are skipped unless --force is used):
+
+    python local_index.py ingest --db pubmed_index.sqlite3 pubmed25n0001.xml.gz ...
+
+Then start the server with PUBMED_BACKEND=local and PUBMED_LOCAL_INDEX pointing
+at the database to serve search_pubmed, advanced_search_pubmed and
+get_paper_details without network access.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger("pubmed-mcp")
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    pmid INTEGER PRIMARY KEY,
+    title TEXT,
+    abstract TEXT,
+    authors TEXT,
+    author_names TEXT,
+    journal TEXT,
+    source TEXT,
+    pubdate TEXT,
+    sortdate TEXT,
+    doi TEXT,
+    pmc_id TEXT,
+    pub_types TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+    title, abstract, authors, journal,
+    content='articles', content_rowid='pmid'
+);
+CREATE TRIGGER IF NOT EXISTS articles_ai AFTER INSERT ON articles BEGIN
+    INSERT INTO articles_fts(rowid, title, abstract, authors, journal)
+    VALUES (new.pmid, new.title, new.abstract, new.author_names, new.journal || ' ' || new.source);
+END;
+CREATE TRIGGER IF NOT EXISTS articles_ad AFTER DELETE ON articles BEGIN
+    INSERT INTO articles_fts(articles_fts, rowid, title, abstract, authors, journal)
+    VALUES ('delete', old.pmid, old.title, old.abstract, old.author_names, old.journal || ' ' || old.source);
+END;
+CREATE INDEX IF NOT EXISTS articles_sortdate ON articles(sortdate);
+CREATE TABLE IF NOT EXISTS applied_files (
+    name TEXT PRIMARY KEY,
+    applied_at REAL,
+    upserted INTEGER,
+    deleted INTEGER
+);
+"""
+
+# Maps PubMed field tags to FTS columns
+FIELD_TAGS = {
+    "ti": "title", "title": "title",
+    "tiab": None, "title/abstract": None, "ab": "abstract", "abstract": "abstract",
+    "au": "authors", "author": "authors",
+    "ta": "journal", "journal": "journal",
+}
+
+QUERY_TOKEN_RE = re.compile(r'"[^"]*"(?:\[[^\]]*\])?|\(|\)|[^\s()]+')
+
+# --- Parsing ---
+
+def element_text(elem) -> str:
+    """Full text of an element including inline markup such as <i> or <sup>"""
+    if elem is None:
+        return ""
+    return "".join(elem.itertext())
+
+def parse_pubdate(pub_date) -> tuple:
+    """Return (display date like '2020 Jan 5', sortable 'YYYY/MM/DD') from a PubDate element"""
+    if pub_date is None:
+        return "", ""
+    medline_date = pub_date.findtext("MedlineDate")
+    if medline_date:
+        year = re.search(r"\d{4}", medline_date)
+        return medline_date, f"{year.group(0)}/01/01" if year else ""
+
+    year = pub_date.findtext("Year", "")
+    month = pub_date.findtext("Month", "")
+    day = pub_date.findtext("Day", "")
+    display = " ".join(part for part in (year, month, day) if part)
+    month_num = MONTHS.get(month[:3].lower()) if month and not month.isdigit() else (int(month) if month else 1)
+    sortdate = f"{year}/{month_num or 1:02d}/{int(day) if day.isdigit() else 1:02d}" if year else ""
+    return display, sortdate
+
+def parse_record(pubmed_article) -> dict:
+    """Extract the indexed fields from a PubmedArticle element"""
+    citation = pubmed_article.find("MedlineCitation")
+    article = citation.find("Article")
+
+    authors = []
+    author_names = []
+    for auth in article.findall("AuthorList/Author"):
+        last_name = auth.findtext("LastName")
+        if last_name:
+            fore_name = auth.findtext("ForeName")
+            if fore_name:
+                authors.append(f"{last_name} {fore_name}")
+            initials = auth.findtext("Initials")
+            author_names.append(f"{last_name} {initials}" if initials else last_name)
+        elif auth.findtext("CollectiveName"):
+            author_names.append(auth.findtext("CollectiveName"))
+
+    doi = None
+    pmc_id = None
+    for article_id in pubmed_article.findall("PubmedData/ArticleIdList/ArticleId"):
+        id_type = article_id.get("IdType")
+        if id_type == "doi":
+            doi = article_id.text
+        elif id_type == "pmc":
+            pmc_id = article_id.text
+
+    pubdate, sortdate = parse_pubdate(article.find("Journal/JournalIssue/PubDate"))
+    source = (citation.findtext("MedlineJournalInfo/MedlineTA")
+              or article.findtext("Journal/ISOAbbreviation", ""))
+
+    return {
+        "pmid": int(citation.findtext("PMID").strip()),
+        "title": element_text(article.find("ArticleTitle")),
+        "abstract": "\n".join(element_text(a) for a in article.findall("Abstract/AbstractText")),
+        "authors": json.dumps(authors, ensure_ascii=False),
+        "author_names": ", ".join(author_names),
+        "journal": article.findtext("Journal/Title", ""),
+        "source": source,
+        "pubdate": pubdate,
+        "sortdate": sortdate,
+        "doi": doi,
+        "pmc_id": pmc_id,
+        "pub_types": json.dumps([pt.text for pt in article.findall("PublicationTypeList/PublicationType")]),
+    }
+
+def iter_dump(fileobj):
+    """Stream ('upsert', record) and ('delete', pmid) events from a PubMed XML dump in constant memory"""
+    root = None
+    for event, elem in ET.iterparse(fileobj, events=("start", "end")):
+        if root is None:
+            root = elem
+            continue
+        if event != "end":
+            continue
+        if elem.tag == "PubmedArticle":
+            try:
+                yield "upsert", parse_record(elem)
+            except (AttributeError, ValueError) as e:
+                logger.warning(f"Skipping malformed record: {e}")
+            root.clear()
+        elif elem.tag == "DeleteCitation":
+            for pmid in elem.findall("PMID"):
+                yield "delete", int(pmid.text.strip())
+            root.clear()
+
+def open_dump(path: str):
+    """Open a dump file, transparently decompressing .gz"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+# --- Index ---
+
+def to_fts_query(query: str) -> str:
+    """Translate a PubMed-style query (AND/OR/NOT, quotes, field tags, trailing *) into FTS5 syntax"""
+    parts = []
+    for token in QUERY_TOKEN_RE.findall(query or ""):
+        if token in ("(", ")") or token in ("AND", "OR", "NOT"):
+            parts.append(token)
+            continue
+        column = None
+        tag = re.search(r"\[([^\]]*)\]$", token)
+        if tag:
+            token = token[:tag.start()]
+            column = FIELD_TAGS.get(tag.group(1).strip().lower())
+        prefix = token.endswith("*")
+        term = token.rstrip("*").strip('"').replace('"', "")
+        if not term:
+            continue
+        expr = f'"{term}"' + (" *" if prefix else "")
+        parts.append(f"{column} : {expr}" if column else expr)
+    # Drop dangling operators left behind by skipped tokens
+    while parts and parts[-1] in ("AND", "OR", "NOT"):
+        parts.pop()
+    # Balance parentheses
+    depth = 0
+    balanced = []
+    for part in parts:
+        if part == ")":
+            if depth == 0:
+                continue
+            depth -= 1
+        elif part == "(":
+            depth += 1
+        balanced.append(part)
+    return " ".join(balanced + [")"] * depth)
+
+def to_plain_fts_query(query: str) -> str:
+    """Fallback for queries FTS5 cannot parse: all words, implicitly ANDed"""
+    words = re.findall(r"\w+", re.sub(r"\[[^\]]*\]|\b(AND|OR|NOT)\b", " ", query or ""))
+    return " ".join(f'"{w}"' for w in words)
+
+class LocalIndex:
+    """SQLite FTS5 index of PubMed records"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # Ingestion
+
+    def is_applied(self, name: str) -> bool:
+        row = self.conn.execute("SELECT 1 FROM applied_files WHERE name = ?", (name,)).fetchone()
+        return row is not None
+
+    def apply_dump(self, fileobj, name: str, batch_size: int = 1000) -> tuple:
+        """Apply one baseline or update file inside a single transaction. Returns (upserted, deleted)."""
+        upserted = 0
+        deleted = 0
+        batch = []
+
+        def flush():
+            # Delete first so the FTS delete trigger sees the old row, then insert the new version
+            self.conn.executemany("DELETE FROM articles WHERE pmid = ?", [(r["pmid"],) for r in batch])
+            self.conn.executemany(
+                "INSERT INTO articles VALUES (:pmid, :title, :abstract, :authors, :author_names, :journal,"
+                " :source, :pubdate, :sortdate, :doi, :pmc_id, :pub_types)",
+                batch
+            )
+            batch.clear()
+
+        with self.lock, self.conn:
+            for action, value in iter_dump(fileobj):
+                if action == "upsert":
+                    batch.append(value)
+                    upserted += 1
+                    if len(batch) >= batch_size:
+                        flush()
+                else:
+                    # Keep ordering: pending upserts must land before a later deletion of the same PMID
+                    if batch:
+                        flush()
+                    deleted += self.conn.execute("DELETE FROM articles WHERE pmid = ?", (value,)).rowcount
+            if batch:
+                flush()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO applied_files VALUES (?, ?, ?, ?)",
+                (name, time.time(), upserted, deleted)
+            )
+        return upserted, deleted
+
+    def apply_file(self, path: str, force: bool = False):
+        """Apply a dump file by path; returns None if it was already applied"""
+        name = os.path.basename(path)
+        if not force and self.is_applied(name):
+            return None
+        with open_dump(path) as f:
+            return self.apply_dump(f, name)
+
+    # Queries
+
+    def search(self, query: str = "", author: str = None, journal: str = None,
+               date_from: str = None, date_to: str = None, pub_types: list = None,
+               limit: int = 20, offset: int = 0) -> tuple:
+        """Full-text search ranked by bm25. Returns (total_count, [pmid, ...]).
+
+        pub_types keeps articles with at least one of the given publication types.
+        """
+        try:
+            return self._search(to_fts_query(query), author, journal, date_from, date_to, pub_types, limit, offset)
+        except sqlite3.OperationalError as e:
+            logger.info(f"Falling back to plain-word query for {query!r}: {e}")
+            return self._search(to_plain_fts_query(query), author, journal, date_from, date_to, pub_types, limit, offset)
+
+    def _search(self, fts_query, author, journal, date_from, date_to, pub_types, limit, offset) -> tuple:
+        clauses = []
+        if fts_query:
+            clauses.append(f"({fts_query})")
+        if author:
+            clauses.append('authors : "{}"'.format(author.replace('"', "")))
+        if journal:
+            clauses.append('journal : "{}"'.format(journal.replace('"', "")))
+        match = " AND ".join(clauses)
+
+        where = []
+        args = []
+        if match:
+            where.append("articles_fts MATCH ?")
+            args.append(match)
+        if date_from:
+            where.append("a.sortdate >= ?")
+            args.append(date_from.replace("-", "/"))
+        if date_to:
+            date_to = date_to.replace("-", "/")
+            # "2024" or "2024/05" should include the whole year or month
+            if len(date_to) < 10:
+                date_to += "/99"
+            where.append("a.sortdate <= ?")
+            args.append(date_to)
+        if pub_types:
+            placeholders = ",".join("?" * len(pub_types))
+            where.append(f"EXISTS (SELECT 1 FROM json_each(a.pub_types) WHERE value IN ({placeholders}))")
+            args.extend(pub_types)
+        if not where:
+            return 0, []
+
+        joins = "FROM articles_fts JOIN articles a ON a.pmid = articles_fts.rowid" if match else "FROM articles a"
+        condition = " AND ".join(where)
+        order = "bm25(articles_fts)" if match else "a.sortdate DESC"
+        with self.lock:
+            count = self.conn.execute(f"SELECT count(*) {joins} WHERE {condition}", args).fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT a.pmid {joins} WHERE {condition} ORDER BY {order} LIMIT ? OFFSET ?",
+                args + [limit, offset]
+            ).fetchall()
+        return count, [str(row[0]) for row in rows]
+
+    def _rows(self, pmids: list) -> dict:
+        ids = [int(p) for p in pmids if str(p).isdigit()]
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self.lock:
+            rows = self.conn.execute(f"SELECT * FROM articles WHERE pmid IN ({placeholders})", ids).fetchall()
+        return {str(row["pmid"]): row for row in rows}
+
+    def summaries(self, pmids: list) -> dict:
+        """Return esummary-shaped records keyed by PMID"""
+        result = {}
+        for pmid, row in self._rows(pmids).items():
+            result[pmid] = {
+                "uid": pmid,
+                "title": row["title"],
+                "pubdate": row["pubdate"],
+                "source": row["source"],
+                "authors": [{"name": name, "authtype": "Author"} for name in row["author_names"].split(", ") if name],
+                "pubtype": json.loads(row["pub_types"]),
+            }
+        return result
+
+    def details(self, pmids: list) -> dict:
+        """Return get_paper_details-shaped records keyed by PMID"""
+        result = {}
+        for pmid, row in self._rows(pmids).items():
+            links = {"pubmed": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"}
+            if row["pmc_id"]:
+                links["pmc"] = f"https://www.ncbi.nlm.nih.gov/pmc/articles/{row['pmc_id']}/"
+            if row["doi"]:
+                links["doi"] = f"https://doi.org/{row['doi']}"
+            result[pmid] = {
+                "pmid": pmid,
+                "title": row["title"] or "No title",
+                "authors": json.loads(row["authors"]),
+                "journal": row["journal"],
+                "doi": row["doi"],
+                "pmc_id": row["pmc_id"],
+                "abstract": row["abstract"],
+                "links": links
+            }
+        return result
+
+# --- CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a local PubMed index from NLM XML dumps")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest = sub.add_parser("ingest", help="Apply baseline/update .xml.gz files to the index")
+    ingest.add_argument("files", nargs="+", help="Dump files, applied in the given order")
+    ingest.add_argument("--db", default=os.environ.get("PUBMED_LOCAL_INDEX", "pubmed_index.sqlite3"))
+    ingest.add_argument("--force", action="store_true", help="Re-apply files that were already applied")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s - %(levelname)s - %(message)s')
+    index = LocalIndex(args.db)
+    try:
+        for path in args.files:
+            started = time.monotonic()
+            result = index.apply_file(path, force=args.force)
+            if result is None:
+                logger.info(f"Skipping {path} (already applied)")
+            else:
+                logger.info(f"Applied {path}: {result[0]} upserted, {result[1]} deleted "
+                            f"in {time.monotonic() - started:.1f}s")
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
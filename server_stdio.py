@@ -1,499 +1,3668 @@
+from __future__ import annotations
+
 import sys
 import json
 import asyncio
-import httpx
-import xmltodict
 import logging
 import os
+import argparse
+import io
+import base64
+import random
+import re
+import time
+import sqlite3
+import hashlib
+import zlib
+import threading
+import contextvars
+import signal
+import itertools
+import uuid
+from collections import Counter, OrderedDict, deque
 
 # Configure logging to stderr so it doesn't interfere with stdout JSON-RPC
 logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("pubmed-mcp")
 
-BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
-API_KEY = os.environ.get("NCBI_API_KEY")
+# Override to point at a mirror or the mock server in benchmarks/
+BASE_URL = os.environ.get("PUBMED_EUTILS_BASE_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils").rstrip("/")
+API_KEY = os.environ.get("NCBI_API_KEY")
+# Optional comma-separated list of extra keys; load is spread across all of them
+API_KEYS = [k.strip() for k in os.environ.get("NCBI_API_KEYS", "").split(",") if k.strip()]
+if API_KEY and API_KEY not in API_KEYS:
+    API_KEYS.insert(0, API_KEY)
+if not API_KEY and API_KEYS:
+    API_KEY = API_KEYS[0]
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment"""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        logger.warning(f"Invalid value for {name}, using default {default}")
+        return default
+
+def env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment"""
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        logger.warning(f"Invalid value for {name}, using default {default}")
+        return default
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """Read a boolean setting from the environment"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def get_params(base_params: dict) -> dict:
+    """Helper to add API key to params if available"""
+    if API_KEY:
+        base_params["api_key"] = API_KEY
+    return base_params
+
+# --- Metrics ---
+
+# Write a metrics snapshot here at exit and on SIGUSR1 (".prom" = Prometheus text, otherwise JSON)
+METRICS_DUMP_PATH = os.environ.get("PUBMED_METRICS_DUMP")
+
+# Upper bounds (ms) of the histogram buckets
+HISTOGRAM_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float("inf"))
+
+# Tool currently being served; inherited by every task the tool call spawns
+current_tool = contextvars.ContextVar("current_tool", default="")
+
+class Histogram:
+    """Fixed-bucket latency histogram: O(buckets) memory, approximate quantiles"""
+
+    def __init__(self):
+        self.counts = [0] * len(HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation inside the bucket that contains it"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, n in zip(HISTOGRAM_BUCKETS, self.counts):
+            if n and seen + n >= rank:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = bound
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 2) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 2),
+            "p95": round(self.quantile(0.95), 2),
+            "p99": round(self.quantile(0.99), 2),
+            "max": round(self.max, 2),
+        }
+
+class Metrics:
+    """Counters and histograms keyed by (name, sorted labels)"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        # Label values are kept as text so that e.g. status=200 and status="ReadTimeout" sort together
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value_ms: float, **labels):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value_ms)
+
+    def histogram(self, name: str, **labels):
+        return self.histograms.get(self._key(name, labels))
+
+    def timer(self, name: str, **labels):
+        return MetricsTimer(self, name, labels)
+
+    @staticmethod
+    def _label_text(labels: tuple) -> str:
+        return ",".join(f"{k}={v}" for k, v in labels)
+
+    def snapshot(self) -> dict:
+        counters = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            counters.setdefault(name, {})[self._label_text(labels) or "total"] = value
+        histograms = {}
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            histograms.setdefault(name, {})[self._label_text(labels) or "all"] = histogram.summary()
+        return {"uptime_s": round(time.time() - self.started, 1), "counters": counters, "histograms_ms": histograms}
+
+    def prometheus(self) -> str:
+        """Render counters and histograms in the Prometheus text exposition format"""
+        def label_str(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"pubmed_{name}{label_str(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, n in zip(HISTOGRAM_BUCKETS, histogram.counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else str(bound)
+                lines.append(f"pubmed_{name}_bucket{label_str(labels, [('le', le)])} {cumulative}")
+            lines.append(f"pubmed_{name}_sum{label_str(labels)} {histogram.total}")
+            lines.append(f"pubmed_{name}_count{label_str(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+class MetricsTimer:
+    """Context manager that records elapsed milliseconds into a histogram"""
+
+    def __init__(self, metrics: Metrics, name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, (time.perf_counter() - self.start) * 1000, **self.labels)
+        return False
+
+metrics = Metrics()
+
+# --- Shared HTTP client ---
+
+# Connection pool settings (one keep-alive pool shared by every tool call)
+HTTP_MAX_CONNECTIONS = env_int("PUBMED_HTTP_MAX_CONNECTIONS", 10)
+HTTP_MAX_KEEPALIVE = env_int("PUBMED_HTTP_MAX_KEEPALIVE", 10)
+HTTP_KEEPALIVE_EXPIRY = env_float("PUBMED_HTTP_KEEPALIVE_EXPIRY", 30.0)
+HTTP2_ENABLED = env_bool("PUBMED_HTTP2")
+
+# Per-phase timeouts in seconds
+HTTP_CONNECT_TIMEOUT = env_float("PUBMED_HTTP_CONNECT_TIMEOUT", 5.0)
+HTTP_READ_TIMEOUT = env_float("PUBMED_HTTP_READ_TIMEOUT", 30.0)
+HTTP_WRITE_TIMEOUT = env_float("PUBMED_HTTP_WRITE_TIMEOUT", 10.0)
+HTTP_POOL_TIMEOUT = env_float("PUBMED_HTTP_POOL_TIMEOUT", 10.0)
+
+_http_client = None
+
+# httpx is imported on first use so that initialize/tools/list never pay for it
+httpx = None
+
+def load_httpx():
+    global httpx
+    if httpx is None:
+        import httpx as module
+        httpx = module
+    return httpx
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create the pooled AsyncClient used for all E-utilities requests"""
+    load_httpx()
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("PUBMED_HTTP2 is set but the 'h2' package is not installed; falling back to HTTP/1.1")
+            http2 = False
+
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+    timeout = httpx.Timeout(
+        connect=HTTP_CONNECT_TIMEOUT,
+        read=HTTP_READ_TIMEOUT,
+        write=HTTP_WRITE_TIMEOUT,
+        pool=HTTP_POOL_TIMEOUT
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared AsyncClient, creating it on first use"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = create_http_client()
+    return _http_client
+
+async def close_http_client():
+    """Close the shared AsyncClient and release pooled connections"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+# --- Rate limiting and retries ---
+
+# NCBI allows 3 requests/second without an API key and 10 with one (per key)
+RATE_LIMIT = env_float("PUBMED_RATE_LIMIT", 10.0 if API_KEYS else 3.0)
+RATE_BURST = env_float("PUBMED_RATE_BURST", 1.0)
+
+# Retry settings for 429, 5xx and transport errors
+MAX_RETRIES = env_int("PUBMED_MAX_RETRIES", 3)
+BACKOFF_BASE = env_float("PUBMED_BACKOFF_BASE", 0.5)
+BACKOFF_MAX = env_float("PUBMED_BACKOFF_MAX", 8.0)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class EutilsError(Exception):
+    """Raised when an E-utilities request fails after all retries"""
+
+class EutilsResponseError(EutilsError):
+    """Raised when NCBI answers with an error document in place of results"""
+
+class DeadlineExceeded(EutilsError):
+    """Raised when the tool call's deadline passes before an upstream request completes"""
+
+# Time budget in seconds for one tools/call, shared by every upstream request it makes (0 = none)
+TOOL_DEADLINE = env_float("PUBMED_TOOL_DEADLINE", 30.0)
+
+# Loop time by which the current tool call must finish; inherited by every task it spawns
+request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+def deadline_after(seconds: float):
+    """Deadline value for request_deadline, or None when seconds is 0 (no deadline)"""
+    return asyncio.get_running_loop().time() + seconds if seconds > 0 else None
+
+def time_left():
+    """Seconds until the current deadline, or None without one"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - asyncio.get_running_loop().time()
+
+async def within_deadline(awaitable, what: str):
+    """Await awaitable, raising DeadlineExceeded if the current deadline passes first"""
+    remaining = time_left()
+    if remaining is None:
+        return await awaitable
+    if remaining <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded(f"Deadline exceeded before {what}")
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Deadline exceeded waiting for {what}") from None
+
+class TokenBucket:
+    """Async token bucket. Tokens are reserved up front, so waiters are served in FIFO order."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token would be available, without reserving it"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reserve(self) -> float:
+        """Reserve one token and return how long the caller must wait before using it"""
+        wait = self.wait_time()
+        self.tokens -= 1
+        return wait
+
+    def pause(self, seconds: float):
+        """Push back the next available token, e.g. after a 429"""
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+class RateLimiter:
+    """Global limiter with one token bucket per API key (or one anonymous bucket)"""
+
+    def __init__(self, api_keys: list, rate: float = RATE_LIMIT, burst: float = RATE_BURST):
+        keys = api_keys or [None]
+        self.buckets = {key: TokenBucket(rate, burst) for key in keys}
+
+    async def acquire(self, promoted: asyncio.Event = None):
+        """Wait for a token and return the API key whose budget it was taken from.
+
+        Background callers pass an event and, until it is set, only take a token
+        that is free right now, so they never delay requests already queued.
+        """
+        key = min(self.buckets, key=lambda k: self.buckets[k].wait_time())
+        if promoted is not None:
+            while not promoted.is_set() and (idle := self.buckets[key].wait_time()) > 0:
+                await asyncio.sleep(idle)
+                key = min(self.buckets, key=lambda k: self.buckets[k].wait_time())
+        wait = self.buckets[key].reserve()
+        metrics.observe("rate_limit_wait_ms", wait * 1000)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return key
+
+    def pause(self, key, seconds: float):
+        if key in self.buckets:
+            self.buckets[key].pause(seconds)
+
+rate_limiter = RateLimiter(API_KEYS)
+
+# Set in background tasks (prefetch) so their upstream requests yield to tool calls;
+# setting the event promotes them to normal priority once a tool call depends on them
+background_request = contextvars.ContextVar("background_request", default=None)
+
+# Counter of requests the current tool call sent upstream (cache misses), when the tool sets one
+upstream_requests = contextvars.ContextVar("upstream_requests", default=None)
+
+def parse_retry_after(value: str):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+# Hedged requests: when an idempotent request is slower than the endpoint's recent
+# latency quantile, send a second copy and use whichever answers first
+HEDGE_ENABLED = env_bool("PUBMED_HEDGE")
+HEDGE_ENDPOINTS = ("esummary", "efetch")
+HEDGE_QUANTILE = env_float("PUBMED_HEDGE_QUANTILE", 0.95)
+# Latency samples needed before the quantile is trusted
+HEDGE_MIN_SAMPLES = env_int("PUBMED_HEDGE_MIN_SAMPLES", 20)
+HEDGE_MIN_DELAY_MS = env_float("PUBMED_HEDGE_MIN_DELAY_MS", 50.0)
+
+def hedge_delay(endpoint: str):
+    """Seconds to wait before hedging a request, or None if it should not be hedged"""
+    if not HEDGE_ENABLED or endpoint not in HEDGE_ENDPOINTS or background_request.get() is not None:
+        return None
+    histogram = metrics.histogram("upstream_ms", endpoint=endpoint)
+    if histogram is None or histogram.count < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY_MS, histogram.quantile(HEDGE_QUANTILE)) / 1000
+
+async def send_eutils(endpoint: str, url: str, params: dict, key) -> tuple:
+    """One GET paid for from the given API key's rate-limit budget. Returns (api_key, response)."""
+    # The except clause below needs the module even when replaying without an HTTP client
+    load_httpx()
+    request_params = dict(params)
+    # The limiter decides which key's budget pays for this request
+    request_params.pop("api_key", None)
+    if key:
+        request_params["api_key"] = key
+
+    metrics.inc("upstream_calls_total", tool=current_tool.get() or "none")
+    started = time.perf_counter()
+    try:
+        if cassette is not None and cassette.mode == "replay":
+            resp = await cassette.replay(endpoint, url, request_params)
+        else:
+            resp = await get_http_client().get(url, params=request_params)
+    except httpx.TransportError as e:
+        metrics.inc("upstream_requests_total", endpoint=endpoint, status=type(e).__name__)
+        if cassette is not None and cassette.mode == "record":
+            await asyncio.to_thread(cassette.record, endpoint, request_params, (time.perf_counter() - started) * 1000, error=e)
+        raise
+    if cassette is not None and cassette.mode == "record":
+        await asyncio.to_thread(cassette.record, endpoint, request_params, (time.perf_counter() - started) * 1000, resp)
+    metrics.observe("upstream_ms", (time.perf_counter() - started) * 1000, endpoint=endpoint)
+    metrics.inc("upstream_requests_total", endpoint=endpoint, status=resp.status_code)
+    metrics.inc("upstream_bytes_total", len(resp.content), endpoint=endpoint)
+    return key, resp
+
+async def hedged_send(endpoint: str, url: str, params: dict) -> tuple:
+    """send_eutils, plus a second copy of the request if the first is slow.
+
+    The hedge takes its rate-limit token at background priority, so it never delays
+    other tool calls; the losing request is cancelled.
+    """
+    async def send_hedge():
+        key = await rate_limiter.acquire(asyncio.Event())
+        return await send_eutils(endpoint, url, params, key)
+
+    # The hedge timer starts once the request is on the wire, not while it waits for a token
+    key = await rate_limiter.acquire(background_request.get())
+    first = asyncio.ensure_future(send_eutils(endpoint, url, params, key))
+    tasks = {first}
+    try:
+        delay = hedge_delay(endpoint)
+        if delay is not None:
+            await asyncio.wait(tasks, timeout=delay)
+            if not first.done():
+                metrics.inc("hedged_requests_total", endpoint=endpoint)
+                hedge = asyncio.ensure_future(send_hedge())
+                tasks.add(hedge)
+                while tasks:
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is hedge:
+                                metrics.inc("hedge_wins_total", endpoint=endpoint)
+                            return task.result()
+                # Both failed: report the original request's error
+                return first.result()
+        return await first
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def fetch_eutils(endpoint: str, params: dict) -> httpx.Response:
+    """Send a rate-limited GET request to an E-utilities endpoint (e.g. 'esearch'), retrying transient failures.
+
+    Raises DeadlineExceeded when the tool call's deadline passes first.
+    """
+    load_httpx()
+    counter = upstream_requests.get()
+    if counter is not None:
+        counter["requests"] += 1
+    url = f"{BASE_URL}/{endpoint}.fcgi"
+    last_error = None
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            metrics.inc("upstream_retries_total", endpoint=endpoint)
+        key = None
+        try:
+            key, resp = await within_deadline(hedged_send(endpoint, url, params), endpoint)
+        except httpx.TransportError as e:
+            last_error = f"{type(e).__name__}: {e}"
+            delay = backoff_delay(attempt)
+        else:
+            if resp.status_code not in RETRY_STATUS_CODES:
+                return resp
+            last_error = f"HTTP {resp.status_code}"
+            delay = backoff_delay(attempt)
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if resp.status_code == 429:
+                rate_limiter.pause(key, delay)
+
+        if attempt < MAX_RETRIES:
+            remaining = time_left()
+            if remaining is not None and delay >= remaining:
+                raise DeadlineExceeded(f"Deadline exceeded retrying {endpoint} ({last_error})")
+            logger.warning(f"{endpoint} failed ({last_error}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    raise EutilsError(f"NCBI {endpoint} request failed after {MAX_RETRIES + 1} attempts: {last_error}")
+
+# --- Record / replay ---
+
+# "record" writes every upstream exchange to the cassette at PUBMED_CASSETTE;
+# "replay" answers from it without touching the network
+CASSETTE_MODE = os.environ.get("PUBMED_CASSETTE_MODE", "").strip().lower()
+CASSETTE_PATH = os.environ.get("PUBMED_CASSETTE", "pubmed-cassette")
+# Multiplies the recorded response times during replay (0 = answer immediately)
+REPLAY_TIME_SCALE = env_float("PUBMED_REPLAY_TIME_SCALE", 1.0)
+# Response headers kept in the cassette
+CASSETTE_HEADERS = ("content-type", "retry-after")
+
+class CassetteMiss(EutilsError):
+    """Raised in replay mode for a request that was never recorded"""
+
+class Cassette:
+    """Recorded upstream traffic, stored in a directory.
+
+    Response bodies are zlib-compressed blobs under objects/, named by the SHA-256 of
+    the body, so a response that recurs is stored once. log.jsonl has one line per
+    upstream exchange (cache key, parameters without the API key, status, headers,
+    elapsed time, body hash) and one per tool call.
+    """
+
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.log = None
+        self.started = time.monotonic()
+        # Replay: cache key -> recorded exchanges, served in recorded order
+        self.exchanges = {}
+        self.counters = {"recorded": 0, "replayed": 0, "misses": 0}
+        if mode == "record":
+            os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+            self.log = open(os.path.join(path, "log.jsonl"), "a", encoding="utf-8")
+        else:
+            for entry in self.entries():
+                if entry.get("type") == "exchange":
+                    self.exchanges.setdefault(entry["key"], deque()).append(entry)
+
+    def entries(self):
+        """Log entries in recorded order"""
+        with open(os.path.join(self.path, "log.jsonl"), encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.path, "objects", digest[:2], digest)
+
+    def write_blob(self, body: bytes) -> str:
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(zlib.compress(body))
+            os.replace(tmp, path)
+        return digest
+
+    def append(self, entry: dict):
+        entry.setdefault("t", round(time.monotonic() - self.started, 3))
+        with self.lock:
+            self.log.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self.log.flush()
+            if entry["type"] == "exchange":
+                self.counters["recorded"] += 1
+
+    def record(self, endpoint: str, params: dict, elapsed_ms: float, resp=None, error: Exception = None):
+        """Store one upstream exchange (a response, or the transport error that replaced it)"""
+        entry = {
+            "type": "exchange",
+            "endpoint": endpoint,
+            "key": cache_key(endpoint, params),
+            "params": {k: v for k, v in params.items() if k != "api_key"},
+            "ms": round(elapsed_ms, 1),
+        }
+        if resp is not None:
+            entry["status"] = resp.status_code
+            entry["headers"] = {k: resp.headers[k] for k in CASSETTE_HEADERS if k in resp.headers}
+            entry["body"] = self.write_blob(resp.content)
+        else:
+            entry["error"] = type(error).__name__
+            entry["message"] = str(error)
+        self.append(entry)
+
+    def record_call(self, name: str, arguments: dict, elapsed_ms: float):
+        """Store a tool call, so that a session can be replayed against the recorded traffic"""
+        started = time.monotonic() - self.started - elapsed_ms / 1000
+        self.append({"type": "call", "t": round(started, 3), "name": name, "arguments": arguments, "ms": round(elapsed_ms, 1)})
+
+    async def replay(self, endpoint: str, url: str, params: dict) -> httpx.Response:
+        """The recorded response for a request, after its recorded (scaled) delay.
+
+        Repeats of a request get its recordings in order; the last one is reused after that.
+        """
+        queue = self.exchanges.get(cache_key(endpoint, params))
+        if not queue:
+            self.counters["misses"] += 1
+            raise CassetteMiss(f"{endpoint} request not found in cassette {self.path}")
+        entry = queue.popleft() if len(queue) > 1 else queue[0]
+        if REPLAY_TIME_SCALE > 0:
+            await asyncio.sleep(entry["ms"] / 1000 * REPLAY_TIME_SCALE)
+        self.counters["replayed"] += 1
+        request = httpx.Request("GET", url, params=params)
+        if "error" in entry:
+            error = getattr(httpx, entry["error"], None)
+            if not (isinstance(error, type) and issubclass(error, httpx.TransportError)):
+                error = httpx.TransportError
+            raise error(entry["message"], request=request)
+        with open(self.blob_path(entry["body"]), "rb") as f:
+            body = zlib.decompress(f.read())
+        return httpx.Response(entry["status"], headers=entry["headers"], content=body, request=request)
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "path": self.path, **self.counters}
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+cassette = None
+
+def open_cassette():
+    """Open the cassette named by PUBMED_CASSETTE for recording or replay (PUBMED_CASSETTE_MODE)"""
+    global cassette
+    if CASSETTE_MODE not in ("record", "replay"):
+        if CASSETTE_MODE:
+            logger.warning(f"Unknown PUBMED_CASSETTE_MODE '{CASSETTE_MODE}'; expected 'record' or 'replay'")
+        return
+    load_httpx()
+    cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE)
+    logger.info(f"Cassette {CASSETTE_MODE}: {CASSETTE_PATH}")
+
+# --- Response cache ---
+
+CACHE_ENABLED = env_bool("PUBMED_CACHE_ENABLED", True)
+CACHE_MAX_ENTRIES = env_int("PUBMED_CACHE_MAX_ENTRIES", 2000)
+# Total response bytes kept in memory; larger bodies are only cached on disk
+CACHE_MAX_BYTES = env_int("PUBMED_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+# Persistent tier; set PUBMED_CACHE_PATH to an empty string to keep the cache in memory only
+CACHE_PATH = os.environ.get("PUBMED_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "pubmed-mcp", "cache.sqlite3"))
+# Rows kept in the persistent tier, and how often (seconds) expired and excess rows are pruned
+CACHE_DISK_MAX_ENTRIES = env_int("PUBMED_CACHE_DISK_MAX_ENTRIES", 100000)
+CACHE_PRUNE_INTERVAL = env_float("PUBMED_CACHE_PRUNE_INTERVAL", 600)
+
+# Time-to-live in seconds per endpoint: article records rarely change, relevance rankings do
+CACHE_TTLS = {
+    "efetch": env_float("PUBMED_CACHE_TTL_EFETCH", 30 * 86400),
+    "esummary": env_float("PUBMED_CACHE_TTL_ESUMMARY", 7 * 86400),
+    "elink": env_float("PUBMED_CACHE_TTL_ELINK", 7 * 86400),
+    "esearch": env_float("PUBMED_CACHE_TTL_ESEARCH", 3600),
+}
+# TTL for responses in which none of the requested PMIDs was found
+CACHE_NEGATIVE_TTL = env_float("PUBMED_CACHE_NEGATIVE_TTL", 86400)
+
+def cache_key(endpoint: str, params: dict) -> str:
+    """Normalized cache key for an (endpoint, params) pair; the API key is not part of it"""
+    items = sorted((k, str(v)) for k, v in params.items() if k != "api_key")
+    raw = endpoint + "?" + "&".join(f"{k}={v}" for k, v in items)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+ARTICLE_TAG_RE = re.compile(rb"<(PubmedArticle|PubmedBookArticle)[\s>]")
+
+def response_error(endpoint: str, body: bytes):
+    """The error NCBI reported in place of results (e.g. {"error": ...} or
+    {"esummaryresult": [...]} from esummary), or None for a normal response"""
+    if endpoint != "esummary":
+        return None
+    try:
+        doc = json.loads(body)
+    except ValueError:
+        return "response is not JSON"
+    if isinstance(doc, dict) and isinstance(doc.get("result"), dict):
+        return None
+    if not isinstance(doc, dict):
+        return "unexpected response"
+    message = doc.get("error") or doc.get("esummaryresult") or "response has no result"
+    return "; ".join(map(str, message)) if isinstance(message, list) else str(message)
+
+def is_negative_response(endpoint: str, body: bytes) -> bool:
+    """True if a successful response means "nothing found" for the requested IDs"""
+    if endpoint == "efetch":
+        return ARTICLE_TAG_RE.search(body) is None
+    if endpoint == "esummary":
+        # Unknown UIDs are listed with an entry that only carries "error"
+        try:
+            result = json.loads(body)["result"]
+            uids = result.get("uids")
+            return bool(uids) and all("error" in result.get(uid, {}) for uid in uids)
+        except (ValueError, KeyError, AttributeError, TypeError):
+            return False
+    return False
+
+def is_cacheable(endpoint: str, params: dict) -> bool:
+    """History server results are tied to a short-lived WebEnv, so they are never cached"""
+    return "WebEnv" not in params and params.get("usehistory") != "y"
+
+class DiskCache:
+    """SQLite-backed persistent cache tier. Bodies are stored zlib-compressed.
+
+    Expired rows, and the rows closest to expiry beyond max_entries, are pruned
+    when the database is opened and then on a put every prune_interval seconds.
+    """
+
+    def __init__(self, path: str, max_entries: int = CACHE_DISK_MAX_ENTRIES,
+                 prune_interval: float = CACHE_PRUNE_INTERVAL):
+        self.path = path
+        self.max_entries = max_entries
+        self.prune_interval = prune_interval
+        self.lock = threading.Lock()
+        self.conn = None
+        self.failed = False
+        self.pruned_at = 0.0
+
+    def _connection(self):
+        """Open the database on first use, off the startup path (call with the lock held)"""
+        if self.conn is None and not self.failed:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, endpoint TEXT, expires REAL, negative INTEGER, body BLOB)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses(expires)")
+                self.conn = conn
+                self._prune()
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f"Persistent cache disabled ({self.path}): {e}")
+                self.conn = None
+                self.failed = True
+        return self.conn
+
+    def _prune(self):
+        """Delete expired rows, then the rows closest to expiry above max_entries (call with the lock held)"""
+        now = time.time()
+        self.conn.execute("DELETE FROM responses WHERE expires < ?", (now,))
+        excess = self.conn.execute("SELECT count(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY expires LIMIT ?)", (excess,)
+            )
+        self.conn.commit()
+        self.pruned_at = now
+
+    def get(self, key: str):
+        with self.lock:
+            if self._connection() is None:
+                return None
+            row = self.conn.execute(
+                "SELECT expires, negative, body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[0] < time.time():
+            return None
+        return row[0], bool(row[1]), zlib.decompress(row[2])
+
+    def put(self, key: str, endpoint: str, expires: float, negative: bool, body: bytes):
+        with self.lock:
+            if self._connection() is None:
+                return
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, endpoint, expires, int(negative), zlib.compress(body))
+            )
+            self.conn.commit()
+            if time.time() - self.pruned_at >= self.prune_interval:
+                self._prune()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+class ResponseCache:
+    """Two-tier cache for raw E-utilities responses: in-memory LRU in front of an optional disk tier.
+    The memory tier is bounded both in entries and in total body bytes."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, path: str = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        # Opened lazily on the first lookup
+        self.disk = DiskCache(path) if path else None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "negative_hits": 0, "stores": 0}
+
+    def _remember(self, key: str, entry: tuple):
+        self._forget(key)
+        if len(entry[2]) > self.max_bytes:
+            return
+        self.memory[key] = entry
+        self.memory_bytes += len(entry[2])
+        while len(self.memory) > self.max_entries or self.memory_bytes > self.max_bytes:
+            _, (_, _, body) = self.memory.popitem(last=False)
+            self.memory_bytes -= len(body)
+
+    def _forget(self, key: str):
+        entry = self.memory.pop(key, None)
+        if entry is not None:
+            self.memory_bytes -= len(entry[2])
+
+    async def get(self, endpoint: str, params: dict):
+        """Return the cached body for a request, or None"""
+        key = cache_key(endpoint, params)
+        entry = self.memory.get(key)
+        if entry is not None and entry[0] < time.time():
+            self._forget(key)
+            entry = None
+        if entry is not None:
+            self.memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+        elif self.disk is not None:
+            entry = await asyncio.to_thread(self.disk.get, key)
+            if entry is not None:
+                self._remember(key, entry)
+                self.counters["disk_hits"] += 1
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        if entry[1]:
+            self.counters["negative_hits"] += 1
+        return entry[2]
+
+    async def put(self, endpoint: str, params: dict, body: bytes):
+        ttl = CACHE_TTLS.get(endpoint, 0)
+        negative = is_negative_response(endpoint, body)
+        if negative:
+            ttl = min(ttl, CACHE_NEGATIVE_TTL)
+        if ttl <= 0:
+            return
+        key = cache_key(endpoint, params)
+        entry = (time.time() + ttl, negative, body)
+        self._remember(key, entry)
+        self.counters["stores"] += 1
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.put, key, endpoint, *entry)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write persistent cache: {e}")
+
+    def stats(self) -> dict:
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_bytes,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+# With a cassette only the in-memory tier is used, so a replay sees the same upstream requests as its recording
+response_cache = ResponseCache(path="" if CASSETTE_MODE else CACHE_PATH) if CACHE_ENABLED else None
+
+# --- Request coalescing ---
+
+SINGLE_FLIGHT_ENABLED = env_bool("PUBMED_SINGLE_FLIGHT", True)
+
+class SingleFlight:
+    """Coalesces concurrent identical requests into one shared upstream task.
+
+    Every waiter gets the same result or exception. Waiters await the task through
+    asyncio.shield, so cancelling one waiter never cancels the fetch for the others.
+    The shared task runs without the leader's deadline; each waiter applies its own.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.counters = {"leaders": 0, "coalesced": 0}
+
+    async def do(self, key: str, factory, what: str = "upstream response"):
+        task = self.calls.get(key)
+        if task is None:
+            context = contextvars.copy_context()
+            context.run(request_deadline.set, None)
+            task = context.run(asyncio.ensure_future, factory())
+            task.promoted = background_request.get()
+            self.calls[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+            self.counters["leaders"] += 1
+        else:
+            self.counters["coalesced"] += 1
+            if task.promoted is not None and background_request.get() is None:
+                task.promoted.set()  # a foreground call now waits on a background fetch
+        return await within_deadline(asyncio.shield(task), what)
+
+    def _finished(self, key: str, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Mark the exception as retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {**self.counters, "in_flight": len(self.calls)}
+
+single_flight = SingleFlight() if SINGLE_FLIGHT_ENABLED else None
+
+async def eutils_get(endpoint: str, params: dict) -> httpx.Response:
+    """GET an E-utilities endpoint, serving repeat requests from the response cache
+    and sharing one upstream request between concurrent identical calls"""
+    cacheable = response_cache is not None and is_cacheable(endpoint, params)
+    if cacheable:
+        body = await response_cache.get(endpoint, params)
+        if body is not None:
+            load_httpx()
+            request = httpx.Request("GET", f"{BASE_URL}/{endpoint}.fcgi", params=params)
+            return httpx.Response(200, content=body, request=request)
+
+    async def fetch():
+        resp = await fetch_eutils(endpoint, params)
+        error = response_error(endpoint, resp.content) if resp.status_code == 200 else None
+        if error is not None:
+            # Never cached: the same request may well succeed next time
+            raise EutilsResponseError(f"NCBI {endpoint} returned an error: {error}")
+        if cacheable and resp.status_code == 200:
+            await response_cache.put(endpoint, params, resp.content)
+        return resp
+
+    if single_flight is None:
+        return await fetch()
+    return await single_flight.do(cache_key(endpoint, params), fetch, f"{endpoint} response")
+
+def response_json(resp: httpx.Response) -> dict:
+    """Decode a JSON response, recording the parse time"""
+    with metrics.timer("parse_ms", format="json"):
+        return resp.json()
+
+# Shared encoders: json.dumps() with keyword arguments builds a new encoder on every call
+pretty_json_encoder = json.JSONEncoder(indent=2, ensure_ascii=False)
+compact_json_encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+def dump_json(obj, compact: bool = False) -> str:
+    """Serialize a tool result; pretty-printed unless compact output is requested"""
+    return (compact_json_encoder if compact else pretty_json_encoder).encode(obj)
+
+# --- Journal impact index ---
+
+# High-impact Neurology/NeuroScience journals by tier.
+# Each entry lists the NLM abbreviation, the full title and known ISSNs.
+DEFAULT_JOURNAL_TIERS = {
+    1: [
+        ["N Engl J Med", "The New England Journal of Medicine", "0028-4793", "1533-4406"],
+        ["Lancet", "The Lancet", "0140-6736", "1474-547X"],
+        ["JAMA", "Journal of the American Medical Association", "0098-7484", "1538-3598"],
+        ["BMJ", "BMJ (Clinical research ed.)", "0959-8138", "1756-1833"],
+        ["Nature", "0028-0836", "1476-4687"],
+        ["Nat Med", "Nature Medicine", "1078-8956", "1546-170X"],
+        ["Cell", "0092-8674", "1097-4172"],
+        ["Science", "0036-8075", "1095-9203"],
+        ["Lancet Neurol", "The Lancet Neurology", "1474-4422", "1474-4465"],
+        ["JAMA Neurol", "JAMA Neurology", "2168-6149", "2168-6157"],
+        ["Nat Rev Neurol", "Nature Reviews Neurology", "1759-4758", "1759-4766"],
+        ["Neuron", "0896-6273", "1097-4199"],
+        ["Brain", "Brain : a journal of neurology", "0006-8950", "1460-2156"],
+        ["Ann Neurol", "Annals of Neurology", "0364-5134", "1531-8249"],
+        ["Neurology", "0028-3878", "1526-632X"],
+    ],
+    2: [
+        ["J Neurol Neurosurg Psychiatry", "Journal of Neurology, Neurosurgery, and Psychiatry", "0022-3050", "1468-330X"],
+        ["Mov Disord", "Movement Disorders", "0885-3185", "1531-8257"],
+        ["Mov Disord Clin Pract", "Movement Disorders Clinical Practice", "2330-1619"],
+        ["Amyloid", "1350-6129", "1744-2818"],
+        ["Parkinsonism Relat Disord", "Parkinsons Relat Disord", "Parkinsonism & Related Disorders", "1353-8020", "1873-5126"],
+        ["J Parkinsons Dis", "Journal of Parkinson's Disease", "1877-7171", "1877-718X"],
+        ["NPJ Parkinsons Dis", "NPJ Parkinson's Disease", "2373-8057"],
+        ["Stroke", "0039-2499", "1524-4628"],
+        ["CNS Neurol Disord Drug Targets", "CNS & Neurological Disorders Drug Targets", "1871-5273", "1996-3181"],
+        ["Clin Neurol Neurosurg", "Clinical Neurology and Neurosurgery", "0303-8467", "1872-6968"],
+        ["Mult Scler", "Mult Scler J", "Multiple Sclerosis Journal", "Multiple Sclerosis (Houndmills, Basingstoke, England)", "1352-4585", "1477-0970"],
+        ["Epilepsia", "0013-9580", "1528-1167"],
+        ["Sleep", "0161-8105", "1550-9109"],
+    ],
+}
+
+# Optional JSON file with a user-supplied tier list, same shape as DEFAULT_JOURNAL_TIERS:
+# {"1": [["N Engl J Med", "0028-4793"], "Lancet"], "2": [...]}
+JOURNAL_TIERS_PATH = os.environ.get("PUBMED_JOURNAL_TIERS")
+# Journals in this tier or better count as "high impact"
+HIGH_IMPACT_MAX_TIER = env_int("PUBMED_HIGH_IMPACT_MAX_TIER", 2)
+
+ISSN_RE = re.compile(r"^\d{4}-?\d{3}[\dXx]$")
+JOURNAL_PUNCT_RE = re.compile(r"[^\w\s]")
+
+def normalize_journal(name: str) -> str:
+    """Normalize a journal abbreviation or title for exact lookup.
+
+    Subtitles after ' : ' and parenthetical place names are dropped, so
+    "Brain : a journal of neurology" and "Lancet (London, England)" match their short forms.
+    """
+    name = name.split(" : ")[0]
+    name = re.sub(r"\([^)]*\)", " ", name).replace("&", " and ")
+    words = JOURNAL_PUNCT_RE.sub(" ", name.lower().replace("'", "")).split()
+    if words and words[0] == "the":
+        words = words[1:]
+    return " ".join(words)
+
+def normalize_issn(issn: str) -> str:
+    return issn.replace("-", "").strip().upper()
+
+class JournalIndex:
+    """Exact-match journal lookup by normalized name or ISSN, returning a tier (1 = best)"""
+
+    def __init__(self):
+        self.by_name = {}
+        self.by_issn = {}
+
+    def add(self, tier: int, names):
+        for name in names:
+            if ISSN_RE.match(name.strip()):
+                self.by_issn.setdefault(normalize_issn(name), tier)
+            else:
+                self.by_name.setdefault(normalize_journal(name), tier)
+
+    def tier(self, journal_name: str = None, issn: str = None):
+        """Return the journal's tier, or None if it is not listed"""
+        if issn:
+            tier = self.by_issn.get(normalize_issn(issn))
+            if tier is not None:
+                return tier
+        if journal_name:
+            return self.by_name.get(normalize_journal(journal_name))
+        return None
+
+    @classmethod
+    def from_tiers(cls, tiers: dict) -> "JournalIndex":
+        index = cls()
+        # Lower tiers first, so a journal listed twice keeps its best tier
+        for tier in sorted(tiers, key=int):
+            for entry in tiers[tier]:
+                index.add(int(tier), [entry] if isinstance(entry, str) else entry)
+        return index
+
+def load_journal_index() -> JournalIndex:
+    if JOURNAL_TIERS_PATH:
+        try:
+            with open(JOURNAL_TIERS_PATH, encoding="utf-8") as f:
+                return JournalIndex.from_tiers(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load journal tiers from {JOURNAL_TIERS_PATH}: {e}; using built-in list")
+    return JournalIndex.from_tiers(DEFAULT_JOURNAL_TIERS)
+
+journal_index = load_journal_index()
+
+def journal_tier(journal_name: str, issn: str = None):
+    """Tier of a journal (1 = highest) or None if it is not in the list"""
+    return journal_index.tier(journal_name, issn)
+
+def is_high_impact_journal(journal_name: str, issn: str = None) -> bool:
+    """Check if a journal is in the high-impact list"""
+    tier = journal_tier(journal_name, issn)
+    return tier is not None and tier <= HIGH_IMPACT_MAX_TIER
+
+def summary_journal_tier(item: dict):
+    """Tier for an esummary record, using its ISSN/eISSN when present"""
+    return journal_tier(item.get("source", ""), item.get("issn") or item.get("essn"))
+
+def is_high_impact_summary(item: dict) -> bool:
+    tier = summary_journal_tier(item)
+    return tier is not None and tier <= HIGH_IMPACT_MAX_TIER
+
+# --- Publication types ---
+
+# PubMed publication types (efetch PublicationTypeList, esummary "pubtype") -> result tag
+PUBLICATION_TYPE_TAGS = {
+    "Practice Guideline": "guideline",
+    "Guideline": "guideline",
+    "Meta-Analysis": "meta-analysis",
+    "Network Meta-Analysis": "meta-analysis",
+    "Systematic Review": "systematic review",
+    "Randomized Controlled Trial": "rct",
+    "Clinical Trial": "clinical trial",
+    "Clinical Trial, Phase I": "clinical trial",
+    "Clinical Trial, Phase II": "clinical trial",
+    "Clinical Trial, Phase III": "clinical trial",
+    "Clinical Trial, Phase IV": "clinical trial",
+    "Controlled Clinical Trial": "clinical trial",
+    "Pragmatic Clinical Trial": "clinical trial",
+    "Equivalence Trial": "clinical trial",
+    "Adaptive Clinical Trial": "clinical trial",
+    "Observational Study": "observational study",
+    "Review": "review",
+    "Scoping Review": "review",
+    "Case Reports": "case report",
+    "Retracted Publication": "retracted",
+}
+
+# Tags by strength of evidence (rank_by_type); untagged articles sit between primary studies and reviews
+EVIDENCE_ORDER = ["guideline", "meta-analysis", "systematic review", "rct", "clinical trial",
+                  "observational study", None, "review", "case report", "retracted"]
+EVIDENCE_RANK = {tag: rank for rank, tag in enumerate(EVIDENCE_ORDER)}
+PUBLICATION_TYPE_CHOICES = [tag for tag in EVIDENCE_ORDER if tag is not None]
+# Tags that mark a secondary (review) article, with the label get_similar_articles appends to its title
+REVIEW_LABELS = {"meta-analysis": "Meta-Analysis", "systematic review": "Systematic Review", "review": "Review"}
+
+def publication_type_tags(pub_types) -> list:
+    """Tags for a record's publication types, strongest evidence first"""
+    tags = {PUBLICATION_TYPE_TAGS.get(pt) for pt in pub_types}
+    tags.discard(None)
+    return sorted(tags, key=EVIDENCE_RANK.get)
+
+def evidence_rank(tags) -> int:
+    if "retracted" in tags:
+        return EVIDENCE_RANK["retracted"]
+    return min((EVIDENCE_RANK[tag] for tag in tags if tag in EVIDENCE_RANK), default=EVIDENCE_RANK[None])
+
+def parse_publication_types(value) -> list:
+    """Validate the publication_types argument of a tool call"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    tags = [str(tag).strip().lower() for tag in value if str(tag).strip()]
+    unknown = [tag for tag in tags if tag not in PUBLICATION_TYPE_CHOICES]
+    if unknown:
+        raise ValueError(f"Unknown publication type(s): {', '.join(unknown)}. Valid: {', '.join(PUBLICATION_TYPE_CHOICES)}")
+    return tags
+
+def publication_type_names(tags: list) -> list:
+    """PubMed publication type names covered by the given tags"""
+    return [pt for pt, tag in PUBLICATION_TYPE_TAGS.items() if tag in tags]
+
+def publication_type_query(tags: list) -> str:
+    """Entrez clause restricting a search to the given tags, so NCBI filters before paging"""
+    return "(" + " OR ".join(f'"{pt}"[pt]' for pt in publication_type_names(tags)) + ")"
+
+def ranked_by_type(formatter):
+    """Wrap a result formatter so results are ordered by evidence level (stable within a level)"""
+    def format_ranked(id_list: list, uid_data: dict) -> list:
+        results = formatter(id_list, uid_data)
+        results.sort(key=lambda r: evidence_rank(r.get("types", ())))
+        return results
+    return format_ranked
+
+# --- Streaming efetch XML parsing ---
+
+# PMIDs per efetch request (NCBI recommends at most ~200 IDs per GET)
+EFETCH_BATCH_SIZE = env_int("PUBMED_EFETCH_BATCH_SIZE", 200)
+# Upper bound on PMIDs accepted by a single batch tool call
+MAX_BATCH_PMIDS = env_int("PUBMED_MAX_BATCH_PMIDS", 1000)
+
+def element_text(elem) -> str:
+    """Full text of an element including inline markup such as <i> or <sup>"""
+    if elem is None:
+        return ""
+    return "".join(elem.itertext())
+
+def iter_pubmed_articles(xml_bytes: bytes):
+    """Yield PubmedArticle elements one at a time, clearing each after use to keep memory flat"""
+    import xml.etree.ElementTree as ET
+    for _, elem in ET.iterparse(io.BytesIO(xml_bytes), events=("end",)):
+        if elem.tag == "PubmedArticle":
+            yield elem
+            elem.clear()
+
+class Article:
+    """Compact article record shared by all tools.
+
+    One parser per upstream format (from_summary for esummary JSON, from_element
+    for efetch XML); tool-specific result dicts are only built at output time.
+    """
+
+    __slots__ = ("pmid", "title", "authors", "author_records", "journal", "source", "pubdate",
+                 "issn", "doi", "pmc_id", "pub_types", "abstract")
+
+    def __init__(self, pmid: str, title: str = "No title", authors: tuple = (), author_records: list = (),
+                 journal: str = "", source: str = None, pubdate: str = "Unknown date", issn: str = None,
+                 doi: str = None, pmc_id: str = None, pub_types: list = (), abstract: str = ""):
+        self.pmid = pmid
+        self.title = title
+        self.authors = authors
+        # esummary author objects, passed through unchanged by tools that return them
+        self.author_records = author_records
+        self.journal = journal
+        # Journal abbreviation; None when the record has none
+        self.source = source
+        self.pubdate = pubdate
+        self.issn = issn
+        self.doi = doi
+        self.pmc_id = pmc_id
+        self.pub_types = pub_types
+        self.abstract = abstract
+
+    @classmethod
+    def from_summary(cls, pmid: str, item: dict) -> "Article":
+        """Build from an esummary JSON record"""
+        return cls(
+            pmid,
+            title=item.get("title", "No title"),
+            author_records=item.get("authors", []),
+            source=item.get("source"),
+            pubdate=item.get("pubdate", "Unknown date"),
+            issn=item.get("issn") or item.get("essn"),
+            pub_types=item.get("pubtype", []),
+        )
+
+    @classmethod
+    def from_element(cls, pubmed_article) -> "Article":
+        """Build from a PubmedArticle element of an efetch XML response"""
+        citation = pubmed_article.find("MedlineCitation")
+        article = citation.find("Article")
+
+        authors = []
+        for auth in article.findall("AuthorList/Author"):
+            last_name = auth.findtext("LastName")
+            fore_name = auth.findtext("ForeName")
+            if last_name and fore_name:
+                authors.append(f"{last_name} {fore_name}")
+
+        doi = None
+        pmc_id = None
+        for article_id in pubmed_article.findall("PubmedData/ArticleIdList/ArticleId"):
+            id_type = article_id.get("IdType")
+            if id_type == "doi":
+                doi = article_id.text
+            elif id_type == "pmc":
+                pmc_id = article_id.text
+
+        return cls(
+            citation.findtext("PMID", "").strip(),
+            title=element_text(article.find("ArticleTitle")) or "No title",
+            authors=authors,
+            journal=article.findtext("Journal/Title", ""),
+            source=article.findtext("Journal/ISOAbbreviation"),
+            issn=article.findtext("Journal/ISSN"),
+            doi=doi,
+            pmc_id=pmc_id,
+            pub_types=[element_text(pt) for pt in article.findall("PublicationTypeList/PublicationType")],
+            abstract="\n".join(element_text(a) for a in article.findall("Abstract/AbstractText")),
+        )
+
+    def author_names(self, limit: int) -> list:
+        """First `limit` author names (esummary records)"""
+        return [a.get("name", "") for a in self.author_records[:limit] if isinstance(a, dict)]
+
+    def is_review(self) -> bool:
+        return any("review" in pt.lower() for pt in self.pub_types)
+
+    def types(self) -> list:
+        return publication_type_tags(self.pub_types)
+
+    def tier(self):
+        return journal_tier(self.source or "", self.issn)
+
+    def search_result(self) -> dict:
+        """search_pubmed result shape: first three authors as one string"""
+        names = self.author_names(3)
+        result = {
+            "pmid": self.pmid,
+            "title": self.title,
+            "authors": ", ".join(names) if names else "No authors",
+            "pubdate": self.pubdate,
+            "source": self.source if self.source is not None else "Unknown source"
+        }
+        return self._with_types(result)
+
+    def advanced_result(self) -> dict:
+        """advanced_search_pubmed result shape: esummary author objects"""
+        result = {
+            "pmid": self.pmid,
+            "title": self.title,
+            "pubdate": self.pubdate,
+            "source": self.source if self.source is not None else "Unknown source",
+            "authors": self.author_records
+        }
+        return self._with_types(result)
+
+    def _with_types(self, result: dict) -> dict:
+        types = self.types()
+        if types:
+            result["types"] = types
+        return result
+
+    def details(self) -> dict:
+        """get_paper_details result shape"""
+        links = {"pubmed": f"https://pubmed.ncbi.nlm.nih.gov/{self.pmid}/"}
+        if self.pmc_id:
+            links["pmc"] = f"https://www.ncbi.nlm.nih.gov/pmc/articles/{self.pmc_id}/"
+        if self.doi:
+            links["doi"] = f"https://doi.org/{self.doi}"
+        return {
+            "pmid": self.pmid,
+            "title": self.title,
+            "authors": self.authors,
+            "journal": self.journal,
+            "doi": self.doi,
+            "pmc_id": self.pmc_id,
+            "abstract": self.abstract,
+            "links": links
+        }
+
+def chunked(items: list, size: int):
+    """Split a list into consecutive chunks of at most `size` items"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+# Per-PMID error for records whose chunk did not arrive before the deadline
+DEADLINE_ERROR = "Not fetched before the deadline"
+
+async def fetch_article_records(pmids: list) -> tuple:
+    """Fetch and parse efetch records for many PMIDs in concurrent chunks.
+
+    Returns (records, errors): records maps PMID -> Article, errors maps PMID -> message.
+    """
+    records = {}
+    errors = {}
+
+    async def fetch_chunk(chunk):
+        fetch_params = get_params({"db": "pubmed", "id": ",".join(chunk), "retmode": "xml"})
+        try:
+            resp = await eutils_get("efetch", fetch_params)
+            with metrics.timer("parse_ms", format="xml"):
+                for elem in iter_pubmed_articles(resp.content):
+                    try:
+                        record = Article.from_element(elem)
+                        records[record.pmid] = record
+                    except Exception as e:
+                        pmid = elem.findtext("MedlineCitation/PMID", "").strip()
+                        errors[pmid] = f"Failed to parse record: {e}"
+        except DeadlineExceeded:
+            for pmid in chunk:
+                errors.setdefault(pmid, DEADLINE_ERROR)
+        except Exception as e:
+            logger.error(f"efetch chunk of {len(chunk)} PMIDs failed: {e}")
+            for pmid in chunk:
+                errors.setdefault(pmid, f"Fetch failed: {e}")
+
+    await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunked(pmids, EFETCH_BATCH_SIZE)))
+    return records, errors
+
+# PMIDs per esummary request when summarizing large ID sets
+ESUMMARY_BATCH_SIZE = env_int("PUBMED_ESUMMARY_BATCH_SIZE", 200)
+
+async def fetch_summary_chunk(chunk: list) -> dict:
+    """One esummary request; returns PMID -> summary item"""
+    summary_params = get_params({"db": "pubmed", "id": ",".join(chunk), "retmode": "json"})
+    resp = await eutils_get("esummary", summary_params)
+    return {k: v for k, v in response_json(resp).get("result", {}).items() if k != "uids"}
+
+async def fetch_summaries(pmids: list) -> dict:
+    """Fetch esummary records for many PMIDs in concurrent chunks; returns PMID -> summary item"""
+    uid_data = {}
+    for result in await asyncio.gather(*(fetch_summary_chunk(c) for c in chunked(pmids, ESUMMARY_BATCH_SIZE))):
+        uid_data.update(result)
+    return uid_data
+
+# --- Speculative prefetch ---
+
+PREFETCH_ENABLED = env_bool("PUBMED_PREFETCH", False)
+# Top search results whose efetch records are fetched in the background
+PREFETCH_TOP_K = env_int("PUBMED_PREFETCH_TOP_K", 5)
+# Prefetch batches allowed in flight; scheduling another cancels the oldest
+PREFETCH_MAX_PENDING = env_int("PUBMED_PREFETCH_MAX_PENDING", 2)
+PREFETCH_MAX_ENTRIES = env_int("PUBMED_PREFETCH_MAX_ENTRIES", 500)
+PREFETCH_TTL = env_float("PUBMED_PREFETCH_TTL", 900)
+
+class Prefetcher:
+    """Fetches details for the top PMIDs of a search result in the background.
+
+    One batched efetch per search runs at low priority under the rate limiter.
+    Parsed records are kept in a small LRU so that follow-up get_paper_details /
+    get_papers_details calls are answered without another round trip; a call that
+    arrives while its batch is still in flight waits for it instead of refetching.
+    """
+
+    def __init__(self, top_k: int = PREFETCH_TOP_K, max_pending: int = PREFETCH_MAX_PENDING,
+                 max_entries: int = PREFETCH_MAX_ENTRIES, ttl: float = PREFETCH_TTL):
+        self.top_k = top_k
+        self.max_pending = max(1, max_pending)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.records = OrderedDict()
+        self.pending = {}
+        self.batches = []
+        self.counters = {"scheduled": 0, "fetched": 0, "hits": 0, "cancelled": 0, "failed": 0}
+
+    def schedule(self, pmids: list):
+        """Start a background fetch for the first top_k PMIDs not already prefetched"""
+        now = time.monotonic()
+        wanted = []
+        for pmid in pmids:
+            pmid = str(pmid)
+            entry = self.records.get(pmid)
+            if pmid in self.pending or (entry is not None and entry[0] > now):
+                continue
+            wanted.append(pmid)
+            if len(wanted) >= self.top_k:
+                break
+        if not wanted:
+            return
+
+        # Newer searches are more likely to be followed up than older ones
+        while len(self.batches) >= self.max_pending:
+            oldest = self.batches.pop(0)
+            if not oldest.done():
+                oldest.cancel()
+                self.counters["cancelled"] += 1
+
+        promoted = asyncio.Event()
+        task = asyncio.create_task(self._fetch(wanted, promoted))
+        task.promoted = promoted
+        self.batches.append(task)
+        for pmid in wanted:
+            self.pending[pmid] = task
+        task.add_done_callback(lambda t: self._finished(wanted, t))
+        self.counters["scheduled"] += len(wanted)
+
+    async def _fetch(self, pmids: list, promoted: asyncio.Event) -> dict:
+        background_request.set(promoted)
+        current_tool.set("prefetch")
+        # Not bound by the deadline of the search that scheduled it
+        request_deadline.set(deadline_after(TOOL_DEADLINE))
+        records, _ = await fetch_article_records(pmids)
+        expires = time.monotonic() + self.ttl
+        for pmid, record in records.items():
+            self.records[pmid] = (expires, record)
+            self.records.move_to_end(pmid)
+        while len(self.records) > self.max_entries:
+            self.records.popitem(last=False)
+        self.counters["fetched"] += len(records)
+        return records
+
+    def _finished(self, pmids: list, task):
+        for pmid in pmids:
+            if self.pending.get(pmid) is task:
+                del self.pending[pmid]
+        if task in self.batches:
+            self.batches.remove(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.counters["failed"] += 1
+            logger.warning(f"Prefetch of {len(pmids)} PMIDs failed: {task.exception()}")
+
+    async def get(self, pmid: str):
+        """Return the prefetched record for a PMID, or None; counts a hit when found"""
+        pmid = str(pmid)
+        task = self.pending.get(pmid)
+        if task is not None:
+            task.promoted.set()
+            try:
+                await within_deadline(asyncio.shield(task), "prefetched records")
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise  # the caller itself was cancelled
+                # batch evicted or cancelled at shutdown: fall back to a normal fetch
+            except Exception:
+                pass  # failed or out of time: fall back to a normal fetch
+        entry = self.records.pop(pmid, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        # Each prefetched record is served once; the response cache covers later repeats
+        self.counters["hits"] += 1
+        metrics.inc("prefetch_hits_total")
+        return entry[1]
+
+    def cancel(self):
+        for task in self.batches:
+            task.cancel()
+
+    def stats(self) -> dict:
+        fetched = self.counters["fetched"]
+        return {
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / fetched, 3) if fetched else 0.0,
+            "stored": len(self.records),
+            "in_flight": len(self.batches),
+        }
+
+prefetcher = Prefetcher() if PREFETCH_ENABLED else None
+
+def prefetch_details(pmids: list):
+    """Queue background detail fetches for search results (no-op unless PUBMED_PREFETCH is on)"""
+    if prefetcher is not None and not use_local_index():
+        prefetcher.schedule(pmids)
+
+# --- Entrez History server paging ---
+
+# max_results above this switches searches to WebEnv/query_key paging
+HISTORY_THRESHOLD = env_int("PUBMED_HISTORY_THRESHOLD", 100)
+# esummary records fetched per history page request
+HISTORY_PAGE_SIZE = env_int("PUBMED_HISTORY_PAGE_SIZE", 200)
+# Upper bound on results returned by one paged call
+MAX_SEARCH_RESULTS = env_int("PUBMED_MAX_SEARCH_RESULTS", 5000)
+
+def encode_cursor(state: dict) -> str:
+    """Encode paging state as an opaque URL-safe token"""
+    raw = json.dumps(state, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    """Decode a cursor token; raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        state = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(state, dict) or not {"term", "start", "size"} <= state.keys():
+        raise ValueError("Invalid cursor")
+    return state
+
+async def esearch_history(term: str, webenv: str = None) -> dict:
+    """Run esearch with usehistory=y and return the count, WebEnv and query_key.
+
+    With webenv, the term may refer to sets already stored there (e.g. "#1").
+    """
+    search_params = get_params({
+        "db": "pubmed",
+        "term": term,
+        "retmode": "json",
+        "retmax": 0,
+        "sort": "relevance",
+        "usehistory": "y"
+    })
+    if webenv:
+        search_params["WebEnv"] = webenv
+    resp = await eutils_get("esearch", search_params)
+    result = response_json(resp).get("esearchresult", {})
+    return {
+        "count": int(result.get("count", 0)),
+        "webenv": result.get("webenv"),
+        "query_key": result.get("querykey")
+    }
+
+async def esummary_history_page(webenv: str, query_key: str, retstart: int, retmax: int) -> tuple:
+    """Fetch one page of esummary records from the History server. Returns (id_list, uid_data)."""
+    summary_params = get_params({
+        "db": "pubmed",
+        "WebEnv": webenv,
+        "query_key": query_key,
+        "retstart": retstart,
+        "retmax": retmax,
+        "retmode": "json"
+    })
+    try:
+        resp = await eutils_get("esummary", summary_params)
+    except EutilsResponseError:
+        # The History server forgets WebEnvs after a while
+        raise LookupError("WebEnv expired") from None
+    uid_data = response_json(resp)["result"]
+    return uid_data.get("uids", []), uid_data
+
+async def paged_search(term: str, max_results: int, cursor: str, formatter, no_results: str) -> str:
+    """Search via the History server and return one page of results plus a cursor for the next page.
+    no_results is the calling tool's message for an empty result."""
+    if cursor:
+        try:
+            state = decode_cursor(cursor)
+        except ValueError:
+            return "Error: Invalid cursor. Re-run the search without a cursor."
+        term = state["term"]
+    else:
+        state = {"term": term, "start": 0, "size": max(1, min(max_results, MAX_SEARCH_RESULTS))}
+
+    if state.get("webenv"):
+        history = {"count": state.get("count", 0), "webenv": state["webenv"], "query_key": state["query_key"]}
+    else:
+        history = await esearch_history(term)
+    if not history["count"] or not history["webenv"]:
+        return no_results
+
+    start = state["start"]
+    end = min(start + state["size"], history["count"])
+    pages = [(s, min(HISTORY_PAGE_SIZE, end - s)) for s in range(start, end, HISTORY_PAGE_SIZE)]
+
+    async def fetch_pages(history):
+        page_data = await asyncio.gather(*(
+            esummary_history_page(history["webenv"], history["query_key"], s, n) for s, n in pages
+        ), return_exceptions=True)
+        for result in page_data:
+            if isinstance(result, Exception) and not isinstance(result, DeadlineExceeded):
+                raise result
+        return page_data
+
+    try:
+        page_data = await fetch_pages(history)
+    except LookupError:
+        logger.info("WebEnv expired, re-running esearch")
+        history = await esearch_history(term)
+        page_data = await fetch_pages(history)
+
+    # Pages that missed the deadline end the response; the cursor resumes from there
+    stopped = None
+    id_list = []
+    uid_data = {}
+    for (page_start, _), result in zip(pages, page_data):
+        if isinstance(result, DeadlineExceeded):
+            stopped = result
+            end = page_start
+            break
+        ids, data = result
+        id_list.extend(ids)
+        uid_data.update(data)
+    if stopped is not None and not id_list:
+        raise stopped
+
+    next_cursor = None
+    if end < history["count"]:
+        next_cursor = encode_cursor({
+            "term": term,
+            "start": end,
+            "size": state["size"],
+            "count": history["count"],
+            "webenv": history["webenv"],
+            "query_key": history["query_key"]
+        })
+
+    results = formatter(id_list, uid_data)
+    prefetch_details([r["pmid"] for r in results])
+    if stopped is not None:
+        return render_result(partial_result(results, stopped, count=history["count"], retstart=start, next_cursor=next_cursor))
+    return render_result({
+        "count": history["count"],
+        "retstart": start,
+        "results": results,
+        "next_cursor": next_cursor
+    })
+
+# --- Local index backend ---
+
+# "eutils" queries NCBI live; "local" serves searches and details from an offline
+# index built with local_index.py
+SEARCH_BACKEND = os.environ.get("PUBMED_BACKEND", "eutils").strip().lower()
+LOCAL_INDEX_PATH = os.environ.get("PUBMED_LOCAL_INDEX", "pubmed_index.sqlite3")
+
+_local_index = None
+
+def use_local_index() -> bool:
+    return SEARCH_BACKEND == "local"
+
+def get_local_index():
+    """Open the local index on first use"""
+    global _local_index
+    if _local_index is None:
+        from local_index import LocalIndex
+        if not os.path.exists(LOCAL_INDEX_PATH):
+            raise FileNotFoundError(f"Local index not found: {LOCAL_INDEX_PATH}. Build it with 'python local_index.py ingest'.")
+        _local_index = LocalIndex(LOCAL_INDEX_PATH)
+    return _local_index
+
+def close_local_index():
+    global _local_index
+    if _local_index is not None:
+        _local_index.close()
+        _local_index = None
+
+async def local_search(term: str, filters: dict, max_results: int, cursor: str, use_history: bool,
+                       formatter, no_results: str) -> str:
+    """Search the local index; supports the same cursor paging and messages as the History server path"""
+    paged = bool(cursor or use_history or max_results > HISTORY_THRESHOLD)
+    if cursor:
+        try:
+            state = decode_cursor(cursor)
+        except ValueError:
+            return "Error: Invalid cursor. Re-run the search without a cursor."
+        term = state["term"]
+        filters = state.get("filters", {})
+    else:
+        state = {"term": term, "start": 0, "size": max(1, min(max_results, MAX_SEARCH_RESULTS))}
+
+    index = get_local_index()
+    count, id_list = await asyncio.to_thread(
+        index.search, term, limit=state["size"], offset=state["start"], **filters
+    )
+    if not id_list:
+        return no_results
+    uid_data = await asyncio.to_thread(index.summaries, id_list)
+    results = formatter(id_list, uid_data)
+    if not paged:
+        return render_result(results)
+
+    end = state["start"] + len(id_list)
+    next_cursor = None
+    if end < count:
+        next_cursor = encode_cursor({"term": term, "filters": filters, "start": end, "size": state["size"]})
+    return render_result({
+        "count": count,
+        "retstart": state["start"],
+        "results": results,
+        "next_cursor": next_cursor
+    })
+
+# --- Output shaping ---
+
+OUTPUT_FORMATS = ("json", "compact", "text")
+# Rough token estimate used for budgets (English text averages ~4 characters per token)
+CHARS_PER_TOKEN = 4
+# Abstracts are not shortened below this many characters to fit a budget
+MIN_ABSTRACT_CHARS = env_int("PUBMED_MIN_ABSTRACT_CHARS", 200)
+# Result keys holding per-query / per-saved-search groups of results
+GROUP_KEYS = ("queries", "watches")
+# Keys of each tool's result records: the names its `fields` argument accepts
+SEARCH_RESULT_FIELDS = ("pmid", "title", "authors", "pubdate", "source", "types")
+DETAILS_RESULT_FIELDS = ("pmid", "title", "authors", "journal", "doi", "pmc_id", "abstract", "links")
+RESULT_FIELDS = {
+    "search_pubmed": SEARCH_RESULT_FIELDS,
+    "advanced_search_pubmed": SEARCH_RESULT_FIELDS,
+    "batch_search": SEARCH_RESULT_FIELDS + ("also_in",),
+    "check_updates": SEARCH_RESULT_FIELDS,
+    "get_paper_details": DETAILS_RESULT_FIELDS,
+    "get_papers_details": DETAILS_RESULT_FIELDS + ("error",),
+    "get_similar_articles": SEARCH_RESULT_FIELDS + ("is_review",),
+    "expand_related_articles": SEARCH_RESULT_FIELDS + ("score", "hop", "linked_from", "high_impact"),
+    "list_saved_searches": ("name", "query", "author", "journal", "publication_types", "term", "new_since", "last_checked"),
+}
+
+# Output arguments accepted by every tool
+OUTPUT_OPTIONS_SCHEMA = {
+    "format": {"type": "string", "enum": list(OUTPUT_FORMATS), "default": "json", "description": "json (pretty-printed), compact (minified JSON, author lists as names) or text (one tab-separated row per result)"},
+    "budget": {"type": "integer", "description": "Approximate token budget for the whole response. Abstracts are shortened first, then trailing results are omitted (reported as 'omitted')"},
+    "fields": {"type": "array", "items": {"type": "string"}, "description": "Only return these result fields (pmid is always included); 'source' is the journal abbreviation. Unknown names are an error listing the valid ones"},
+    "max_authors": {"type": "integer", "description": "Truncate author lists to this many names, followed by 'et al.'"},
+    "abstract_chars": {"type": "integer", "description": "Truncate abstracts to this many characters"}
+}
+
+output_options = contextvars.ContextVar("output_options", default=None)
+
+class OutputOptionsError(ValueError):
+    """Invalid output arguments; the tool call answers with an "Error: ..." text"""
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def truncate_text(text: str, limit: int) -> str:
+    """Shorten text to at most `limit` characters, cutting at a word boundary"""
+    if not text or len(text) <= limit:
+        return text
+    if limit <= 1:
+        return ""
+    cut = text[:limit - 1]
+    space = cut.rfind(" ")
+    if space > limit // 2:
+        cut = cut[:space]
+    return cut.rstrip(" ,;:.") + "…"
+
+class OutputOptions:
+    """Per-call output settings taken from the tool arguments"""
+
+    __slots__ = ("format", "budget", "fields", "max_authors", "abstract_chars")
+
+    def __init__(self, format: str = "json", budget: int = None, fields: list = None,
+                 max_authors: int = None, abstract_chars: int = None):
+        if format not in OUTPUT_FORMATS:
+            raise OutputOptionsError(f"format must be one of: {', '.join(OUTPUT_FORMATS)}")
+        self.format = format
+        self.budget = max(1, int(budget)) if budget else None
+        self.fields = set(fields) | {"pmid", "error"} if fields else None
+        self.max_authors = max(1, int(max_authors)) if max_authors else None
+        self.abstract_chars = max(0, int(abstract_chars)) if abstract_chars is not None else None
+
+    @classmethod
+    def from_args(cls, args: dict, tool: str):
+        """Options for a tools/call, or None when the defaults (pretty JSON, everything) apply"""
+        format = args.get("format", "json")
+        if format == "prometheus":
+            if tool != "server_stats":
+                raise OutputOptionsError("format 'prometheus' is only available for server_stats")
+            format = "json"  # server_stats renders this one itself
+        fields = args.get("fields")
+        if isinstance(fields, str):
+            fields = fields.replace(",", " ").split()
+        if fields:
+            valid = RESULT_FIELDS.get(tool, ())
+            if not valid:
+                raise OutputOptionsError(f"{tool} returns no result records to select fields from")
+            unknown = [str(f) for f in fields if f not in valid]
+            if unknown:
+                raise OutputOptionsError(f"Unknown fields: {', '.join(unknown)}. Valid fields: {', '.join(valid)}")
+        options = cls(format, args.get("budget"), fields, args.get("max_authors"), args.get("abstract_chars"))
+        if format == "json" and options.budget is None and options.fields is None \
+                and options.max_authors is None and options.abstract_chars is None:
+            return None
+        return options
+
+    def shape(self, record: dict) -> dict:
+        """Apply field selection and author/abstract truncation to one result"""
+        shaped = {}
+        for key, value in record.items():
+            if self.fields is not None and key not in self.fields:
+                continue
+            if key == "authors":
+                value = self.shape_authors(value)
+            elif key == "abstract" and self.abstract_chars is not None:
+                value = truncate_text(value, self.abstract_chars)
+            shaped[key] = value
+        return shaped
+
+    def shape_authors(self, authors):
+        if isinstance(authors, str):
+            if self.max_authors is None:
+                return authors
+            names = authors.split(", ")
+            return authors if len(names) <= self.max_authors else ", ".join(names[:self.max_authors]) + " et al."
+        if self.format != "json" or self.max_authors is not None:
+            # esummary author objects carry ids and types nobody reads: keep the names
+            authors = [a.get("name", "") if isinstance(a, dict) else a for a in authors]
+        if self.max_authors is not None and len(authors) > self.max_authors:
+            authors = authors[:self.max_authors] + ["et al."]
+        return authors
+
+    def serialize(self, envelope, records: list, single: bool, omitted: int) -> str:
+        if self.format == "text":
+            return self.render_text(envelope, records, omitted)
+        if envelope is not None:
+            obj = {**envelope, "results": records}
+        elif single:
+            obj = records[0] if records else {}
+        else:
+            obj = records
+        if omitted:
+            obj = {"results": obj, "omitted": omitted} if isinstance(obj, list) else {**obj, "omitted": omitted}
+        return dump_json(obj, compact=self.format == "compact")
+
+    def render_text(self, envelope, records: list, omitted: int) -> str:
+        """Tab-separated rows under a header line; abstracts go on an indented line below their row"""
+        lines = [f"{k}: {v}" for k, v in (envelope or {}).items() if v is not None]
+        columns = []
+        for record in records:
+            columns.extend(k for k in record if k != "abstract" and k not in columns)
+        if records:
+            lines.append("\t".join(columns))
+        for record in records:
+            lines.append("\t".join(text_cell(record.get(k)) for k in columns))
+            if record.get("abstract"):
+                lines.append("    " + " ".join(record["abstract"].split()))
+        if omitted:
+            lines.append(f"[{omitted} more results omitted to fit the budget]")
+        return "\n".join(lines)
+
+    def fit(self, envelope, records: list, single: bool) -> tuple:
+        """Shrink abstracts, then drop trailing results, until the output fits the budget.
+
+        Returns (records, omitted). At least one result is always kept.
+        """
+        limit = self.budget * CHARS_PER_TOKEN
+        if len(self.serialize(envelope, records, single, 0)) <= limit:
+            return records, 0
+
+        with_abstract = [i for i, r in enumerate(records) if r.get("abstract")]
+        if with_abstract:
+            bare = [{**r, "abstract": ""} if r.get("abstract") else r for r in records]
+            room = limit - len(self.serialize(envelope, bare, single, 0))
+            allowance = room // len(with_abstract)
+            # Escaping and ellipses make the estimate slightly optimistic; tighten until it fits
+            while allowance >= MIN_ABSTRACT_CHARS:
+                trial = [{**r, "abstract": truncate_text(r["abstract"], allowance)} if r.get("abstract") else r for r in records]
+                if len(self.serialize(envelope, trial, single, 0)) <= limit:
+                    return trial, 0
+                allowance = int(allowance * 0.9)
+            records = [{**r, "abstract": truncate_text(r["abstract"], MIN_ABSTRACT_CHARS)} if r.get("abstract") else r for r in records]
+
+        # Largest prefix of the ranked results that fits
+        low, high = 1, len(records)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if len(self.serialize(envelope, records[:mid], single, len(records) - mid)) <= limit:
+                low = mid
+            else:
+                high = mid - 1
+        return records[:low], len(records) - low
+
+    def render_groups(self, obj: dict, key: str) -> str:
+        """Results grouped per query (batch_search) or saved search (check_updates).
+        A budget keeps the same number of top results in every group, as many as fit."""
+        groups = [{**g, "results": [self.shape(r) for r in g["results"]]} if "results" in g else g
+                  for g in obj[key]]
+        total = sum(len(g.get("results", ())) for g in groups)
+
+        def serialize(keep: int) -> str:
+            kept = [{**g, "results": g["results"][:keep]} if "results" in g else g for g in groups]
+            doc = {**obj, key: kept}
+            omitted = total - sum(len(g.get("results", ())) for g in kept)
+            if omitted:
+                doc["omitted"] = omitted
+            if self.format != "text":
+                return dump_json(doc, compact=self.format == "compact")
+            lines = [f"{k}: {dump_json(v, compact=True) if isinstance(v, (dict, list)) else v}"
+                     for k, v in doc.items() if k != key]
+            for g in kept:
+                lines.append("")
+                lines.append(self.render_text({k: v for k, v in g.items() if k != "results"}, g.get("results", []), 0))
+            return "\n".join(lines)
+
+        keep = max((len(g.get("results", ())) for g in groups), default=0)
+        if self.budget is not None and len(serialize(keep)) > self.budget * CHARS_PER_TOKEN:
+            low, high = 1, keep
+            while low < high:
+                mid = (low + high + 1) // 2
+                if len(serialize(mid)) <= self.budget * CHARS_PER_TOKEN:
+                    low = mid
+                else:
+                    high = mid - 1
+            keep = low
+        return serialize(keep)
+
+    def render(self, obj) -> str:
+        for key in GROUP_KEYS:
+            if isinstance(obj, dict) and isinstance(obj.get(key), list):
+                return self.render_groups(obj, key)
+        if isinstance(obj, list):
+            envelope, records, single = None, obj, False
+        elif isinstance(obj, dict) and isinstance(obj.get("results"), list):
+            envelope = {k: v for k, v in obj.items() if k != "results"}
+            records, single = obj["results"], False
+        elif isinstance(obj, dict) and "pmid" in obj:
+            envelope, records, single = None, [obj], True
+        else:
+            # Not a result list (e.g. server statistics)
+            return dump_json(obj, compact=self.format != "json")
+
+        records = [self.shape(r) for r in records if isinstance(r, dict)]
+        omitted = 0
+        if self.budget is not None:
+            records, omitted = self.fit(envelope, records, single)
+        return self.serialize(envelope, records, single, omitted)
+
+def text_cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, dict):
+        value = " ".join(str(v) for v in value.values())
+    elif isinstance(value, list):
+        value = ", ".join(str(v) for v in value)
+    return " ".join(str(value).split())
+
+def render_result(obj) -> str:
+    """Serialize a tool result using the output options of the current call"""
+    options = output_options.get()
+    if options is None:
+        return dump_json(obj)
+    return options.render(obj)
+
+def partial_result(results: list, reason, **fields) -> dict:
+    """Envelope for results cut short by the tool call's deadline or upstream budget"""
+    return {**fields, "partial": True, "partial_reason": str(reason), "results": results}
+
+# --- Tool Implementations ---
+
+def summary_articles(id_list: list, uid_data: dict) -> list:
+    """Articles for the PMIDs of id_list that have an esummary record, in id_list order"""
+    return [Article.from_summary(pmid, uid_data[pmid]) for pmid in id_list if pmid in uid_data]
+
+def format_search_results(id_list: list, uid_data: dict) -> list:
+    """Build search_pubmed results from esummary data, original articles before reviews"""
+    articles = summary_articles(id_list, uid_data)
+    rank = {pmid: i for i, pmid in enumerate(id_list)}
+    articles.sort(key=lambda a: (a.is_review(), rank[a.pmid]))
+    return [a.search_result() for a in articles]
+
+def format_advanced_results(id_list: list, uid_data: dict) -> list:
+    """Build advanced_search_pubmed results from esummary data"""
+    return [a.advanced_result() for a in summary_articles(id_list, uid_data)]
+
+async def search_pubmed(
+    query: str,
+    max_results: int = 5,
+    cursor: str = None,
+    use_history: bool = False,
+    publication_types: list = None,
+    rank_by_type: bool = False
+) -> str:
+    """Search PubMed for papers matching the query"""
+    logger.info(f"Searching PubMed for: {query}")
+    try:
+        tags = parse_publication_types(publication_types)
+    except ValueError as e:
+        return f"Error: {e}"
+    formatter = ranked_by_type(format_search_results) if rank_by_type else format_search_results
+    if use_local_index():
+        filters = {"pub_types": publication_type_names(tags)} if tags else {}
+        return await local_search(query, filters, max_results, cursor, use_history, formatter, "No results found.")
+    term = f"({query}) AND {publication_type_query(tags)}" if tags else query
+    if cursor or use_history or max_results > HISTORY_THRESHOLD:
+        return await paged_search(term, max_results, cursor, formatter, "No results found.")
+
+    search_params = get_params({
+        "db": "pubmed",
+        "term": term,
+        "retmode": "json",
+        "retmax": max_results,
+        "sort": "relevance"
+    })
+    resp = await eutils_get("esearch", search_params)
+    data = response_json(resp)
+    id_list = data.get("esearchresult", {}).get("idlist", [])
+    
+    if not id_list:
+        return "No results found."
+
+    summary_params = get_params({
+        "db": "pubmed",
+        "id": ",".join(id_list),
+        "retmode": "json"
+    })
+    try:
+        resp = await eutils_get("esummary", summary_params)
+    except DeadlineExceeded as e:
+        # The ranked PMIDs are all there is
+        return render_result(partial_result([{"pmid": pmid} for pmid in id_list], e))
+    summary_data = response_json(resp)
+    
+    results = formatter(id_list, summary_data.get("result", {}))
+    prefetch_details([r["pmid"] for r in results])
+    return render_result(results)
+
+async def get_paper_details(pmid: str) -> str:
+    """Get detailed information (Abstract, Authors, DOI, Links) for a specific PMID"""
+    logger.info(f"Fetching details for PMID: {pmid}")
+    if use_local_index():
+        records = await asyncio.to_thread(get_local_index().details, [str(pmid)])
+        if str(pmid) not in records:
+            return f"Error: PMID {pmid} not found. Please check the PMID and try again."
+        return render_result(records[str(pmid)])
+    if prefetcher is not None:
+        article = await prefetcher.get(pmid)
+        if article is not None:
+            return render_result(article.details())
+    fetch_params = get_params({"db": "pubmed", "id": pmid, "retmode": "xml"})
+    resp = await eutils_get("efetch", fetch_params)
+    with metrics.timer("parse_ms", format="xml"):
+        elem = next(iter_pubmed_articles(resp.content), None)
+        if elem is None:
+            return f"Error: PMID {pmid} not found. Please check the PMID and try again."
+        try:
+            article = Article.from_element(elem)
+        except AttributeError:
+            return f"Error: PMID {pmid} not found or invalid. Please check the PMID and try again."
+        except Exception as e:
+            logger.error(f"Error parsing details for PMID {pmid}: {e}")
+            return f"Error retrieving details for PMID {pmid}: {str(e)}"
+    return render_result(article.details())
+
+async def get_papers_details(pmids: list) -> str:
+    """Get details for many PMIDs at once using chunked, concurrent efetch requests"""
+    if isinstance(pmids, str):
+        pmids = pmids.replace(",", " ").split()
+    # Deduplicate while keeping the caller's order
+    requested = list(dict.fromkeys(str(p).strip() for p in pmids or [] if str(p).strip()))
+    logger.info(f"Fetching details for {len(requested)} PMIDs")
+    if not requested:
+        return "Error: No PMIDs given."
+    if len(requested) > MAX_BATCH_PMIDS:
+        return f"Error: Too many PMIDs ({len(requested)}). The maximum is {MAX_BATCH_PMIDS} per call."
+
+    valid = [p for p in requested if p.isdigit()]
+    if use_local_index():
+        records, errors = await asyncio.to_thread(get_local_index().details, valid), {}
+    else:
+        articles = {}
+        if prefetcher is not None:
+            for pmid in valid:
+                article = await prefetcher.get(pmid)
+                if article is not None:
+                    articles[pmid] = article
+        fetched, errors = await fetch_article_records([p for p in valid if p not in articles])
+        articles.update(fetched)
+        records = {pmid: article.details() for pmid, article in articles.items()}
+
+    results = []
+    for pmid in requested:
+        if pmid in records:
+            results.append(records[pmid])
+        elif not pmid.isdigit():
+            results.append({"pmid": pmid, "error": "Invalid PMID"})
+        else:
+            results.append({"pmid": pmid, "error": errors.get(pmid, "PMID not found")})
+
+    missed = sum(1 for error in errors.values() if error == DEADLINE_ERROR)
+    if missed:
+        return render_result(partial_result(results, f"{missed} PMIDs not fetched before the deadline"))
+    return render_result(results)
+
+def build_search_term(query: str, author: str = None, journal: str = None,
+                      pub_date_from: str = None, pub_date_to: str = None, tags: list = None) -> str:
+    """Entrez term for a query plus advanced_search_pubmed-style filters"""
+    query_parts = [f"({query})"]
+    
+    if author:
+        # Handle various author name formats
+        query_parts.append(f"({author}[Author])")
+    
+    if journal:
+        # Support both full names and abbreviations
+        query_parts.append(f"({journal}[Journal])")
+    
+    if pub_date_from or pub_date_to:
+        # Date range filter
+        date_from = pub_date_from if pub_date_from else "1900/01/01"
+        date_to = pub_date_to if pub_date_to else "3000/12/31"
+        query_parts.append(f'("{date_from}"[PDAT] : "{date_to}"[PDAT])')
+    
+    if tags:
+        # Filtered by NCBI before paging, so every returned slot is a matching article
+        query_parts.append(publication_type_query(tags))
+    
+    return " AND ".join(query_parts)
+
+async def advanced_search_pubmed(
+    query: str,
+    author: str = None,
+    journal: str = None,
+    pub_date_from: str = None,
+    pub_date_to: str = None,
+    max_results: int = 5,
+    cursor: str = None,
+    use_history: bool = False,
+    publication_types: list = None,
+    rank_by_type: bool = False
+) -> str:
+    """
+    Advanced search with filters for author, journal, publication date and publication type.
+    Supports both structured parameters and natural language queries.
+    """
+    logger.info(f"Advanced search - Query: {query}, Author: {author}, Journal: {journal}")
+    try:
+        tags = parse_publication_types(publication_types)
+    except ValueError as e:
+        return f"Error: {e}"
+    formatter = ranked_by_type(format_advanced_results) if rank_by_type else format_advanced_results
+    final_query = build_search_term(query, author, journal, pub_date_from, pub_date_to, tags)
+    no_results = f"No results found for query: {final_query}"
+    if use_local_index():
+        filters = {"author": author, "journal": journal, "date_from": pub_date_from, "date_to": pub_date_to}
+        if tags:
+            filters["pub_types"] = publication_type_names(tags)
+        return await local_search(query, filters, max_results, cursor, use_history, formatter, no_results)
+    
+    logger.info(f"Constructed query: {final_query}")
+    
+    if cursor or use_history or max_results > HISTORY_THRESHOLD:
+        return await paged_search(final_query, max_results, cursor, formatter, no_results)
+
+    # Use the same search logic as search_pubmed
+    search_params = get_params({
+        "db": "pubmed",
+        "term": final_query,
+        "retmode": "json",
+        "retmax": max_results,
+        "sort": "relevance"
+    })
+    resp = await eutils_get("esearch", search_params)
+    data = response_json(resp)
+    id_list = data.get("esearchresult", {}).get("idlist", [])
+    
+    if not id_list:
+        return no_results
+
+    summary_params = get_params({
+        "db": "pubmed",
+        "id": ",".join(id_list),
+        "retmode": "json"
+    })
+    try:
+        resp = await eutils_get("esummary", summary_params)
+    except DeadlineExceeded as e:
+        # The ranked PMIDs are all there is
+        return render_result(partial_result([{"pmid": pmid} for pmid in id_list], e))
+    summary_data = response_json(resp)
+    
+    results = formatter(id_list, summary_data.get("result", {}))
+    prefetch_details([r["pmid"] for r in results])
+    return render_result(results)
+
+# Queries per batch_search call
+MAX_BATCH_QUERIES = env_int("PUBMED_MAX_BATCH_QUERIES", 20)
+
+BATCH_FILTERS = ("author", "journal", "pub_date_from", "pub_date_to")
+
+def parse_batch_queries(queries, max_results: int, publication_types) -> list:
+    """Normalize batch_search query items (strings or objects with per-query filters)"""
+    if isinstance(queries, str):
+        queries = [queries]
+    if not isinstance(queries, list) or not queries:
+        raise ValueError("No queries given.")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise ValueError(f"Too many queries ({len(queries)}). The maximum is {MAX_BATCH_QUERIES} per call.")
+    default_tags = parse_publication_types(publication_types)
+    items = []
+    for i, entry in enumerate(queries):
+        if isinstance(entry, str):
+            entry = {"query": entry}
+        if not isinstance(entry, dict) or not str(entry.get("query") or "").strip():
+            raise ValueError(f"Query {i} has no query text.")
+        limit = entry.get("max_results", max_results)
+        if not isinstance(limit, int) or limit < 1:
+            raise ValueError(f"Query {i}: max_results must be a positive integer.")
+        tags = parse_publication_types(entry["publication_types"]) if "publication_types" in entry else default_tags
+        items.append({
+            "query": str(entry["query"]).strip(),
+            **{key: entry.get(key) for key in BATCH_FILTERS},
+            "tags": tags,
+            # No cursors here: each query returns one page of at most HISTORY_THRESHOLD results
+            "max_results": min(limit, HISTORY_THRESHOLD),
+        })
+    return items
+
+async def batch_esearch(item: dict) -> tuple:
+    """esearch for one batch_search query; returns (count, ranked PMIDs)"""
+    if use_local_index():
+        filters = {"author": item["author"], "journal": item["journal"],
+                   "date_from": item["pub_date_from"], "date_to": item["pub_date_to"]}
+        if item["tags"]:
+            filters["pub_types"] = publication_type_names(item["tags"])
+        return await asyncio.to_thread(get_local_index().search, item["query"], limit=item["max_results"], **filters)
+    term = build_search_term(item["query"], *(item[key] for key in BATCH_FILTERS), item["tags"])
+    search_params = get_params({
+        "db": "pubmed",
+        "term": term,
+        "retmode": "json",
+        "retmax": item["max_results"],
+        "sort": "relevance"
+    })
+    resp = await eutils_get("esearch", search_params)
+    result = response_json(resp).get("esearchresult", {})
+    return int(result.get("count", 0) or 0), result.get("idlist", [])
+
+def batch_overlap(id_lists: dict) -> dict:
+    """Overlap statistics between the PMID sets of the queries (index -> ranked PMIDs)"""
+    sets = {i: set(ids) for i, ids in id_lists.items()}
+    seen = Counter(pmid for ids in sets.values() for pmid in ids)
+    pairs = []
+    for i, j in itertools.combinations(sorted(sets), 2):
+        shared = len(sets[i] & sets[j])
+        if shared:
+            pairs.append({"queries": [i, j], "shared": shared,
+                          "jaccard": round(shared / len(sets[i] | sets[j]), 3)})
+    return {
+        "total_results": sum(len(ids) for ids in sets.values()),
+        "unique_pmids": len(seen),
+        "shared_pmids": sum(1 for n in seen.values() if n > 1),
+        "pairs": pairs,
+    }
+
+async def batch_search(
+    queries: list,
+    max_results: int = 5,
+    publication_types: list = None,
+    rank_by_type: bool = False
+) -> str:
+    """Run several searches at once; summaries for all of them come from one batched esummary fan-in"""
+    try:
+        items = parse_batch_queries(queries, max_results, publication_types)
+    except ValueError as e:
+        return f"Error: {e}"
+    logger.info(f"Batch search of {len(items)} queries")
+    formatter = ranked_by_type(format_search_results) if rank_by_type else format_search_results
+
+    # The esearches share the rate limiter like any other concurrent calls
+    outcomes = await asyncio.gather(*(batch_esearch(item) for item in items), return_exceptions=True)
+    id_lists = {}
+    reasons = []
+    for i, outcome in enumerate(outcomes):
+        if isinstance(outcome, DeadlineExceeded):
+            reasons.append(f"query {i}: {outcome}")
+        elif isinstance(outcome, BaseException):
+            logger.error(f"Batch query {i} failed: {outcome}")
+        else:
+            id_lists[i] = outcome[1]
+
+    merged = list(dict.fromkeys(pmid for ids in id_lists.values() for pmid in ids))
+    uid_data = None
+    if merged:
+        try:
+            if use_local_index():
+                uid_data = await asyncio.to_thread(get_local_index().summaries, merged)
+            else:
+                uid_data = await fetch_summaries(merged)
+        except DeadlineExceeded as e:
+            # The ranked PMIDs are all there is
+            reasons.append(str(e))
+
+    found_in = {}
+    for i, ids in id_lists.items():
+        for pmid in ids:
+            found_in.setdefault(pmid, []).append(i)
+
+    groups = []
+    for i, (item, outcome) in enumerate(zip(items, outcomes)):
+        if isinstance(outcome, BaseException):
+            groups.append({"index": i, "query": item["query"], "error": str(outcome) or type(outcome).__name__})
+            continue
+        count, ids = outcome
+        results = formatter(ids, uid_data) if uid_data is not None else [{"pmid": pmid} for pmid in ids]
+        for record in results:
+            others = [j for j in found_in[record["pmid"]] if j != i]
+            if others:
+                record["also_in"] = others
+        groups.append({"index": i, "query": item["query"], "count": count, "results": results})
+
+    # Warm the detail cache with the top hit of every query first
+    prefetch_details([pmid for rank in itertools.zip_longest(*id_lists.values()) for pmid in rank if pmid])
+    result = {"queries": groups, "overlap": batch_overlap(id_lists)}
+    if reasons:
+        result = {"partial": True, "partial_reason": "; ".join(reasons), **result}
+    return render_result(result)
+
+# Neighbours considered per requested result when get_similar_articles filters by journal or publication type
+SIMILAR_CANDIDATE_FACTOR = env_int("PUBMED_SIMILAR_CANDIDATE_FACTOR", 3)
+
+async def get_similar_articles(
+    pmid: str,
+    max_results: int = 5,
+    high_impact_only: bool = False,
+    publication_types: list = None,
+    rank_by_type: bool = False
+) -> str:
+    """
+    Get similar articles for a given PMID using PubMed's elink API.
+    Optionally filter to high-impact journals and/or publication types.
+    """
+    logger.info(f"Getting similar articles for PMID: {pmid}, high_impact_only: {high_impact_only}")
+    try:
+        tags = parse_publication_types(publication_types)
+    except ValueError as e:
+        return f"Error: {e}"
+    
+    # Get similar article PMIDs using elink
+    elink_params = get_params({
+        "dbfrom": "pubmed",
+        "db": "pubmed",
+        "id": pmid,
+        "cmd": "neighbor_score",
+        "retmode": "json"
+    })
+    
+    resp = await eutils_get("elink", elink_params)
+    data = response_json(resp)
+    
+    try:
+        linksets = data.get("linksets", [])
+        if not linksets:
+            return "No similar articles found."
+        
+        linkset = linksets[0]
+        linksetdbs = linkset.get("linksetdbs", [])
+        
+        similar_pmids = []
+        for db in linksetdbs:
+            if db.get("linkname") == "pubmed_pubmed":
+                for link in db.get("links", []):
+                    if isinstance(link, dict):
+                        similar_pmids.append(str(link.get("id", "")))
+                    else:
+                        similar_pmids.append(str(link))
+                break
+        
+        if not similar_pmids:
+            return "No similar articles found."
+        
+        # Separate results by journal quality; publication types come from the esummary pubtype list
+        high_impact_results = []
+        other_results = []
+        
+        # Summarize the top max_results neighbours first; only when filters leave too few
+        # are the remaining candidates fetched, in one more request
+        batches = [similar_pmids[:max_results]]
+        if high_impact_only or tags:
+            batches.append(similar_pmids[max_results:max_results * SIMILAR_CANDIDATE_FACTOR])
+        stopped = None
+        for page in batches:
+            if not page:
+                break
+            summary_params = get_params({
+                "db": "pubmed",
+                "id": ",".join(page),
+                "retmode": "json"
+            })
+            try:
+                resp = await eutils_get("esummary", summary_params)
+            except DeadlineExceeded as e:
+                if page is batches[0]:
+                    raise
+                # Out of time for more candidates: go with the first batch
+                stopped = e
+                break
+            uid_data = response_json(resp).get("result", {})
+            
+            for article in summary_articles(page, uid_data):
+                types = article.types()
+                if tags and not any(tag in tags for tag in types):
+                    continue
+                review_tag = next((tag for tag in types if tag in REVIEW_LABELS), None)
+                paper_info = {
+                    "pmid": article.pmid,
+                    "title": article.title + (f" [{REVIEW_LABELS[review_tag]}]" if review_tag else ""),
+                    "pubdate": article.pubdate,
+                    "source": article.source or "",
+                    "authors": article.author_records,
+                    "is_review": review_tag is not None
+                }
+                if types:
+                    paper_info["types"] = types
+                
+                # Categorize by journal impact
+                tier = article.tier()
+                if tier is not None and tier <= HIGH_IMPACT_MAX_TIER:
+                    high_impact_results.append((tier, paper_info))
+                else:
+                    other_results.append(paper_info)
+            
+            found = len(high_impact_results) if high_impact_only else len(high_impact_results) + len(other_results)
+            if found >= max_results:
+                break
+        
+        # Better tiers first; sort is stable, so elink relevance order is kept within a tier
+        high_impact_results.sort(key=lambda x: x[0])
+        high_impact_results = [paper_info for _, paper_info in high_impact_results]
+        
+        # Smart fallback logic
+        if high_impact_only:
+            # Prefer high-impact journals, but fallback if too few
+            if len(high_impact_results) >= max_results:
+                results = high_impact_results[:max_results]
+            elif len(high_impact_results) >= max_results // 2:
+                # If we have at least half from high-impact, use only those
+                results = high_impact_results[:max_results]
+            else:
+                # Not enough high-impact papers, include others
+                results = high_impact_results + other_results
+                results = results[:max_results]
+                logger.info(f"Fallback: Only {len(high_impact_results)} high-impact papers found, including others")
+        else:
+            # No filtering, combine all results
+            results = high_impact_results + other_results
+            results = results[:max_results]
+        
+        if rank_by_type:
+            results.sort(key=lambda r: evidence_rank(r.get("types", ())))
+        
+        if not results:
+            return "No similar articles found."
+        
+        if stopped is not None:
+            return render_result(partial_result(results, stopped))
+        return render_result(results)
+        
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting similar articles: {e}")
+        return f"Error retrieving similar articles: {str(e)}"
+
+# Seed PMIDs per elink request during graph expansion
+ELINK_BATCH_SIZE = env_int("PUBMED_ELINK_BATCH_SIZE", 50)
+
+async def expand_related_articles(
+    pmids: list,
+    hops: int = 2,
+    max_results: int = 20,
+    frontier_size: int = 10,
+    combine: str = "sum",
+    min_score: float = 0.0,
+    high_impact_only: bool = False,
+    max_api_calls: int = 30
+) -> str:
+    """
+    Expand from seed PMIDs through PubMed's related-articles graph for several hops.
+    Each hop issues batched elink requests for the whole frontier concurrently.
+    At most max_api_calls requests go upstream (cached responses are free); when the
+    budget runs out before the summaries, the score-only ranking is returned as partial.
+    """
+    if isinstance(pmids, str):
+        pmids = pmids.replace(",", " ").split()
+    seeds = list(dict.fromkeys(str(p).strip() for p in pmids or [] if str(p).strip().isdigit()))
+    logger.info(f"Expanding related articles from {len(seeds)} seeds, hops={hops}, combine={combine}")
+    if not seeds:
+        return "Error: No valid seed PMIDs given."
+    if combine not in ("sum", "max"):
+        return "Error: combine must be 'sum' or 'max'."
+
+    hops = max(1, min(hops, 5))
+    counter = Counter()
+    upstream_requests.set(counter)
+    visited = set(seeds)
+    scores = {}
+    first_hop = {}
+    linked_from = {}
+    summaries = {}
+    frontier = seeds
+    hops_completed = 0
+    stopped = None
+    # Set when a batch was skipped because the budget ran out
+    over_budget = False
+
+    async def within_budget(fetch, batches: list) -> list:
+        """Run fetch over batches in rounds no larger than the remaining budget; returns
+        the results (or exceptions) of the batches that ran"""
+        nonlocal over_budget
+        results = []
+        while batches:
+            allowed = max(0, max_api_calls - counter["requests"])
+            if not allowed:
+                over_budget = True
+                break
+            round_batches, batches = batches[:allowed], batches[allowed:]
+            results.extend(await asyncio.gather(*(fetch(b) for b in round_batches), return_exceptions=True))
+        return results
+
+    async def summarize(pmids: list):
+        nonlocal stopped
+        for result in await within_budget(fetch_summary_chunk, chunked(pmids, ESUMMARY_BATCH_SIZE)):
+            if isinstance(result, DeadlineExceeded):
+                stopped = result
+            elif isinstance(result, Exception):
+                logger.error(f"esummary batch failed: {result}")
+            else:
+                summaries.update(result)
+
+    for hop in range(1, hops + 1):
+        batches = chunked(frontier, ELINK_BATCH_SIZE)
+
+        async def elink_batch(batch):
+            elink_params = get_params({
+                "dbfrom": "pubmed",
+                "db": "pubmed",
+                "id": batch,  # repeated id= parameters give one linkset (and score list) per seed
+                "cmd": "neighbor_score",
+                "linkname": "pubmed_pubmed",
+                "retmode": "json"
+            })
+            resp = await eutils_get("elink", elink_params)
+            return response_json(resp).get("linksets", [])
+
+        linksets = []
+        outcomes = await within_budget(elink_batch, batches)
+        if not outcomes:
+            break
+        for result in outcomes:
+            if isinstance(result, DeadlineExceeded):
+                stopped = result
+                continue
+            if isinstance(result, Exception):
+                logger.error(f"elink batch failed: {result}")
+                continue
+            linksets.extend(result)
+
+        # Scores are normalized per source (best neighbor = 1.0) and decayed by hop distance
+        decay = 0.5 ** (hop - 1)
+        discovered = set()
+        for linkset in linksets:
+            source = str((linkset.get("ids") or [""])[0])
+            for db in linkset.get("linksetdbs", []):
+                if db.get("linkname") != "pubmed_pubmed":
+                    continue
+                links = [l for l in db.get("links", []) if isinstance(l, dict) and str(l.get("id")) != source]
+                top = max((float(l.get("score", 0)) for l in links), default=0.0)
+                for link in links:
+                    candidate = str(link.get("id"))
+                    if candidate in visited and candidate not in scores:
+                        continue  # seed or earlier frontier node
+                    score = (float(link.get("score", 0)) / top if top else 0.0) * decay
+                    if combine == "sum":
+                        scores[candidate] = scores.get(candidate, 0.0) + score
+                    else:
+                        scores[candidate] = max(scores.get(candidate, 0.0), score)
+                    first_hop.setdefault(candidate, hop)
+                    linked_from[candidate] = linked_from.get(candidate, 0) + 1
+                    if candidate not in visited:
+                        discovered.add(candidate)
+        hops_completed = hop
+
+        if hop == hops or not discovered or stopped is not None:
+            break
+
+        # Prune: only the best-scoring new nodes are expanded further
+        ranked = sorted((c for c in discovered if scores[c] >= min_score), key=lambda c: -scores[c])
+        if high_impact_only:
+            ranked = ranked[:frontier_size * 3]
+            missing = [c for c in ranked if c not in summaries]
+            if missing:
+                await summarize(missing)
+                if stopped is not None:
+                    break
+            ranked = [c for c in ranked if c in summaries and is_high_impact_summary(summaries[c])]
+        frontier = ranked[:frontier_size]
+        visited.update(discovered)
+        if not frontier:
+            break
+
+    candidates = sorted((c for c in scores if c not in seeds and scores[c] >= min_score), key=lambda c: -scores[c])
+    if high_impact_only:
+        candidates = candidates[:max_results * 3]
+    else:
+        candidates = candidates[:max_results]
+    if any(c not in summaries for c in candidates):
+        await summarize([c for c in candidates if c not in summaries])
+    unsummarized = any(c not in summaries for c in candidates)
+    if stopped is None and unsummarized and over_budget:
+        stopped = f"API call budget spent (max_api_calls={max_api_calls})"
+
+    if stopped is not None and unsummarized and not high_impact_only:
+        # No time or budget left for summaries: return the ranking itself
+        results = [
+            {"pmid": c, "score": round(scores[c], 4), "hop": first_hop[c], "linked_from": linked_from[c]}
+            for c in candidates
+        ]
+    else:
+        results = []
+        for candidate in candidates:
+            item = summaries.get(candidate)
+            if item is None or "error" in item:
+                continue
+            high_impact = is_high_impact_summary(item)
+            if high_impact_only and not high_impact:
+                continue
+            results.append({
+                **Article.from_summary(candidate, item).search_result(),
+                "score": round(scores[candidate], 4),
+                "hop": first_hop[candidate],
+                "linked_from": linked_from[candidate],
+                "high_impact": high_impact
+            })
+            if len(results) >= max_results:
+                break
+
+    if not results:
+        if isinstance(stopped, DeadlineExceeded):
+            raise stopped
+        if stopped is not None and candidates:
+            # Budget spent before any high-impact check could be made: the ranking itself
+            results = [
+                {"pmid": c, "score": round(scores[c], 4), "hop": first_hop[c], "linked_from": linked_from[c]}
+                for c in candidates[:max_results]
+            ]
+        else:
+            return "No related articles found."
+
+    envelope = {"seeds": seeds, "hops_completed": hops_completed, "api_calls": counter["requests"]}
+    if stopped is not None:
+        return render_result(partial_result(results, stopped, **envelope))
+    return render_result({**envelope, "results": results})
+
+# --- Citation export ---
+
+EXPORT_FORMATS = ("ris", "bibtex", "csl-json", "medline")
+# Records per efetch request; also the most records held in memory at once
+EXPORT_CHUNK_SIZE = env_int("PUBMED_EXPORT_CHUNK_SIZE", 200)
+# Records per page when the export is returned instead of written to a file
+EXPORT_PAGE_SIZE = env_int("PUBMED_EXPORT_PAGE_SIZE", 50)
+# Upper bound on records written by one export (the History server pages at most 10000 records)
+EXPORT_MAX_RECORDS = env_int("PUBMED_EXPORT_MAX_RECORDS", 10000)
+# Time budget for export_citations, which writes many chunks (instead of PUBMED_TOOL_DEADLINE)
+EXPORT_DEADLINE = env_float("PUBMED_EXPORT_DEADLINE", 600.0)
+# output_path is resolved inside this directory; paths that escape it are rejected
+EXPORT_DIR = os.environ.get("PUBMED_EXPORT_DIR", os.path.join(os.path.expanduser("~"), "pubmed-exports"))
+
+MEDLINE_LINE_RE = re.compile(r"^([A-Z0-9]{2,4}) *- ?(.*)$")
+MONTH_NUMBERS = {m: i for i, m in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), 1)}
+
+def iter_medline_records(text: str):
+    """Yield (fields, raw) for each record of efetch rettype=medline output.
+
+    fields maps a MEDLINE tag (e.g. "TI", "FAU") to its values in order; continuation
+    lines are joined onto the value they belong to.
+    """
+    fields, raw, tag = {}, [], None
+    for line in text.splitlines():
+        if not line.strip():
+            if fields:
+                yield fields, "\n".join(raw)
+            fields, raw, tag = {}, [], None
+            continue
+        raw.append(line)
+        match = MEDLINE_LINE_RE.match(line)
+        if match:
+            tag = match.group(1)
+            fields.setdefault(tag, []).append(match.group(2).strip())
+        elif tag is not None:
+            fields[tag][-1] += " " + line.strip()
+    if fields:
+        yield fields, "\n".join(raw)
+
+def medline_first(fields: dict, tag: str) -> str:
+    values = fields.get(tag)
+    return values[0] if values else ""
+
+def medline_doi(fields: dict) -> str:
+    for value in fields.get("LID", []) + fields.get("AID", []):
+        if value.endswith("[doi]"):
+            return value[:-len("[doi]")].strip()
+    return ""
+
+def medline_date_parts(fields: dict) -> list:
+    """[year, month, day] from the DP field, as far as it is known ("2019 Winter" -> [2019])"""
+    words = medline_first(fields, "DP").replace("-", " ").split()
+    if not words or not words[0][:4].isdigit():
+        return []
+    parts = [int(words[0][:4])]
+    month = MONTH_NUMBERS.get(words[1][:3].lower()) if len(words) > 1 else None
+    if month:
+        parts.append(month)
+        if len(words) > 2 and words[2].isdigit():
+            parts.append(int(words[2]))
+    return parts
+
+def medline_authors(fields: dict) -> list:
+    """(family, given) pairs, full names where available; collective names have no given name"""
+    authors = []
+    for name in fields.get("FAU") or fields.get("AU", []):
+        if "," in name:
+            family, given = name.split(",", 1)
+        else:
+            family, _, given = name.rpartition(" ") if " " in name else (name, "", "")
+        authors.append((family.strip(), given.strip()))
+    authors.extend((name, "") for name in fields.get("CN", []))
+    return authors
+
+def medline_pages(fields: dict) -> tuple:
+    """(first, last) page; MEDLINE abbreviates the last page ("123-9" -> "129")"""
+    first, _, last = medline_first(fields, "PG").partition("-")
+    first, last = first.strip(), last.strip()
+    if last and first.isdigit() and last.isdigit() and len(last) < len(first):
+        last = first[:len(first) - len(last)] + last
+    return first, last
+
+def medline_issns(fields: dict) -> list:
+    # "1234-5678 (Electronic)"
+    return [value.split(" ")[0] for value in fields.get("IS", [])]
+
+def medline_to_ris(fields: dict, raw: str) -> str:
+    lines = ["TY  - JOUR"]
+
+    def add(tag, value):
+        if value:
+            lines.append(f"{tag}  - {value}")
+
+    pmid = medline_first(fields, "PMID")
+    add("TI", medline_first(fields, "TI") or medline_first(fields, "BTI"))
+    for family, given in medline_authors(fields):
+        add("AU", f"{family}, {given}" if given else family)
+    date_parts = medline_date_parts(fields)
+    add("PY", date_parts[0] if date_parts else "")
+    add("DA", "/".join(f"{p:02d}" for p in date_parts))
+    add("T2", medline_first(fields, "JT"))
+    add("J2", medline_first(fields, "TA"))
+    add("VL", medline_first(fields, "VI"))
+    add("IS", medline_first(fields, "IP"))
+    first_page, last_page = medline_pages(fields)
+    add("SP", first_page)
+    add("EP", last_page)
+    add("AB", medline_first(fields, "AB"))
+    add("DO", medline_doi(fields))
+    for issn in medline_issns(fields):
+        add("SN", issn)
+    for keyword in fields.get("MH", []) + fields.get("OT", []):
+        add("KW", keyword)
+    add("LA", medline_first(fields, "LA"))
+    add("AN", pmid)
+    add("UR", f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/" if pmid else "")
+    lines.append("ER  - ")
+    return "\n".join(lines) + "\n\n"
+
+BIBTEX_SPECIAL_RE = re.compile(r"([&%$#_{}])")
+
+def bibtex_escape(text: str) -> str:
+    return BIBTEX_SPECIAL_RE.sub(r"\\\1", text.replace("\\", "\\textbackslash "))
+
+def medline_to_bibtex(fields: dict, raw: str) -> str:
+    pmid = medline_first(fields, "PMID")
+    date_parts = medline_date_parts(fields)
+    first_page, last_page = medline_pages(fields)
+    entries = [
+        # Double braces keep the title's capitalization
+        ("title", "{" + bibtex_escape(medline_first(fields, "TI") or medline_first(fields, "BTI")) + "}"),
+        ("author", " and ".join(
+            f"{bibtex_escape(family)}, {bibtex_escape(given)}" if given else "{" + bibtex_escape(family) + "}"
+            for family, given in medline_authors(fields))),
+        ("journal", bibtex_escape(medline_first(fields, "JT"))),
+        ("year", str(date_parts[0]) if date_parts else ""),
+        ("month", str(date_parts[1]) if len(date_parts) > 1 else ""),
+        ("volume", bibtex_escape(medline_first(fields, "VI"))),
+        ("number", bibtex_escape(medline_first(fields, "IP"))),
+        ("pages", f"{first_page}--{last_page}" if last_page else first_page),
+        ("doi", bibtex_escape(medline_doi(fields))),
+        ("issn", ", ".join(medline_issns(fields))),
+        ("pmid", pmid),
+        ("pmcid", medline_first(fields, "PMC")),
+        ("abstract", bibtex_escape(medline_first(fields, "AB"))),
+    ]
+    body = ",\n".join(f"  {name} = {{{value}}}" for name, value in entries if value)
+    return f"@article{{pmid{pmid},\n{body}\n}}\n\n"
+
+def medline_to_csl(fields: dict, raw: str) -> dict:
+    pmid = medline_first(fields, "PMID")
+    item = {"id": f"pmid:{pmid}", "type": "article-journal"}
+    first_page, last_page = medline_pages(fields)
+    date_parts = medline_date_parts(fields)
+    values = {
+        "title": medline_first(fields, "TI") or medline_first(fields, "BTI"),
+        "author": [{"family": family, "given": given} if given else {"literal": family}
+                   for family, given in medline_authors(fields)],
+        "container-title": medline_first(fields, "JT"),
+        "container-title-short": medline_first(fields, "TA"),
+        "issued": {"date-parts": [date_parts]} if date_parts else None,
+        "volume": medline_first(fields, "VI"),
+        "issue": medline_first(fields, "IP"),
+        "page": f"{first_page}-{last_page}" if last_page else first_page,
+        "DOI": medline_doi(fields),
+        "ISSN": medline_issns(fields)[0] if medline_issns(fields) else "",
+        "PMID": pmid,
+        "PMCID": medline_first(fields, "PMC"),
+        "abstract": medline_first(fields, "AB"),
+        "language": medline_first(fields, "LA"),
+        "URL": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/" if pmid else "",
+    }
+    item.update((k, v) for k, v in values.items() if v)
+    return item
+
+def medline_to_medline(fields: dict, raw: str) -> str:
+    return raw + "\n\n"
+
+EXPORT_EXPIRED_MESSAGE = "Error: The History server set has expired. Re-run the export with pmids or a query."
+
+CITATION_CONVERTERS = {
+    "ris": medline_to_ris,
+    "bibtex": medline_to_bibtex,
+    "csl-json": medline_to_csl,
+    "medline": medline_to_medline,
+}
+
+async def fetch_medline(params: dict) -> str:
+    """One efetch rettype=medline request. Bypasses the response cache so exports don't evict it."""
+    fetch_params = get_params({"db": "pubmed", "rettype": "medline", "retmode": "text", **params})
+    resp = await fetch_eutils("efetch", fetch_params)
+    if resp.status_code != 200:
+        raise EutilsError(f"NCBI efetch returned HTTP {resp.status_code}")
+    text = resp.text
+    if "WebEnv" in params and "PMID-" not in text and text.lstrip()[:1] in ("<", "{"):
+        # The History server answers an expired WebEnv with an error document
+        raise LookupError("WebEnv expired")
+    return text
+
+async def iter_medline_chunks(batches: list):
+    """Yield MEDLINE text for each batch of efetch parameters, requesting the next batch
+    while the current one is converted. At most two chunks are held at a time."""
+    pending = None
+    try:
+        for i, params in enumerate(batches):
+            task = pending or asyncio.ensure_future(fetch_medline(params))
+            pending = asyncio.ensure_future(fetch_medline(batches[i + 1])) if i + 1 < len(batches) else None
+            yield await task
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+def export_file_path(output_path: str) -> str:
+    """Resolve output_path inside EXPORT_DIR; raises ValueError if it points elsewhere"""
+    base = os.path.realpath(os.path.expanduser(EXPORT_DIR))
+    path = os.path.realpath(os.path.join(base, os.path.expanduser(output_path)))
+    if os.path.commonpath([base, path]) != base or path == base:
+        raise ValueError(f"output_path must be a file inside {base}")
+    return path
+
+def export_batches(source: dict, start: int, end: int, size: int) -> list:
+    """efetch parameters for records [start, end) of a PMID list or History server set"""
+    if "pmids" in source:
+        return [{"id": ",".join(chunk)} for chunk in chunked(source["pmids"][start:end], size)]
+    return [
+        {"WebEnv": source["webenv"], "query_key": source["query_key"], "retstart": s, "retmax": min(size, end - s)}
+        for s in range(start, end, size)
+    ]
+
+async def export_citations(
+    pmids: list = None,
+    query: str = None,
+    webenv: str = None,
+    query_key: str = None,
+    citation_format: str = "ris",
+    output_path: str = None,
+    cursor: str = None,
+    page_size: int = EXPORT_PAGE_SIZE
+) -> str:
+    """
+    Export citations for a PMID list, a search query or a History server set (WebEnv + query_key)
+    as RIS, BibTeX, CSL-JSON or MEDLINE. Records are fetched in efetch chunks and converted
+    as they arrive, either written to output_path or returned one page at a time.
+    """
+    state = None
+    if cursor:
+        try:
+            state = decode_cursor(cursor)
+        except ValueError:
+            return "Error: Invalid cursor. Re-run the export without a cursor."
+        citation_format = state.get("format", citation_format)
+    citation_format = (citation_format or "ris").lower()
+    if citation_format not in EXPORT_FORMATS:
+        return f"Error: citation_format must be one of: {', '.join(EXPORT_FORMATS)}."
+
+    if isinstance(pmids, str):
+        pmids = pmids.replace(",", " ").split()
+    pmids = list(dict.fromkeys(str(p).strip() for p in pmids or [] if str(p).strip().isdigit()))
+
+    # Where the records come from: the PMID list itself or a History server set
+    term = None
+    if state is not None and state.get("webenv"):
+        term = state["term"]
+        source = {"count": state["count"], "webenv": state["webenv"], "query_key": state["query_key"]}
+    elif state is not None:
+        if len(pmids) != state.get("count"):
+            return "Error: Pass the same pmids together with the cursor."
+        source = {"count": len(pmids), "pmids": pmids}
+    elif pmids:
+        source = {"count": len(pmids), "pmids": pmids}
+    elif query:
+        term = query
+        source = await esearch_history(query)
+    elif webenv and query_key:
+        # Re-query the stored set to learn its size
+        source = await esearch_history(f"#{query_key}", webenv=webenv)
+    else:
+        return "Error: Give pmids, a query, or a webenv with its query_key."
+    if not source["count"] or ("pmids" not in source and not source["webenv"]):
+        return "No records to export."
+    logger.info(f"Exporting {source['count']} records as {citation_format}")
+
+    convert = CITATION_CONVERTERS[citation_format]
+    # PMID -> message for records that could not be converted
+    errors = {}
+
+    async def records(start: int, end: int):
+        """Converted records in [start, end), re-running the search once if the WebEnv expired"""
+        nonlocal term
+        done = start
+        while True:
+            try:
+                async for text in iter_medline_chunks(export_batches(source, done, end, EXPORT_CHUNK_SIZE)):
+                    for fields, raw in iter_medline_records(text):
+                        pmid = medline_first(fields, "PMID")
+                        try:
+                            item = convert(fields, raw)
+                        except Exception as e:
+                            logger.warning(f"Skipping record {pmid} in {citation_format} export: {e}")
+                            errors[pmid] = f"Failed to convert record: {e}"
+                            continue
+                        yield pmid, item
+                    # History batches are positional; count them even if a record is missing
+                    done = min(end, done + EXPORT_CHUNK_SIZE)
+                return
+            except LookupError:
+                if term is None:
+                    raise
+                logger.info("WebEnv expired, re-running esearch")
+                source.update(await esearch_history(term))
+                term = None
+
+    if output_path:
+        try:
+            path = export_file_path(output_path)
+        except ValueError as e:
+            return f"Error: {e}"
+        end = min(source["count"], EXPORT_MAX_RECORDS)
+        try:
+            exported, stopped = await write_citations(path, records(0, end), citation_format)
+        except LookupError:
+            return EXPORT_EXPIRED_MESSAGE
+        result = {"path": path, "format": citation_format, "count": source["count"], "exported": len(exported)}
+        if stopped is not None:
+            result.update(partial=True, partial_reason=str(stopped))
+        if "pmids" in source:
+            result["missing"] = [p for p in source["pmids"] if p not in exported and p not in errors]
+        elif end < source["count"]:
+            result["truncated_at"] = end
+        if errors:
+            result["errors"] = errors
+        metrics.inc("exported_records_total", len(exported), format=citation_format)
+        return render_result(result)
+
+    # Paged: one efetch request per call
+    size = state["size"] if state else max(1, min(int(page_size or EXPORT_PAGE_SIZE), EXPORT_CHUNK_SIZE))
+    start = state["start"] if state else 0
+    end = min(start + size, source["count"])
+    try:
+        exported = [(pmid, item) async for pmid, item in records(start, end)]
+    except LookupError:
+        return EXPORT_EXPIRED_MESSAGE
+    items = [item for _, item in exported]
+    metrics.inc("exported_records_total", len(items), format=citation_format)
+
+    next_cursor = None
+    if end < source["count"]:
+        next_state = {"term": term, "start": end, "size": size, "count": source["count"], "format": citation_format}
+        if "webenv" in source:
+            next_state.update(webenv=source["webenv"], query_key=source["query_key"])
+        next_cursor = encode_cursor(next_state)
+    result = {
+        "count": source["count"],
+        "retstart": start,
+        "format": citation_format,
+        "citations": items if citation_format == "csl-json" else "".join(items),
+        "next_cursor": next_cursor
+    }
+    if "pmids" in source:
+        # Requested PMIDs of this page that efetch did not return
+        returned = {pmid for pmid, _ in exported}
+        result["missing"] = [p for p in source["pmids"][start:end] if p not in returned and p not in errors]
+    if errors:
+        result["errors"] = errors
+    return render_result(result)
+
+async def write_citations(path: str, records, citation_format: str) -> tuple:
+    """Stream converted records into path chunk by chunk.
+
+    Returns (PMIDs written, DeadlineExceeded or None). The file is written under a
+    temporary name and renamed when complete, so a failed export never leaves a
+    truncated file behind; when the deadline passes, the records written so far are kept.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + ".part"
+    exported = set()
+    written = 0
+    stopped = None
+    f = await asyncio.to_thread(open, partial, "w", encoding="utf-8")
+    try:
+        buffer = ["[\n"] if citation_format == "csl-json" else []
+        try:
+            async for pmid, item in records:
+                if citation_format == "csl-json":
+                    item = (",\n" if written else "") + dump_json(item)
+                exported.add(pmid)
+                written += 1
+                buffer.append(item)
+                if len(buffer) >= EXPORT_CHUNK_SIZE:
+                    await asyncio.to_thread(f.writelines, buffer)
+                    buffer = []
+        except DeadlineExceeded as e:
+            if not written:
+                raise
+            stopped = e
+        if citation_format == "csl-json":
+            buffer.append("\n]\n")
+        await asyncio.to_thread(f.writelines, buffer)
+        await asyncio.to_thread(f.close)
+        os.replace(partial, path)
+    except BaseException:
+        f.close()
+        os.remove(partial)
+        raise
+    return exported, stopped
+
+# --- Saved searches ---
+
+# Saved searches and what each has already reported; empty string disables them
+WATCH_PATH = os.environ.get("PUBMED_WATCH_PATH", os.path.join(os.path.expanduser("~"), ".local", "share", "pubmed-mcp", "watches.sqlite3"))
+# New PMIDs one saved search can report per check (retmax of its delta query)
+WATCH_MAX_RESULTS = env_int("PUBMED_WATCH_MAX_RESULTS", 200)
+# Saved searches combined into one OR probe query per check
+WATCH_GROUP_SIZE = env_int("PUBMED_WATCH_GROUP_SIZE", 10)
+WATCH_NAME_MAX_CHARS = 100
+
+def entrez_date(timestamp: float, days: int = 0) -> str:
+    """YYYY/MM/DD (UTC) for mindate/maxdate, shifted by whole days"""
+    return time.strftime("%Y/%m/%d", time.gmtime(timestamp + days * 86400))
+
+class WatchStore:
+    """SQLite table of saved searches.
+
+    Each row keeps the search term, the entrez date a check starts from (mindate),
+    the time of the check run that set it (NULL until the first check), and the
+    PMIDs that run found in its window. The next check only looks at entries added since (EDAT), and drops the
+    PMIDs it already reported.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connection(self):
+        """Open the database on first use (call with the lock held)"""
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS watches ("
+                "name TEXT PRIMARY KEY, spec TEXT, term TEXT, mindate TEXT, checked REAL, seen TEXT)"
+            )
+            conn.commit()
+            self.conn = conn
+        return self.conn
+
+    def _row(self, row) -> dict:
+        name, spec, term, mindate, checked, seen = row
+        return {"name": name, "spec": json.loads(spec), "term": term, "mindate": mindate,
+                "checked": checked, "seen": json.loads(seen)}
+
+    def list(self, names: list = None) -> list:
+        with self.lock:
+            rows = self._connection().execute("SELECT * FROM watches ORDER BY name").fetchall()
+        watches = [self._row(row) for row in rows]
+        if names is not None:
+            watches = [w for w in watches if w["name"] in names]
+        return watches
+
+    def save(self, name: str, spec: dict, term: str, mindate: str):
+        with self.lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO watches VALUES (?, ?, ?, ?, ?, ?)",
+                (name, json.dumps(spec), term, mindate, None, "[]")
+            )
+            self.conn.commit()
+
+    def delete(self, name: str) -> bool:
+        with self.lock:
+            deleted = self._connection().execute("DELETE FROM watches WHERE name = ?", (name,)).rowcount
+            self.conn.commit()
+        return bool(deleted)
+
+    def update(self, checks: list, checked: float):
+        """Record a check run: checks is a list of (name, PMIDs in its window, next mindate)"""
+        with self.lock:
+            self._connection().executemany(
+                "UPDATE watches SET mindate = ?, checked = ?, seen = ? WHERE name = ?",
+                [(mindate, checked, json.dumps(sorted(seen)), name) for name, seen, mindate in checks]
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+_watch_store = None
+# Held by check_updates from reading the saved searches until their new state is written,
+# so overlapping checks (or a save in between) cannot report the same PMIDs twice
+_watch_lock = asyncio.Lock()
+
+def get_watch_store() -> WatchStore:
+    global _watch_store
+    if _watch_store is None:
+        if not WATCH_PATH:
+            raise RuntimeError("Saved searches are disabled (PUBMED_WATCH_PATH is empty).")
+        _watch_store = WatchStore(WATCH_PATH)
+    return _watch_store
+
+def close_watch_store():
+    global _watch_store
+    if _watch_store is not None:
+        _watch_store.close()
+        _watch_store = None
+
+def watch_info(watch: dict) -> dict:
+    checked = watch["checked"]
+    return {"name": watch["name"], **watch["spec"], "term": watch["term"], "new_since": watch["mindate"],
+            "last_checked": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(checked)) if checked is not None else "never"}
+
+async def save_search(
+    name: str,
+    query: str = None,
+    author: str = None,
+    journal: str = None,
+    publication_types: list = None,
+    since: str = None,
+    delete: bool = False
+) -> str:
+    """Create, replace or delete a saved search checked by check_updates"""
+    name = (name or "").strip()
+    if not name or len(name) > WATCH_NAME_MAX_CHARS:
+        return f"Error: A saved search needs a name of 1-{WATCH_NAME_MAX_CHARS} characters."
+    store = get_watch_store()
+    if delete:
+        async with _watch_lock:
+            deleted = await asyncio.to_thread(store.delete, name)
+        if not deleted:
+            return f"Error: No saved search named '{name}'."
+        return render_result({"deleted": name})
+    if not (query or "").strip():
+        return "Error: A saved search needs a query."
+    try:
+        tags = parse_publication_types(publication_types)
+    except ValueError as e:
+        return f"Error: {e}"
+    if since and not re.fullmatch(r"\d{4}/\d{2}/\d{2}", since):
+        return "Error: since must be a date in YYYY/MM/DD format."
+    spec = {"query": query.strip(), "author": author, "journal": journal, "publication_types": tags}
+    spec = {k: v for k, v in spec.items() if v}
+    term = build_search_term(query.strip(), author, journal, tags=tags)
+    # Without a start date only articles added from today on count as new
+    async with _watch_lock:
+        await asyncio.to_thread(store.save, name, spec, term, since or entrez_date(time.time()))
+        watch = (await asyncio.to_thread(store.list, [name]))[0]
+    logger.info(f"Saved search '{name}': {term}")
+    return render_result(watch_info(watch))
+
+async def list_saved_searches() -> str:
+    watches = await asyncio.to_thread(get_watch_store().list)
+    if not watches:
+        return "No saved searches. Create one with save_search."
+    return render_result([watch_info(w) for w in watches])
+
+async def esearch_window(term: str, mindate: str, maxdate: str) -> tuple:
+    """PMIDs added to PubMed (EDAT) between mindate and maxdate; returns (count, ids)"""
+    search_params = get_params({
+        "db": "pubmed",
+        "term": term,
+        "retmode": "json",
+        "retmax": WATCH_MAX_RESULTS,
+        "datetype": "edat",
+        "mindate": mindate,
+        "maxdate": maxdate
+    })
+    # Not through the response cache: a cached window would hide entries added since
+    resp = await fetch_eutils("esearch", search_params)
+    result = response_json(resp).get("esearchresult", {})
+    return int(result.get("count", 0) or 0), result.get("idlist", [])
+
+async def check_updates(names: list = None) -> str:
+    """Report what is new for saved searches since their last check.
+
+    Saved searches last checked in the same run share a window and are probed
+    together with one OR query per WATCH_GROUP_SIZE searches. A search whose own
+    seen PMIDs cover everything its group's probe found is unchanged; the others
+    get a delta query each, and the summaries of all new PMIDs come from one
+    batched esummary fan-in.
+    """
+    if isinstance(names, str):
+        names = [names]
+    async with _watch_lock:
+        return await _check_updates(get_watch_store(), names)
+
+async def _check_updates(store: WatchStore, names: list) -> str:
+    watches = await asyncio.to_thread(store.list, names)
+    if not watches:
+        if names:
+            return f"Error: No saved search named {', '.join(names)}."
+        return "No saved searches. Create one with save_search."
+    missing = [name for name in names or [] if name not in {w["name"] for w in watches}]
+    now = time.time()
+    # One day of slack on both ends: EDAT follows NCBI's clock, not ours
+    maxdate = entrez_date(now, 1)
+    requests = 0
+
+    async def probe(group: list) -> tuple:
+        nonlocal requests
+        requests += 1
+        term = group[0]["term"] if len(group) == 1 else " OR ".join(f"({w['term']})" for w in group)
+        return await esearch_window(term, min(w["mindate"] for w in group), maxdate)
+
+    async def delta(watch: dict) -> tuple:
+        nonlocal requests
+        requests += 1
+        return await esearch_window(watch["term"], watch["mindate"], maxdate)
+
+    # Searches checked in the same run have seen the same window
+    runs = {}
+    for watch in watches:
+        runs.setdefault(watch["checked"], []).append(watch)
+    groups = [chunk for run in runs.values() for chunk in chunked(run, max(1, WATCH_GROUP_SIZE))]
+    probes = await asyncio.gather(*(probe(group) for group in groups), return_exceptions=True)
+
+    windows = {}
+    errors = {}
+    to_query = []
+    for group, outcome in zip(groups, probes):
+        if isinstance(outcome, BaseException):
+            for watch in group:
+                errors[watch["name"]] = str(outcome) or type(outcome).__name__
+            continue
+        count, ids = outcome
+        if len(group) == 1:
+            windows[group[0]["name"]] = outcome
+            continue
+        for watch in group:
+            # The probe covers this search's window: if it already saw every PMID the
+            # probe found, nothing is new for it (a PMID seen by another search may be)
+            if count <= len(ids) and set(watch["seen"]).issuperset(ids):
+                windows[watch["name"]] = outcome
+            else:
+                to_query.append(watch)
+    for watch, outcome in zip(to_query, await asyncio.gather(*(delta(w) for w in to_query), return_exceptions=True)):
+        if isinstance(outcome, BaseException):
+            errors[watch["name"]] = str(outcome) or type(outcome).__name__
+        else:
+            windows[watch["name"]] = outcome
+
+    new = {}
+    for watch in watches:
+        if watch["name"] in windows:
+            seen = set(watch["seen"])
+            new[watch["name"]] = [pmid for pmid in windows[watch["name"]][1] if pmid not in seen]
+    merged = list(dict.fromkeys(pmid for ids in new.values() for pmid in ids))
+    uid_data = None
+    reason = None
+    if merged:
+        requests += len(chunked(merged, ESUMMARY_BATCH_SIZE))
+        try:
+            uid_data = await fetch_summaries(merged)
+        except DeadlineExceeded as e:
+            # New PMIDs are still reported, without summaries
+            reason = str(e)
+
+    groups_out = [{"name": name, "error": "No saved search with this name"} for name in missing]
+    unchanged = []
+    for watch in watches:
+        name = watch["name"]
+        if name in errors:
+            groups_out.append({"name": name, "error": errors[name]})
+        elif new[name]:
+            count, ids = windows[name]
+            results = format_search_results(new[name], uid_data) if uid_data is not None else \
+                [{"pmid": pmid} for pmid in new[name]]
+            entry = {"name": name, "new": len(new[name]), "since": watch["mindate"], "results": results}
+            if count > len(ids):
+                entry["truncated"] = True
+            groups_out.append(entry)
+        else:
+            unchanged.append(name)
+
+    # The next window starts a day before this run (but not before the saved start date),
+    # so entries added later today are not missed
+    checks = [(w["name"], windows[w["name"]][1], max(w["mindate"], entrez_date(now, -1)))
+              for w in watches if w["name"] in windows]
+    await asyncio.to_thread(store.update, checks, now)
+    logger.info(f"Checked {len(watches)} saved searches with {requests} requests: "
+                f"{sum(len(ids) for ids in new.values())} new PMIDs")
+
+    result = {"checked": len(watches), "requests": requests, "watches": groups_out, "unchanged": unchanged}
+    if reason:
+        result = {"partial": True, "partial_reason": reason, **result}
+    return render_result(result)
+
+# --- Server statistics ---
+
+def collect_stats() -> dict:
+    """Metrics snapshot plus cache, coalescing and rate limiter state"""
+    stats = metrics.snapshot()
+    stats["cache"] = response_cache.stats() if response_cache is not None else None
+    stats["single_flight"] = single_flight.stats() if single_flight is not None else None
+    stats["prefetch"] = prefetcher.stats() if prefetcher is not None else None
+    stats["rate_limiter"] = {"rate_per_key": RATE_LIMIT, "keys": len(rate_limiter.buckets)}
+    if cassette is not None:
+        stats["cassette"] = cassette.stats()
+    return stats
 
-def get_params(base_params: dict) -> dict:
-    """Helper to add API key to params if available"""
-    if API_KEY:
-        base_params["api_key"] = API_KEY
-    return base_params
+def prometheus_stats() -> str:
+    text = metrics.prometheus()
+    for name, component in (("cache", response_cache), ("single_flight", single_flight), ("prefetch", prefetcher)):
+        if component is not None:
+            for key, value in component.stats().items():
+                text += f"pubmed_{name}_{key} {value}\n"
+    return text
 
-# High-impact Neurology/NeuroScience journals
-HIGH_IMPACT_JOURNALS = [
-    "N Engl J Med",
-    "Lancet",
-    "Lancet Neurol",
-    "JAMA",
-    "JAMA Neurol",
-    "BMJ",
-    "Nature",
-    "Nature Medicine",
-    "Nature Reviews Neurology",
-    "Cell",
-    "Science",
-    "Neurology",
-    "Brain",
-    "Neuron",
-    "Ann Neurol",
-    "J Neurol Neurosurg Psychiatry",
-    "Mov Disord",
-    "Mov Disord Clin Pract",
-    "Amyloid",
-    "Parkinsons Relat Disord",
-    "J Parkinsons Dis",
-    "NPJ Parkinsons Dis",
-    "Stroke",
-    "CNS Neurol Disord Drug Targets",
-    "Clin Neurol Neurosurg",
-    "Mult Scler J",
-    "Epilepsia",
-    "Sleep"
-]
-
-def is_high_impact_journal(journal_name: str) -> bool:
-    """Check if a journal is in the high-impact list"""
-    if not journal_name:
-        return False
-    # Normalize journal name for comparison
-    journal_normalized = journal_name.strip().lower()
-    for high_impact in HIGH_IMPACT_JOURNALS:
-        if high_impact.lower() in journal_normalized:
-            return True
-    return False
+async def server_stats(format: str = "json") -> str:
+    """Report per-phase latency histograms, upstream counters and cache statistics"""
+    if format == "prometheus":
+        return prometheus_stats()
+    return render_result(collect_stats())
 
-# --- Tool Implementations ---
+def dump_metrics(path: str = None):
+    """Write a stats snapshot to PUBMED_METRICS_DUMP (or stderr if unset)"""
+    path = path or METRICS_DUMP_PATH
+    text = prometheus_stats() if path and path.endswith(".prom") else json.dumps(collect_stats(), indent=2)
+    if not path:
+        sys.stderr.write(text + "\n")
+        return
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    except OSError as e:
+        logger.error(f"Failed to write metrics to {path}: {e}")
 
-async def search_pubmed(query: str, max_results: int = 5) -> str:
-    """Search PubMed for papers matching the query"""
-    logger.info(f"Searching PubMed for: {query}")
-    async with httpx.AsyncClient() as client:
-        search_params = get_params({
-            "db": "pubmed",
-            "term": query,
-            "retmode": "json",
-            "retmax": max_results,
-            "sort": "relevance"
-        })
-        resp = await client.get(f"{BASE_URL}/esearch.fcgi", params=search_params)
-        data = resp.json()
-        id_list = data.get("esearchresult", {}).get("idlist", [])
-        
-        if not id_list:
-            return "No results found."
+# --- MCP Protocol Handling ---
 
-        summary_params = get_params({
-            "db": "pubmed",
-            "id": ",".join(id_list),
-            "retmode": "json"
-        })
-        resp = await client.get(f"{BASE_URL}/esummary.fcgi", params=summary_params)
-        summary_data = resp.json()
-        
-        results = []
-        uid_data = summary_data.get("result", {})
-        for pmid in id_list:
-            if pmid in uid_data:
-                item = uid_data[pmid]
-                # Extract author names
-                authors = item.get("authors", [])
-                author_names = []
-                for author in authors[:3]:  # First 3 authors
-                    if isinstance(author, dict):
-                        author_names.append(author.get("name", ""))
-                
-                # Detect publication type
-                pub_types = item.get("pubtype", [])
-                is_review = any("review" in pt.lower() for pt in pub_types)
-                
-                results.append({
-                    "pmid": pmid,
-                    "title": item.get("title", "No title"),
-                    "authors": ", ".join(author_names) if author_names else "No authors",
-                    "pubdate": item.get("pubdate", "Unknown date"),
-                    "source": item.get("source", "Unknown source"),
-                    "is_review": is_review
-                })
-        
-        # Sort: original articles first, then reviews
-        results.sort(key=lambda x: (x["is_review"], id_list.index(x["pmid"])))
-        
-        # Remove is_review flag from output (internal use only)
-        for r in results:
-            del r["is_review"]
-        
-        return json.dumps(results, indent=2, ensure_ascii=False)
+def initialize_result() -> dict:
+    return {
+        "protocolVersion": "2024-11-05",
+        "capabilities": {
+            "tools": {}
+        },
+        "serverInfo": {
+            "name": "pubmed-server",
+            "version": "0.1.0"
+        }
+    }
 
-async def get_paper_details(pmid: str) -> str:
-    """Get detailed information (Abstract, Authors, DOI, Links) for a specific PMID"""
-    logger.info(f"Fetching details for PMID: {pmid}")
-    async with httpx.AsyncClient() as client:
-        fetch_params = get_params({"db": "pubmed", "id": pmid, "retmode": "xml"})
-        resp = await client.get(f"{BASE_URL}/efetch.fcgi", params=fetch_params)
-        data = xmltodict.parse(resp.text)
-        
-        try:
-            # Check if PubMed returned valid data
-            if 'PubmedArticleSet' not in data or not data['PubmedArticleSet']:
-                return f"Error: PMID {pmid} not found. Please check the PMID and try again."
-            
-            pubmed_article_set = data['PubmedArticleSet']
-            if 'PubmedArticle' not in pubmed_article_set or not pubmed_article_set['PubmedArticle']:
-                return f"Error: PMID {pmid} not found. Please check the PMID and try again."
-            
-            pubmed_article = pubmed_article_set['PubmedArticle']
-            article = pubmed_article['MedlineCitation']['Article']
-            title = article.get('ArticleTitle', 'No title')
-            
-            # Extract abstract
-            abstract_text = ""
-            if 'Abstract' in article and 'AbstractText' in article['Abstract']:
-                abs_content = article['Abstract']['AbstractText']
-                if isinstance(abs_content, list):
-                    abstract_text = "\n".join([item.get('#text', '') if isinstance(item, dict) else item for item in abs_content])
-                elif isinstance(abs_content, dict):
-                    abstract_text = abs_content.get('#text', '')
-                else:
-                    abstract_text = abs_content
-            
-            # Extract authors
-            authors = []
-            if 'AuthorList' in article and 'Author' in article['AuthorList']:
-                auth_list = article['AuthorList']['Author']
-                if isinstance(auth_list, list):
-                    for auth in auth_list:
-                        if 'LastName' in auth and 'ForeName' in auth:
-                            authors.append(f"{auth['LastName']} {auth['ForeName']}")
-                elif isinstance(auth_list, dict):
-                    if 'LastName' in auth_list and 'ForeName' in auth_list:
-                        authors.append(f"{auth_list['LastName']} {auth_list['ForeName']}")
-
-            # Extract DOI and PMC ID
-            doi = None
-            pmc_id = None
-            if 'PubmedData' in pubmed_article and 'ArticleIdList' in pubmed_article['PubmedData']:
-                id_list = pubmed_article['PubmedData']['ArticleIdList']['ArticleId']
-                if not isinstance(id_list, list):
-                    id_list = [id_list]
-                for article_id in id_list:
-                    if isinstance(article_id, dict):
-                        id_type = article_id.get('@IdType')
-                        id_value = article_id.get('#text')
-                        if id_type == 'doi':
-                            doi = id_value
-                        elif id_type == 'pmc':
-                            pmc_id = id_value
-
-            # Build links
-            links = {
-                "pubmed": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/"
-            }
-            if pmc_id:
-                links["pmc"] = f"https://www.ncbi.nlm.nih.gov/pmc/articles/{pmc_id}/"
-            if doi:
-                links["doi"] = f"https://doi.org/{doi}"
-
-            result = {
-                "pmid": pmid,
-                "title": title,
-                "authors": authors,
-                "journal": article.get('Journal', {}).get('Title', ''),
-                "doi": doi,
-                "pmc_id": pmc_id,
-                "abstract": abstract_text,
-                "links": links
+PUBLICATION_TYPES_SCHEMA = {
+    "type": "array",
+    "items": {"type": "string", "enum": PUBLICATION_TYPE_CHOICES},
+    "description": "Only return articles with at least one of these PubMed publication types"
+}
+RANK_BY_TYPE_SCHEMA = {
+    "type": "boolean",
+    "default": False,
+    "description": "Order results by evidence level: guidelines, meta-analyses, systematic reviews, RCTs, other trials, observational studies, untagged, reviews, case reports"
+}
+
+def tools_list_result() -> dict:
+    """Result of tools/list: every tool with its input schema"""
+    return {
+        "tools": [
+            {
+                "name": "search_pubmed",
+                "description": "Search PubMed database and return REAL PMIDs with full details. CRITICAL WARNING: The PMIDs returned by this tool are the ONLY valid PMIDs. You MUST NOT generate, guess, or make up any PMIDs. NEVER cite a PMID that was not explicitly returned by this tool. Results are sorted to prioritize original research articles over reviews. Each result includes: PMID, full title, authors (first 3), publication date, journal name.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "query": {"type": "string"},
+                        "max_results": {"type": "integer", "default": 5},
+                        "use_history": {"type": "boolean", "default": False, "description": "Page through large result sets via the Entrez History server. Enabled automatically for large max_results. The response then contains 'count', 'results' and 'next_cursor'."},
+                        "cursor": {"type": "string", "description": "next_cursor from a previous paged response, to fetch the next page without re-running the search"},
+                        "publication_types": PUBLICATION_TYPES_SCHEMA,
+                        "rank_by_type": RANK_BY_TYPE_SCHEMA,
+                        **OUTPUT_OPTIONS_SCHEMA
+                    },
+                    "required": ["query"]
+                }
+            },
+            {
+                "name": "get_paper_details",
+                "description": "Get detailed information (Abstract, Authors, DOI, full-text links) for a specific PMID.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "pmid": {"type": "string"},
+                        **OUTPUT_OPTIONS_SCHEMA
+                    },
+                    "required": ["pmid"]
+                }
+            },
+            {
+                "name": "get_papers_details",
+                "description": "Get detailed information (Abstract, Authors, DOI, full-text links) for many PMIDs in one call (up to 1000). Results are returned in the given order; PMIDs that could not be retrieved are reported individually with an 'error' field.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "pmids": {"type": "array", "items": {"type": "string"}, "description": "List of PMIDs"},
+                        **OUTPUT_OPTIONS_SCHEMA
+                    },
+                    "required": ["pmids"]
+                }
+            },
+            {
+                "name": "advanced_search_pubmed",
+                "description": "Advanced PubMed search with filters (author, journal, date range). Returns REAL PMIDs only. CRITICAL WARNING: You MUST NOT generate or guess PMIDs. ONLY use PMIDs explicitly returned by this tool. NEVER cite a PMID that was not returned. Can parse natural language like 'Smith's 2023 gastric cancer papers'.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "query": {"type": "string", "description": "Main search keywords"},
+                        "author": {"type": "string", "description": "Author name (e.g., 'Smith J', 'Tanaka')"},
+                        "journal": {"type": "string", "description": "Journal name or abbreviation (e.g., 'NEJM', 'Lancet', 'Nature')"},
+                        "pub_date_from": {"type": "string", "description": "Start date in YYYY/MM/DD format"},
+                        "pub_date_to": {"type": "string", "description": "End date in YYYY/MM/DD format"},
+                        "max_results": {"type": "integer", "default": 5},
+                        "use_history": {"type": "boolean", "default": False, "description": "Page through large result sets via the Entrez History server. Enabled automatically for large max_results. The response then contains 'count', 'results' and 'next_cursor'."},
+                        "cursor": {"type": "string", "description": "next_cursor from a previous paged response, to fetch the next page without re-running the search"},
+                        "publication_types": PUBLICATION_TYPES_SCHEMA,
+                        "rank_by_type": RANK_BY_TYPE_SCHEMA,
+                        **OUTPUT_OPTIONS_SCHEMA
+                    },
+                    "required": ["query"]
+                }
+            },
+            {
+                "name": "batch_search",
+                "description": "Run several PubMed searches in one call (e.g. synonyms, sub-questions or one query per drug). Searches run concurrently and all summaries are fetched together. Results are grouped per query; each article lists the other queries that also found it in 'also_in', and 'overlap' gives shared-PMID counts and Jaccard similarity per query pair. Returns REAL PMIDs only.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "queries": {
+                            "type": "array",
+                            "description": f"Up to {MAX_BATCH_QUERIES} queries: plain search strings, or objects with per-query filters",
+                            "items": {
+                                "anyOf": [
+                                    {"type": "string"},
+                                    {
+                                        "type": "object",
+                                        "properties": {
+                                            "query": {"type": "string"},
+                                            "author": {"type": "string"},
+                                            "journal": {"type": "string"},
+                                            "pub_date_from": {"type": "string", "description": "YYYY/MM/DD"},
+                                            "pub_date_to": {"type": "string", "description": "YYYY/MM/DD"},
+                                            "publication_types": PUBLICATION_TYPES_SCHEMA,
+                                            "max_results": {"type": "integer"}
+                                        },
+                                        "required": ["query"]
+                                    }
+                                ]
+                            }
+                        },
+                        "max_results": {"type": "integer", "default": 5, "description": f"Results per query unless the query sets its own (at most {HISTORY_THRESHOLD})"},
+                        "publication_types": PUBLICATION_TYPES_SCHEMA,
+                        "rank_by_type": RANK_BY_TYPE_SCHEMA,
+                        **OUTPUT_OPTIONS_SCHEMA
+                    },
+                    "required": ["queries"]
+                }
+            },
+            {
+                "name": "get_similar_articles",
+                "description": "Find similar/related articles for a given PMID using PubMed's built-in relevance algorithm. Can optionally filter to show only high-impact journal publications (NEJM, Lancet, JAMA, Nature, etc.). Useful for literature review and finding related research.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "pmid": {"type": "string", "description": "PMID of the reference paper"},
+                        "max_results": {"type": "integer", "default": 5, "description": "Maximum number of similar articles to return"},
+                        "high_impact_only": {"type": "boolean", "default": False, "description": "If true, only return articles from high-impact journals (NEJM, Lancet, JAMA, Nature, etc.)"},
+                        "publication_types": PUBLICATION_TYPES_SCHEMA,
+                        "rank_by_type": RANK_BY_TYPE_SCHEMA,
+                        **OUTPUT_OPTIONS_SCHEMA
+                    },
+                    "required": ["pmid"]
+                }
+            },
+            {
+                "name": "expand_related_articles",
+                "description": "Expand from one or more seed PMIDs through PubMed's related-articles graph for several hops (useful for seeding systematic reviews). Neighbor scores are combined across seeds and hops. Each hop keeps only the best-scoring articles. Returns ranked PMIDs with score, hop distance and how many expanded articles link to each.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "pmids": {"type": "array", "items": {"type": "string"}, "description": "Seed PMIDs"},
+                        "hops": {"type": "integer", "default": 2, "description": "Number of hops to expand (1-5)"},
+                        "max_results": {"type": "integer", "default": 20},
+                        "frontier_size": {"type": "integer", "default": 10, "description": "Articles expanded further at each hop"},
+                        "combine": {"type": "string", "enum": ["sum", "max"], "default": "sum", "description": "How scores from several sources are combined"},
+                        "min_score": {"type": "number", "default": 0, "description": "Drop candidates below this combined score"},
+                        "high_impact_only": {"type": "boolean", "default": False, "description": "Only expand and return articles from high-impact journals"},
+                        "max_api_calls": {"type": "integer", "default": 30, "description": "Upper bound on NCBI requests for this expansion"},
+                        **OUTPUT_OPTIONS_SCHEMA
+                    },
+                    "required": ["pmids"]
+                }
+            },
+            {
+                "name": "export_citations",
+                "description": "Export citations for a list of PMIDs, a PubMed query, or a History server set (webenv + query_key) as RIS, BibTeX, CSL-JSON or MEDLINE. Large exports should be written to a file with output_path; otherwise records are returned one page at a time with a next_cursor.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "pmids": {"type": "array", "items": {"type": "string"}, "description": "PMIDs to export, in order"},
+                        "query": {"type": "string", "description": "PubMed query whose results are exported (instead of pmids)"},
+                        "webenv": {"type": "string", "description": "WebEnv of an existing History server set"},
+                        "query_key": {"type": "string", "description": "query_key of the set within webenv"},
+                        "citation_format": {"type": "string", "enum": list(EXPORT_FORMATS), "default": "ris"},
+                        "output_path": {"type": "string", "description": f"File to write, relative to the export directory (PUBMED_EXPORT_DIR, default {EXPORT_DIR}). Up to {EXPORT_MAX_RECORDS} records."},
+                        "page_size": {"type": "integer", "default": EXPORT_PAGE_SIZE, "description": f"Records per page when no output_path is given (at most {EXPORT_CHUNK_SIZE})"},
+                        "cursor": {"type": "string", "description": "next_cursor from the previous page. For a PMID list, pass the same pmids again"},
+                        **OUTPUT_OPTIONS_SCHEMA
+                    }
+                }
+            },
+            {
+                "name": "save_search",
+                "description": "Save a search (query plus optional author, journal and publication-type filters) under a name so that check_updates can report articles added to PubMed after it. Saving an existing name replaces it; delete=true removes it.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string", "description": "Name of the saved search, e.g. 'PD trials'"},
+                        "query": {"type": "string", "description": "Search keywords"},
+                        "author": {"type": "string"},
+                        "journal": {"type": "string"},
+                        "publication_types": PUBLICATION_TYPES_SCHEMA,
+                        "since": {"type": "string", "description": "Report articles added to PubMed from this date (YYYY/MM/DD) on. Default: today"},
+                        "delete": {"type": "boolean", "default": False, "description": "Delete the saved search instead"},
+                        **OUTPUT_OPTIONS_SCHEMA
+                    },
+                    "required": ["name"]
+                }
+            },
+            {
+                "name": "list_saved_searches",
+                "description": "List the saved searches with their terms and when they were last checked.",
+                "inputSchema": {"type": "object", "properties": {**OUTPUT_OPTIONS_SCHEMA}}
+            },
+            {
+                "name": "check_updates",
+                "description": "Check saved searches for articles added to PubMed since their last check. Returns only new articles, grouped per saved search, and remembers them so they are not reported again. Returns REAL PMIDs only.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "names": {"type": "array", "items": {"type": "string"}, "description": "Saved searches to check (default: all)"},
+                        **OUTPUT_OPTIONS_SCHEMA
+                    }
+                }
+            },
+            {
+                "name": "server_stats",
+                "description": "Operational statistics for this server: per-tool and per-phase latency (queue wait, upstream HTTP, parsing, serialization), upstream status codes, bytes, retries, rate-limiter wait and cache hit rates.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "format": {"type": "string", "enum": ["json", "compact", "prometheus"], "default": "json"}
+                    }
+                }
             }
-            return json.dumps(result, indent=2, ensure_ascii=False)
-        except KeyError:
-            return f"Error: PMID {pmid} not found or invalid. Please check the PMID and try again."
-        except Exception as e:
-            logger.error(f"Error parsing details for PMID {pmid}: {e}")
-            return f"Error retrieving details for PMID {pmid}: {str(e)}"
+        ]
+    }
 
-async def advanced_search_pubmed(
-    query: str,
-    author: str = None,
-    journal: str = None,
-    pub_date_from: str = None,
-    pub_date_to: str = None,
-    max_results: int = 5
-) -> str:
-    """
-    Advanced search with filters for author, journal, and publication date.
-    Supports both structured parameters and natural language queries.
-    """
-    logger.info(f"Advanced search - Query: {query}, Author: {author}, Journal: {journal}")
-    
-    # Build PubMed search query
-    query_parts = [f"({query})"]
-    
-    if author:
-        # Handle various author name formats
-        query_parts.append(f"({author}[Author])")
-    
-    if journal:
-        # Support both full names and abbreviations
-        query_parts.append(f"({journal}[Journal])")
-    
-    if pub_date_from or pub_date_to:
-        # Date range filter
-        date_from = pub_date_from if pub_date_from else "1900/01/01"
-        date_to = pub_date_to if pub_date_to else "3000/12/31"
-        query_parts.append(f'("{date_from}"[PDAT] : "{date_to}"[PDAT])')
-    
-    final_query = " AND ".join(query_parts)
-    logger.info(f"Constructed query: {final_query}")
-    
-    # Use the same search logic as search_pubmed
-    async with httpx.AsyncClient() as client:
-        search_params = get_params({
-            "db": "pubmed",
-            "term": final_query,
-            "retmode": "json",
-            "retmax": max_results,
-            "sort": "relevance"
-        })
-        resp = await client.get(f"{BASE_URL}/esearch.fcgi", params=search_params)
-        data = resp.json()
-        id_list = data.get("esearchresult", {}).get("idlist", [])
-        
-        if not id_list:
-            return f"No results found for query: {final_query}"
+class PrebuiltResponse(dict):
+    """JSON-RPC response whose serialized text was prepared ahead of time (see encode_message)"""
 
-        summary_params = get_params({
-            "db": "pubmed",
-            "id": ",".join(id_list),
-            "retmode": "json"
-        })
-        resp = await client.get(f"{BASE_URL}/esummary.fcgi", params=summary_params)
-        summary_data = resp.json()
-        
-        results = []
-        uid_data = summary_data.get("result", {})
-        for pmid in id_list:
-            if pmid in uid_data:
-                item = uid_data[pmid]
-                results.append({
-                    "pmid": pmid,
-                    "title": item.get("title", "No title"),
-                    "pubdate": item.get("pubdate", "Unknown date"),
-                    "source": item.get("source", "Unknown source"),
-                    "authors": item.get("authors", [])
-                })
-        
-        return json.dumps(results, indent=2, ensure_ascii=False)
+    __slots__ = ("text",)
 
-async def get_similar_articles(pmid: str, max_results: int = 5, high_impact_only: bool = False) -> str:
-    """
-    Get similar articles for a given PMID using PubMed's elink API.
-    Optionally filter to show only high-impact journal publications.
-    """
-    logger.info(f"Getting similar articles for PMID: {pmid}, high_impact_only: {high_impact_only}")
-    
-    async with httpx.AsyncClient() as client:
-        # Get similar article PMIDs using elink
-        elink_params = get_params({
-            "dbfrom": "pubmed",
-            "db": "pubmed",
-            "id": pmid,
-            "cmd": "neighbor_score",
-            "retmode": "json"
-        })
-        
-        resp = await client.get(f"{BASE_URL}/elink.fcgi", params=elink_params)
-        data = resp.json()
-        
-        try:
-            linksets = data.get("linksets", [])
-            if not linksets:
-                return "No similar articles found."
-            
-            linkset = linksets[0]
-            linksetdbs = linkset.get("linksetdbs", [])
-            
-            similar_pmids = []
-            for db in linksetdbs:
-                if db.get("linkname") == "pubmed_pubmed":
-                    links = db.get("links", [])
-                    # Get more PMIDs if filtering by high-impact journals
-                    fetch_count = max_results * 3 if high_impact_only else max_results
-                    for link in links[:fetch_count]:
-                        if isinstance(link, dict):
-                            similar_pmids.append(str(link.get("id", "")))
-                        else:
-                            similar_pmids.append(str(link))
-                    break
-            
-            if not similar_pmids:
-                return "No similar articles found."
-            
-            # Get summaries for similar articles
-            summary_params = get_params({
-                "db": "pubmed",
-                "id": ",".join(similar_pmids),
-                "retmode": "json"
-            })
-            resp = await client.get(f"{BASE_URL}/esummary.fcgi", params=summary_params)
-            summary_data = resp.json()
-            
-            # Separate results by journal quality and publication type
-            high_impact_results = []
-            other_results = []
-            uid_data = summary_data.get("result", {})
-            
-            for pmid_str in similar_pmids:
-                if pmid_str in uid_data:
-                    item = uid_data[pmid_str]
-                    journal = item.get("source", "")
-                    title = item.get("title", "No title")
-                    
-                    # Detect review articles from title
-                    # (esummary API doesn't provide detailed publication types)
-                    is_review = False
-                    review_type = ""
-                    title_lower = title.lower()
-                    
-                    if "meta-analysis" in title_lower or "metaanalysis" in title_lower:
-                        is_review = True
-                        review_type = " [Meta-Analysis]"
-                    elif "systematic review" in title_lower:
-                        is_review = True
-                        review_type = " [Systematic Review]"
-                    elif title_lower.startswith("review") or ": a review" in title_lower or "review article" in title_lower:
-                        is_review = True
-                        review_type = " [Review]"
-                    
-                    paper_info = {
-                        "pmid": pmid_str,
-                        "title": title + review_type,
-                        "pubdate": item.get("pubdate", "Unknown date"),
-                        "source": journal,
-                        "authors": item.get("authors", []),
-                        "is_review": is_review
-                    }
-                    
-                    # Categorize by journal impact
-                    if is_high_impact_journal(journal):
-                        high_impact_results.append(paper_info)
-                    else:
-                        other_results.append(paper_info)
-            
-            # Smart fallback logic
-            if high_impact_only:
-                # Prefer high-impact journals, but fallback if too few
-                if len(high_impact_results) >= max_results:
-                    results = high_impact_results[:max_results]
-                elif len(high_impact_results) >= max_results // 2:
-                    # If we have at least half from high-impact, use only those
-                    results = high_impact_results[:max_results]
-                else:
-                    # Not enough high-impact papers, include others
-                    results = high_impact_results + other_results
-                    results = results[:max_results]
-                    logger.info(f"Fallback: Only {len(high_impact_results)} high-impact papers found, including others")
-            else:
-                # No filtering, combine all results
-                results = high_impact_results + other_results
-                results = results[:max_results]
-            
-            if not results:
-                return "No similar articles found."
-            
-            return json.dumps(results, indent=2, ensure_ascii=False)
-            
-        except Exception as e:
-            logger.error(f"Error getting similar articles: {e}")
-            return f"Error retrieving similar articles: {str(e)}"
+    def __init__(self, msg_id, result: dict, result_json: str):
+        super().__init__(jsonrpc="2.0", id=msg_id, result=result)
+        self.text = f'{{"jsonrpc": "2.0", "id": {json.dumps(msg_id)}, "result": {result_json}}}'
 
-# --- MCP Protocol Handling ---
+# method -> (result, serialized result); these never change while the server runs
+_prebuilt_results = {}
+
+def prebuilt_response(method: str, msg_id, build) -> PrebuiltResponse:
+    """Response for a static method; the result is built and serialized only once"""
+    cached = _prebuilt_results.get(method)
+    if cached is None:
+        result = build()
+        cached = _prebuilt_results[method] = (result, json.dumps(result))
+    return PrebuiltResponse(msg_id, *cached)
+
+def encode_message(message) -> str:
+    """Serialize an outgoing JSON-RPC message, reusing prebuilt text when available"""
+    if isinstance(message, PrebuiltResponse):
+        return message.text
+    return json.dumps(message)
+
+# Tools with their own time budget instead of PUBMED_TOOL_DEADLINE
+TOOL_DEADLINES = {"export_citations": EXPORT_DEADLINE}
 
 async def handle_message(message):
+    """Handle one JSON-RPC message and return the response dict (None for notifications)"""
+    msg_id = message.get("id")
     try:
         if "method" not in message:
             return
         
         method = message["method"]
-        msg_id = message.get("id")
 
         if method == "initialize":
-            response = {
-                "jsonrpc": "2.0",
-                "id": msg_id,
-                "result": {
-                    "protocolVersion": "2024-11-05",
-                    "capabilities": {
-                        "tools": {}
-                    },
-                    "serverInfo": {
-                        "name": "pubmed-server",
-                        "version": "0.1.0"
-                    }
-                }
-            }
-            print(json.dumps(response), flush=True)
+            return prebuilt_response(method, msg_id, initialize_result)
 
         elif method == "tools/list":
-            response = {
-                "jsonrpc": "2.0",
-                "id": msg_id,
-                "result": {
-                    "tools": [
-                        {
-                            "name": "search_pubmed",
-                            "description": "Search PubMed database and return REAL PMIDs with full details. CRITICAL WARNING: The PMIDs returned by this tool are the ONLY valid PMIDs. You MUST NOT generate, guess, or make up any PMIDs. NEVER cite a PMID that was not explicitly returned by this tool. Results are sorted to prioritize original research articles over reviews. Each result includes: PMID, full title, authors (first 3), publication date, journal name.",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "query": {"type": "string"},
-                                    "max_results": {"type": "integer", "default": 5}
-                                },
-                                "required": ["query"]
-                            }
-                        },
-                        {
-                            "name": "get_paper_details",
-                            "description": "Get detailed information (Abstract, Authors, DOI, full-text links) for a specific PMID.",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "pmid": {"type": "string"}
-                                },
-                                "required": ["pmid"]
-                            }
-                        },
-                        {
-                            "name": "advanced_search_pubmed",
-                            "description": "Advanced PubMed search with filters (author, journal, date range). Returns REAL PMIDs only. CRITICAL WARNING: You MUST NOT generate or guess PMIDs. ONLY use PMIDs explicitly returned by this tool. NEVER cite a PMID that was not returned. Can parse natural language like 'Smith's 2023 gastric cancer papers'.",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "query": {"type": "string", "description": "Main search keywords"},
-                                    "author": {"type": "string", "description": "Author name (e.g., 'Smith J', 'Tanaka')"},
-                                    "journal": {"type": "string", "description": "Journal name or abbreviation (e.g., 'NEJM', 'Lancet', 'Nature')"},
-                                    "pub_date_from": {"type": "string", "description": "Start date in YYYY/MM/DD format"},
-                                    "pub_date_to": {"type": "string", "description": "End date in YYYY/MM/DD format"},
-                                    "max_results": {"type": "integer", "default": 5}
-                                },
-                                "required": ["query"]
-                            }
-                        },
-                        {
-                            "name": "get_similar_articles",
-                            "description": "Find similar/related articles for a given PMID using PubMed's built-in relevance algorithm. Can optionally filter to show only high-impact journal publications (NEJM, Lancet, JAMA, Nature, etc.). Useful for literature review and finding related research.",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "pmid": {"type": "string", "description": "PMID of the reference paper"},
-                                    "max_results": {"type": "integer", "default": 5, "description": "Maximum number of similar articles to return"},
-                                    "high_impact_only": {"type": "boolean", "default": False, "description": "If true, only return articles from high-impact journals (NEJM, Lancet, JAMA, Nature, etc.)"}
-                                },
-                                "required": ["pmid"]
-                            }
-                        }
-                    ]
-                }
-            }
-            print(json.dumps(response), flush=True)
+            return prebuilt_response(method, msg_id, tools_list_result)
 
         elif method == "tools/call":
             params = message.get("params", {})
@@ -501,27 +3670,110 @@ async def handle_message(message):
             args = params.get("arguments", {})
             
             result_content = ""
-            if name == "search_pubmed":
-                result_content = await search_pubmed(args.get("query"), args.get("max_results", 5))
-            elif name == "get_paper_details":
-                result_content = await get_paper_details(args.get("pmid"))
-            elif name == "advanced_search_pubmed":
-                result_content = await advanced_search_pubmed(
-                    query=args.get("query"),
-                    author=args.get("author"),
-                    journal=args.get("journal"),
-                    pub_date_from=args.get("pub_date_from"),
-                    pub_date_to=args.get("pub_date_to"),
-                    max_results=args.get("max_results", 5)
-                )
-            elif name == "get_similar_articles":
-                result_content = await get_similar_articles(
-                    pmid=args.get("pmid"),
-                    max_results=args.get("max_results", 5),
-                    high_impact_only=args.get("high_impact_only", False)
-                )
-            else:
-                raise ValueError(f"Unknown tool: {name}")
+            token = current_tool.set(name or "")
+            budget = TOOL_DEADLINES.get(name, TOOL_DEADLINE)
+            deadline_token = request_deadline.set(deadline_after(budget))
+            started = time.perf_counter()
+            try:
+                output_options.set(OutputOptions.from_args(args, name))
+                if name == "search_pubmed":
+                    result_content = await search_pubmed(
+                        args.get("query"),
+                        args.get("max_results", 5),
+                        cursor=args.get("cursor"),
+                        use_history=args.get("use_history", False),
+                        publication_types=args.get("publication_types"),
+                        rank_by_type=args.get("rank_by_type", False)
+                    )
+                elif name == "get_paper_details":
+                    result_content = await get_paper_details(args.get("pmid"))
+                elif name == "get_papers_details":
+                    result_content = await get_papers_details(args.get("pmids"))
+                elif name == "advanced_search_pubmed":
+                    result_content = await advanced_search_pubmed(
+                        query=args.get("query"),
+                        author=args.get("author"),
+                        journal=args.get("journal"),
+                        pub_date_from=args.get("pub_date_from"),
+                        pub_date_to=args.get("pub_date_to"),
+                        max_results=args.get("max_results", 5),
+                        cursor=args.get("cursor"),
+                        use_history=args.get("use_history", False),
+                        publication_types=args.get("publication_types"),
+                        rank_by_type=args.get("rank_by_type", False)
+                    )
+                elif name == "batch_search":
+                    result_content = await batch_search(
+                        queries=args.get("queries"),
+                        max_results=args.get("max_results", 5),
+                        publication_types=args.get("publication_types"),
+                        rank_by_type=args.get("rank_by_type", False)
+                    )
+                elif name == "get_similar_articles":
+                    result_content = await get_similar_articles(
+                        pmid=args.get("pmid"),
+                        max_results=args.get("max_results", 5),
+                        high_impact_only=args.get("high_impact_only", False),
+                        publication_types=args.get("publication_types"),
+                        rank_by_type=args.get("rank_by_type", False)
+                    )
+                elif name == "expand_related_articles":
+                    result_content = await expand_related_articles(
+                        pmids=args.get("pmids"),
+                        hops=args.get("hops", 2),
+                        max_results=args.get("max_results", 20),
+                        frontier_size=args.get("frontier_size", 10),
+                        combine=args.get("combine", "sum"),
+                        min_score=args.get("min_score", 0.0),
+                        high_impact_only=args.get("high_impact_only", False),
+                        max_api_calls=args.get("max_api_calls", 30)
+                    )
+                elif name == "export_citations":
+                    result_content = await export_citations(
+                        pmids=args.get("pmids"),
+                        query=args.get("query"),
+                        webenv=args.get("webenv"),
+                        query_key=args.get("query_key"),
+                        citation_format=args.get("citation_format", "ris"),
+                        output_path=args.get("output_path"),
+                        cursor=args.get("cursor"),
+                        page_size=args.get("page_size", EXPORT_PAGE_SIZE)
+                    )
+                elif name == "save_search":
+                    result_content = await save_search(
+                        name=args.get("name"),
+                        query=args.get("query"),
+                        author=args.get("author"),
+                        journal=args.get("journal"),
+                        publication_types=args.get("publication_types"),
+                        since=args.get("since"),
+                        delete=args.get("delete", False)
+                    )
+                elif name == "list_saved_searches":
+                    result_content = await list_saved_searches()
+                elif name == "check_updates":
+                    result_content = await check_updates(args.get("names"))
+                elif name == "server_stats":
+                    result_content = await server_stats(args.get("format", "json"))
+                else:
+                    raise ValueError(f"Unknown tool: {name}")
+            except OutputOptionsError as e:
+                result_content = f"Error: {e}"
+            except DeadlineExceeded as e:
+                # Tools that can return partial results do so themselves; this call had none
+                logger.warning(f"{name}: {e}")
+                metrics.inc("deadline_exceeded_total", tool=name)
+                result_content = f"Error: No results within the {budget:g}s deadline ({e}). Try again or narrow the request."
+            except Exception:
+                metrics.inc("tool_errors_total", tool=name)
+                raise
+            finally:
+                metrics.observe("tool_ms", (time.perf_counter() - started) * 1000, tool=name)
+                if cassette is not None and cassette.mode == "record":
+                    cassette.record_call(name, args, (time.perf_counter() - started) * 1000)
+                current_tool.reset(token)
+                request_deadline.reset(deadline_token)
+                output_options.set(None)
 
             response = {
                 "jsonrpc": "2.0",
@@ -535,7 +3787,7 @@ async def handle_message(message):
                     ]
                 }
             }
-            print(json.dumps(response), flush=True)
+            return response
             
         elif method == "notifications/initialized":
             pass # No response needed
@@ -555,24 +3807,437 @@ async def handle_message(message):
                     "message": str(e)
                 }
             }
-            print(json.dumps(error_response), flush=True)
+            return error_response
+
+# --- Request Dispatch ---
+
+# Maximum number of requests handled concurrently (others wait in line)
+MAX_CONCURRENT_REQUESTS = env_int("PUBMED_MAX_CONCURRENT_REQUESTS", 8)
+
+class Dispatcher:
+    """Runs each JSON-RPC request as its own task, capped by a semaphore.
+
+    With a writer (stdio), responses are sent in completion order and clients
+    match them by id. Transports that answer in-band (HTTP) use call() instead.
+    In-flight requests can be aborted with notifications/cancelled.
+    """
+
+    def __init__(self, writer=None, max_concurrent: int = MAX_CONCURRENT_REQUESTS, shared_semaphore=None):
+        self.writer = writer
+        self.semaphore = asyncio.Semaphore(max(1, max_concurrent))
+        # Optional server-wide cap shared by several dispatchers (one per HTTP client)
+        self.shared_semaphore = shared_semaphore
+        self.in_flight = {}
+        self.tasks = set()
+
+    def _track(self, msg_id, task):
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        if msg_id is not None:
+            self.in_flight[msg_id] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(msg_id, None))
+
+    def submit(self, message: dict):
+        if message.get("method") == "notifications/cancelled":
+            self.cancel(message.get("params", {}).get("requestId"))
+            return
+        self._track(message.get("id"), asyncio.create_task(self._run(message)))
+
+    async def call(self, message: dict):
+        """Handle a message and return its response (None for notifications and cancelled requests)"""
+        if message.get("method") == "notifications/cancelled":
+            self.cancel(message.get("params", {}).get("requestId"))
+            return None
+        task = asyncio.create_task(self._handle(message))
+        self._track(message.get("id"), task)
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        # Cancelled via notifications/cancelled: no response
+        return None if task.cancelled() else task.result()
+
+    def cancel(self, request_id):
+        task = self.in_flight.get(request_id)
+        if task is not None and not task.done():
+            logger.info(f"Cancelling request {request_id}")
+            task.cancel()
+
+    async def _handle(self, message: dict):
+        queued = time.perf_counter()
+        async with self.semaphore:
+            if self.shared_semaphore is not None:
+                await self.shared_semaphore.acquire()
+            try:
+                metrics.observe("queue_wait_ms", (time.perf_counter() - queued) * 1000)
+                return await handle_message(message)
+            finally:
+                if self.shared_semaphore is not None:
+                    self.shared_semaphore.release()
+
+    async def _run(self, message: dict):
+        try:
+            response = await self._handle(message)
+        except asyncio.CancelledError:
+            # Cancelled requests get no response
+            return
+        if response is not None:
+            self.writer.send(response)
+
+    async def drain(self):
+        """Wait for all in-flight requests to finish"""
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+# --- Server lifecycle ---
+
+def start_shared_resources():
+    """Install the metrics signal handler and open the cassette, if any. The pooled client is created on first use."""
+    open_cassette()
+    if hasattr(signal, "SIGUSR1"):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, dump_metrics)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+async def close_shared_resources():
+    if prefetcher is not None:
+        prefetcher.cancel()
+        logger.info(f"Prefetch stats: {prefetcher.stats()}")
+    await close_http_client()
+    if response_cache is not None:
+        logger.info(f"Cache stats: {response_cache.stats()}")
+        response_cache.close()
+    if single_flight is not None:
+        logger.info(f"Request coalescing stats: {single_flight.stats()}")
+    close_local_index()
+    close_watch_store()
+    if cassette is not None:
+        logger.info(f"Cassette stats: {cassette.stats()}")
+        cassette.close()
+    if METRICS_DUMP_PATH:
+        dump_metrics()
+
+# --- Stdio Transport ---
+
+class StdoutWriter:
+    """Single writer task so concurrent responses never interleave on stdout"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def send(self, message: dict):
+        self.queue.put_nowait(message)
+
+    async def _run(self):
+        while True:
+            message = await self.queue.get()
+            if message is None:
+                break
+            try:
+                with metrics.timer("serialize_ms"):
+                    line = encode_message(message) + "\n"
+                sys.stdout.write(line)
+                sys.stdout.flush()
+            except Exception as e:
+                logger.error(f"Failed to write response: {e}")
+
+    async def close(self):
+        self.queue.put_nowait(None)
+        if self.task is not None:
+            await self.task
 
 async def run_server():
     reader = asyncio.StreamReader()
     protocol = asyncio.StreamReaderProtocol(reader)
     await asyncio.get_running_loop().connect_read_pipe(lambda: protocol, sys.stdin)
-    
-    while True:
+
+    start_shared_resources()
+    writer = StdoutWriter()
+    writer.start()
+    dispatcher = Dispatcher(writer)
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                dispatcher.submit(message)
+            except json.JSONDecodeError:
+                logger.error("Failed to decode JSON")
+            except Exception as e:
+                logger.error(f"Server loop error: {e}")
+        await dispatcher.drain()
+    finally:
+        await writer.close()
+        await close_shared_resources()
+
+# --- Streamable HTTP Transport ---
+
+HTTP_HOST = os.environ.get("PUBMED_HTTP_HOST", "127.0.0.1")
+HTTP_PORT = env_int("PUBMED_HTTP_PORT", 8000)
+HTTP_PATH = "/mcp"
+# Concurrent tool calls allowed per client session
+HTTP_CLIENT_CONCURRENCY = env_int("PUBMED_HTTP_CLIENT_CONCURRENCY", 4)
+# Sessions idle for longer than this are dropped
+HTTP_SESSION_TTL = env_float("PUBMED_HTTP_SESSION_TTL", 3600.0)
+# Optional bearer token required on every request
+HTTP_TOKEN = os.environ.get("PUBMED_HTTP_TOKEN")
+# Extra allowed Origin values (localhost origins are always allowed)
+HTTP_ALLOWED_ORIGINS = {o.strip() for o in os.environ.get("PUBMED_HTTP_ALLOWED_ORIGINS", "").split(",") if o.strip()}
+HTTP_MAX_BODY = 1024 * 1024
+# Seconds to wait for each request line, header line or body; idle keep-alive connections close after it
+HTTP_REQUEST_TIMEOUT = env_float("PUBMED_HTTP_REQUEST_TIMEOUT", 30.0)
+
+HTTP_REASONS = {
+    200: "OK", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+    404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout", 411: "Length Required",
+    413: "Payload Too Large"
+}
+
+class HttpRequestError(Exception):
+    """A request that cannot be read; answered with its status before the connection closes"""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class HttpSession:
+    def __init__(self, session_id: str, shared_semaphore):
+        self.id = session_id
+        self.dispatcher = Dispatcher(max_concurrent=HTTP_CLIENT_CONCURRENCY, shared_semaphore=shared_semaphore)
+        self.last_seen = time.monotonic()
+
+class StreamableHttpServer:
+    """MCP Streamable HTTP transport: many clients share one process, its caches and its rate limiter.
+
+    Clients POST JSON-RPC messages to /mcp. Responses come back as application/json,
+    or as an SSE stream (one event per response, in completion order) when the client
+    only accepts text/event-stream.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.shared_semaphore = asyncio.Semaphore(max(1, MAX_CONCURRENT_REQUESTS))
+
+    def _expire_sessions(self):
+        now = time.monotonic()
+        for session_id in [sid for sid, s in self.sessions.items() if now - s.last_seen > HTTP_SESSION_TTL]:
+            del self.sessions[session_id]
+
+    @staticmethod
+    def _origin_allowed(origin: str) -> bool:
+        if not origin or origin in HTTP_ALLOWED_ORIGINS:
+            return True
+        host = origin.split("://", 1)[-1].split(":")[0].strip("[]")
+        return host in ("localhost", "127.0.0.1", "::1")
+
+    async def _send(self, writer, status: int, body: bytes = b"", headers: dict = None):
+        lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}"]
+        headers = dict(headers or {})
+        headers.setdefault("Content-Type", "application/json")
+        headers["Content-Length"] = str(len(body))
+        lines.extend(f"{k}: {v}" for k, v in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _send_error(self, writer, status: int, message: str):
+        body = json.dumps({"jsonrpc": "2.0", "id": None, "error": {"code": -32600, "message": message}})
+        await self._send(writer, status, body.encode())
+
+    @staticmethod
+    async def _read(awaitable):
+        try:
+            return await asyncio.wait_for(awaitable, HTTP_REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HttpRequestError(408, "Request timed out") from None
+        except ValueError:
+            # StreamReader.readline() raises ValueError for lines over its limit
+            raise HttpRequestError(400, "Request line or header too long") from None
+
+    async def _read_request(self, reader, request_line: bytes) -> tuple:
+        """Read the headers and body that follow request_line; returns (method, path, headers, body)"""
         try:
-            line = await reader.readline()
-            if not line:
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HttpRequestError(400, "Malformed request line") from None
+        headers = {}
+        while True:
+            line = await self._read(reader.readline())
+            if line in (b"\r\n", b"\n", b""):
                 break
-            message = json.loads(line)
-            await handle_message(message)
-        except json.JSONDecodeError:
-            logger.error("Failed to decode JSON")
-        except Exception as e:
-            logger.error(f"Server loop error: {e}")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        body = b""
+        if "content-length" in headers:
+            try:
+                length = int(headers["content-length"])
+            except ValueError:
+                length = -1
+            if length < 0:
+                raise HttpRequestError(400, "Invalid Content-Length")
+            if length > HTTP_MAX_BODY:
+                raise HttpRequestError(413, "Request body too large")
+            body = await self._read(reader.readexactly(length))
+        elif method == "POST":
+            raise HttpRequestError(411, "Content-Length required")
+        return method, path.split("?")[0], headers, body
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), HTTP_REQUEST_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # Idle keep-alive connection
+                    break
+                if not request_line:
+                    break
+                try:
+                    method, path, headers, body = await self._read_request(reader, request_line)
+                except HttpRequestError as e:
+                    await self._send_error(writer, e.status, str(e))
+                    break
+
+                keep_alive = await self.handle_request(method, path, headers, body, writer)
+                if not keep_alive or headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logger.debug(f"HTTP connection closed: {e}")
+        finally:
+            writer.close()
+
+    async def handle_request(self, method: str, path: str, headers: dict, body: bytes, writer) -> bool:
+        """Serve one HTTP request; returns False if the connection should be closed"""
+        if path != HTTP_PATH:
+            await self._send_error(writer, 404, "Not found")
+            return True
+        if not self._origin_allowed(headers.get("origin")):
+            await self._send_error(writer, 403, "Origin not allowed")
+            return True
+        if HTTP_TOKEN and headers.get("authorization") != f"Bearer {HTTP_TOKEN}":
+            await self._send_error(writer, 401, "Unauthorized")
+            return True
+
+        self._expire_sessions()
+        session_id = headers.get("mcp-session-id")
+        session = self.sessions.get(session_id) if session_id else None
+        if session_id and session is None:
+            await self._send_error(writer, 404, "Session not found")
+            return True
+
+        if method == "DELETE":
+            if session is not None:
+                del self.sessions[session.id]
+            await self._send(writer, 200)
+            return True
+        if method != "POST":
+            # No server-initiated messages, so there is no standalone SSE stream
+            await self._send(writer, 405, headers={"Allow": "POST, DELETE"})
+            return True
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            # Malformed JSON or a body that is not valid UTF-8
+            await self._send_error(writer, 400, "Invalid JSON")
+            return True
+        batch = isinstance(payload, list)
+        messages = payload if batch else [payload]
+        if not messages or not all(isinstance(m, dict) for m in messages):
+            await self._send_error(writer, 400, "Invalid JSON-RPC message")
+            return True
+
+        response_headers = {}
+        if session is None:
+            if not any(m.get("method") == "initialize" for m in messages):
+                await self._send_error(writer, 400, "Missing Mcp-Session-Id header")
+                return True
+            session = HttpSession(uuid.uuid4().hex, self.shared_semaphore)
+            self.sessions[session.id] = session
+            response_headers["Mcp-Session-Id"] = session.id
+        session.last_seen = time.monotonic()
+
+        requests = [m for m in messages if "method" in m and m.get("id") is not None]
+        if not requests:
+            # Only notifications or responses: handle them and acknowledge
+            for message in messages:
+                await session.dispatcher.call(message)
+            await self._send(writer, 202, headers=response_headers)
+            return True
+
+        tasks = [asyncio.create_task(session.dispatcher.call(m)) for m in messages]
+        accept = headers.get("accept", "")
+        if "text/event-stream" in accept and "application/json" not in accept:
+            await self._stream_responses(writer, tasks, response_headers)
+            return False
+
+        try:
+            responses = [r for r in await asyncio.gather(*tasks) if r is not None]
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+        with metrics.timer("serialize_ms"):
+            if batch:
+                body = "[" + ", ".join(encode_message(r) for r in responses) + "]"
+            else:
+                body = encode_message(responses[0]) if responses else "null"
+            body = body.encode()
+        await self._send(writer, 200, body, response_headers)
+        return True
+
+    async def _stream_responses(self, writer, tasks, headers: dict):
+        """Send each response as an SSE event as soon as it completes, then close the stream"""
+        lines = ["HTTP/1.1 200 OK", "Content-Type: text/event-stream", "Cache-Control: no-cache", "Connection: close"]
+        lines.extend(f"{k}: {v}" for k, v in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                response = await next_done
+                if response is None:
+                    continue
+                with metrics.timer("serialize_ms"):
+                    data = encode_message(response)
+                writer.write(f"event: message\ndata: {data}\n\n".encode("utf-8"))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # Client went away: abort its in-flight tool calls
+            for task in tasks:
+                task.cancel()
+            raise
+
+async def run_http_server(host: str = HTTP_HOST, port: int = HTTP_PORT):
+    start_shared_resources()
+    transport = StreamableHttpServer()
+    server = await asyncio.start_server(transport.handle_connection, host, port)
+    logger.info(f"Streamable HTTP transport listening on http://{host}:{port}{HTTP_PATH}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await close_shared_resources()
+
+def main():
+    parser = argparse.ArgumentParser(description="PubMed MCP server")
+    parser.add_argument("--transport", choices=["stdio", "http"], default=os.environ.get("PUBMED_TRANSPORT", "stdio"))
+    parser.add_argument("--host", default=HTTP_HOST, help="HTTP transport bind address")
+    parser.add_argument("--port", type=int, default=HTTP_PORT, help="HTTP transport port")
+    args = parser.parse_args()
+    if args.transport == "http":
+        try:
+            asyncio.run(run_http_server(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        asyncio.run(run_server())
 
 if __name__ == "__main__":
-    asyncio.run(run_server())
+    main()
@@ -0,0 +1,67 @@
+"""Shared fixtures: a mock E-utilities server and one event loop for the whole run.
+
+server_stdio reads its configuration at import time, so the environment is
+pointed at the mock server (and at a scratch directory) before it is imported.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from mock_eutils import add_mock_arguments, start_mock_server  # noqa: E402
+
+_parser = argparse.ArgumentParser()
+add_mock_arguments(_parser)
+MOCK_ARGS = _parser.parse_args(["--latency-ms", "0", "--jitter-ms", "0"])
+MOCK_SERVER, MOCK_URL, MOCK_STATE = start_mock_server(MOCK_ARGS)
+STATE_DIR = tempfile.mkdtemp(prefix="pubmed-mcp-tests-")
+
+os.environ.update({
+    "PUBMED_EUTILS_BASE_URL": MOCK_URL,
+    "PUBMED_CACHE_PATH": "",
+    "PUBMED_RATE_LIMIT": "1000",
+    "PUBMED_RATE_BURST": "100",
+    "PUBMED_BACKOFF_BASE": "0.01",
+    "PUBMED_WATCH_PATH": os.path.join(STATE_DIR, "watches.sqlite3"),
+    "PUBMED_EXPORT_DIR": os.path.join(STATE_DIR, "exports"),
+})
+
+import server_stdio  # noqa: E402
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(server_stdio.close_shared_resources())
+    loop.close()
+
+@pytest.fixture
+def run(loop):
+    """Run a coroutine to completion on the shared loop"""
+    return loop.run_until_complete
+
+@pytest.fixture(autouse=True)
+def fresh_state(loop, monkeypatch):
+    """Empty cache and coalescing state per test; mock latency settings are restored afterwards"""
+    flights = server_stdio.SingleFlight()
+    monkeypatch.setattr(server_stdio, "response_cache", server_stdio.ResponseCache(path=""))
+    monkeypatch.setattr(server_stdio, "single_flight", flights)
+    saved = dict(vars(MOCK_ARGS))
+    MOCK_STATE.reset()
+    yield
+    # Shared fetches outlive cancelled or timed-out waiters; finish them within their own test
+    if flights.calls:
+        loop.run_until_complete(asyncio.gather(*flights.calls.values(), return_exceptions=True))
+    vars(MOCK_ARGS).update(saved)
+
+@pytest.fixture
+def mock():
+    """Mock server state: .args holds the latency/error settings, .stats() the request counts"""
+    return MOCK_STATE
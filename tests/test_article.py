@@ -0,0 +1,112 @@
+import json
+
+import server_stdio as s
+
+EFETCH_XML = b"""<?xml version="1.0"?>
+<PubmedArticleSet>
+<PubmedArticle>
+  <MedlineCitation>
+    <PMID Version="1"> 31000001 </PMID>
+    <Article>
+      <Journal>
+        <ISSN IssnType="Print">0028-3878</ISSN>
+        <Title>Neurology</Title>
+        <ISOAbbreviation>Neurology</ISOAbbreviation>
+      </Journal>
+      <ArticleTitle>Levodopa in <i>early</i> Parkinson disease</ArticleTitle>
+      <Abstract>
+        <AbstractText Label="BACKGROUND">Background text.</AbstractText>
+        <AbstractText Label="RESULTS">CO<sub>2</sub> results.</AbstractText>
+      </Abstract>
+      <AuthorList>
+        <Author><LastName>Smith</LastName><ForeName>Jane</ForeName></Author>
+        <Author><CollectiveName>Study Group</CollectiveName></Author>
+        <Author><LastName>Tanaka</LastName><ForeName>Ken</ForeName></Author>
+      </AuthorList>
+      <PublicationTypeList>
+        <PublicationType>Journal Article</PublicationType>
+        <PublicationType>Randomized Controlled Trial</PublicationType>
+      </PublicationTypeList>
+    </Article>
+  </MedlineCitation>
+  <PubmedData>
+    <ArticleIdList>
+      <ArticleId IdType="pubmed">31000001</ArticleId>
+      <ArticleId IdType="doi">10.1000/example</ArticleId>
+      <ArticleId IdType="pmc">PMC1234567</ArticleId>
+    </ArticleIdList>
+  </PubmedData>
+</PubmedArticle>
+<PubmedArticle>
+  <MedlineCitation>
+    <PMID>31000002</PMID>
+    <Article><Journal><Title>Brain</Title></Journal></Article>
+  </MedlineCitation>
+</PubmedArticle>
+</PubmedArticleSet>"""
+
+SUMMARY = {
+    "uid": "31000003",
+    "title": "A systematic review of deep brain stimulation",
+    "authors": [{"name": "Smith J", "authtype": "Author"}, {"name": "Tanaka K"}, {"name": "Lee S"}, {"name": "Ng P"}],
+    "source": "Mov Disord",
+    "pubdate": "2021 Mar",
+    "issn": "",
+    "essn": "1531-8257",
+    "pubtype": ["Journal Article", "Systematic Review", "Review"],
+}
+
+def test_efetch_record():
+    first, second = [s.Article.from_element(e) for e in s.iter_pubmed_articles(EFETCH_XML)]
+    details = first.details()
+    assert details == {
+        "pmid": "31000001",
+        "title": "Levodopa in early Parkinson disease",
+        # Collective names carry no LastName/ForeName and are left out
+        "authors": ["Smith Jane", "Tanaka Ken"],
+        "journal": "Neurology",
+        "doi": "10.1000/example",
+        "pmc_id": "PMC1234567",
+        "abstract": "Background text.\nCO2 results.",
+        "links": {
+            "pubmed": "https://pubmed.ncbi.nlm.nih.gov/31000001/",
+            "pmc": "https://www.ncbi.nlm.nih.gov/pmc/articles/PMC1234567/",
+            "doi": "https://doi.org/10.1000/example",
+        },
+    }
+    assert first.source == "Neurology" and first.issn == "0028-3878"
+    assert first.types() == ["rct"] and not first.is_review()
+    assert first.tier() == 1
+
+    assert second.pmid == "31000002"
+    assert second.title == "No title" and second.authors == [] and second.abstract == ""
+    assert second.details()["links"] == {"pubmed": "https://pubmed.ncbi.nlm.nih.gov/31000002/"}
+
+def test_esummary_record():
+    article = s.Article.from_summary("31000003", SUMMARY)
+    assert article.search_result() == {
+        "pmid": "31000003",
+        "title": "A systematic review of deep brain stimulation",
+        "authors": "Smith J, Tanaka K, Lee S",
+        "pubdate": "2021 Mar",
+        "source": "Mov Disord",
+        "types": ["systematic review", "review"],
+    }
+    assert article.advanced_result()["authors"] == SUMMARY["authors"]
+    # eISSN is used when the print ISSN is empty
+    assert article.issn == "1531-8257" and article.tier() == 2
+    assert article.is_review()
+
+def test_esummary_record_with_missing_fields():
+    result = s.Article.from_summary("31000004", {"uid": "31000004"}).search_result()
+    assert result == {"pmid": "31000004", "title": "No title", "authors": "No authors",
+                      "pubdate": "Unknown date", "source": "Unknown source"}
+
+def test_both_formats_describe_the_same_mock_article(run, mock):
+    summary = json.loads(run(s.eutils_get("esummary", {"db": "pubmed", "id": "31000005", "retmode": "json"})).content)
+    efetch = run(s.eutils_get("efetch", {"db": "pubmed", "id": "31000005", "retmode": "xml"})).content
+    from_summary = s.Article.from_summary("31000005", summary["result"]["31000005"])
+    from_element = s.Article.from_element(next(s.iter_pubmed_articles(efetch)))
+    assert from_summary.pmid == from_element.pmid == "31000005"
+    assert from_summary.title == from_element.title
+    assert from_summary.types() == from_element.types()
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+from mock_eutils import search_ids
+
+import server_stdio as s
+
+def batch(run, queries, **kwargs):
+    text = run(s.batch_search(queries, **kwargs))
+    return json.loads(text) if text.startswith("{") else text
+
+def expected(query: str, max_results: int, *filters) -> set:
+    """PMIDs the mock returns for the term batch_search builds from query and filters"""
+    term = s.build_search_term(query, *(filters or (None,) * 5))
+    return set(search_ids(term, 0, max_results)[1])
+
+def pmids(group) -> set:
+    return {r["pmid"] for r in group["results"]}
+
+def test_overlapping_queries_share_one_summary_fan_in(run, mock):
+    result = batch(run, ["shared topic", {"query": "shared topic", "max_results": 3}, "other topic"])
+    assert mock.stats()["by_endpoint"] == {"esearch": 3, "esummary": 1}
+    first, second, third = result["queries"]
+    assert pmids(first) == expected("shared topic", 5)
+    assert pmids(second) == expected("shared topic", 3)
+    assert all("title" in r for g in result["queries"] for r in g["results"])
+
+    shared = pmids(second)
+    assert {r["pmid"] for r in first["results"] if r.get("also_in") == [1]} == shared
+    assert all(r["also_in"] == [0] for r in second["results"])
+    assert not any("also_in" in r for r in third["results"])
+    assert result["overlap"] == {
+        "total_results": 13, "unique_pmids": 10, "shared_pmids": 3,
+        "pairs": [{"queries": [0, 1], "shared": 3, "jaccard": 0.6}],
+    }
+
+def test_per_query_filters(run, mock):
+    filtered = {"query": "filtered", "author": "Smith J", "pub_date_from": "2020/01/01", "publication_types": ["rct"]}
+    result = batch(run, ["filtered", filtered], max_results=4)
+    plain, narrowed = result["queries"]
+    filters = ("Smith J", None, "2020/01/01", None, ["rct"])
+    assert pmids(plain) == expected("filtered", 4)
+    assert pmids(narrowed) == expected("filtered", 4, *filters)
+    assert narrowed["count"] == search_ids(s.build_search_term("filtered", *filters), 0, 0)[0]
+
+def test_too_many_queries(run, mock, monkeypatch):
+    monkeypatch.setattr(s, "MAX_BATCH_QUERIES", 2)
+    assert batch(run, ["a", "b", "c"]) == "Error: Too many queries (3). The maximum is 2 per call."
+    assert mock.stats()["total"] == 0
+
+@pytest.mark.parametrize("queries, error", [
+    ([], "Error: No queries given."),
+    (None, "Error: No queries given."),
+    (["fine", "   "], "Error: Query 1 has no query text."),
+    ([{"author": "Smith J"}], "Error: Query 0 has no query text."),
+    ([{"query": "fine", "max_results": 0}], "Error: Query 0: max_results must be a positive integer."),
+])
+def test_empty_queries_are_errors(run, mock, queries, error):
+    assert batch(run, queries) == error
+    assert mock.stats()["total"] == 0
@@ -0,0 +1,69 @@
+import json
+import time
+
+import httpx
+import pytest
+
+import server_stdio as s
+
+def esummary_body(entries: dict) -> bytes:
+    return json.dumps({"result": {"uids": list(entries), **entries}}).encode()
+
+def test_esummary_negative_only_when_every_uid_failed():
+    missing = {"uid": "1", "error": "cannot get document summary"}
+    found = {"uid": "2", "title": "A title"}
+    assert s.is_negative_response("esummary", esummary_body({"1": missing}))
+    assert not s.is_negative_response("esummary", esummary_body({}))
+    assert not s.is_negative_response("esummary", esummary_body({"1": missing, "2": found}))
+    assert not s.is_negative_response("esummary", b"not json")
+    assert not s.is_negative_response("esummary", ERROR_BODY)
+
+ERROR_BODY = json.dumps({"header": {"type": "esummary"}, "error": "Unable to obtain query #1"}).encode()
+
+def test_esummary_error_documents_are_errors():
+    assert s.response_error("esummary", ERROR_BODY) == "Unable to obtain query #1"
+    assert s.response_error("esummary", b'{"esummaryresult": ["Empty id list - nothing todo"]}') == "Empty id list - nothing todo"
+    assert s.response_error("esummary", b"not json") is not None
+    assert s.response_error("esummary", esummary_body({})) is None
+    assert s.response_error("efetch", b"<eFetchResult/>") is None
+
+def test_error_documents_raise_and_are_not_cached(run, monkeypatch):
+    calls = []
+
+    async def fetch_eutils(endpoint, params):
+        calls.append(endpoint)
+        return httpx.Response(200, content=ERROR_BODY)
+
+    monkeypatch.setattr(s, "fetch_eutils", fetch_eutils)
+    for _ in range(2):
+        with pytest.raises(s.EutilsResponseError, match="Unable to obtain query"):
+            run(s.eutils_get("esummary", {"db": "pubmed", "id": "1", "retmode": "json"}))
+    assert calls == ["esummary", "esummary"]
+    assert s.response_cache.counters["stores"] == 0
+
+def test_efetch_negative_without_articles():
+    assert s.is_negative_response("efetch", b"<?xml version='1.0'?><PubmedArticleSet></PubmedArticleSet>")
+    assert not s.is_negative_response("efetch", b"<PubmedArticleSet><PubmedArticle>...</PubmedArticle></PubmedArticleSet>")
+
+def test_memory_tier_is_bounded_by_bytes(run):
+    cache = s.ResponseCache(max_entries=100, path="", max_bytes=250)
+    for i in range(5):
+        run(cache.put("efetch", {"id": str(i)}, b"<PubmedArticle>" + b"x" * 85))
+    assert cache.memory_bytes <= 250 and len(cache.memory) == 2
+    assert run(cache.get("efetch", {"id": "4"})) is not None
+    assert run(cache.get("efetch", {"id": "0"})) is None
+    # A body above the whole budget is not kept in memory at all
+    run(cache.put("efetch", {"id": "big"}, b"<PubmedArticle>" + b"x" * 300))
+    assert run(cache.get("efetch", {"id": "big"})) is None
+    assert cache.memory_bytes == sum(len(entry[2]) for entry in cache.memory.values())
+
+def test_disk_tier_prunes_expired_and_excess_rows(tmp_path):
+    disk = s.DiskCache(str(tmp_path / "cache.sqlite3"), max_entries=3, prune_interval=0)
+    now = time.time()
+    disk.put("expired", "efetch", now - 1, False, b"old")
+    for i in range(5):
+        disk.put(f"k{i}", "efetch", now + 100 + i, False, b"body")
+    keys = [row[0] for row in disk.conn.execute("SELECT key FROM responses ORDER BY key")]
+    # The rows closest to expiry go first
+    assert keys == ["k2", "k3", "k4"]
+    disk.close()
@@ -0,0 +1,24 @@
+import pytest
+
+import server_stdio as s
+
+PARAMS = {"db": "pubmed", "term": "cassette test", "retmode": "json"}
+
+def test_record_then_replay(run, tmp_path, monkeypatch, mock):
+    monkeypatch.setattr(s, "cassette", s.Cassette(str(tmp_path), "record"))
+    recorded = run(s.fetch_eutils("esearch", PARAMS))
+    s.cassette.close()
+
+    monkeypatch.setattr(s, "REPLAY_TIME_SCALE", 0)
+    monkeypatch.setattr(s, "cassette", s.Cassette(str(tmp_path), "replay"))
+    mock.reset()
+    replayed = run(s.fetch_eutils("esearch", PARAMS))
+    assert replayed.content == recorded.content
+    assert mock.stats()["total"] == 0
+
+def test_replay_miss_without_httpx_loaded(run, tmp_path, monkeypatch):
+    (tmp_path / "log.jsonl").write_text("")
+    monkeypatch.setattr(s, "cassette", s.Cassette(str(tmp_path), "replay"))
+    monkeypatch.setattr(s, "httpx", None)
+    with pytest.raises(s.CassetteMiss):
+        run(s.fetch_eutils("esearch", PARAMS))
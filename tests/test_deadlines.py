@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+import server_stdio as s
+
+PARAMS = {"db": "pubmed", "term": "deadline test", "retmode": "json"}
+
+async def esearch_by(deadline: float = 0):
+    s.request_deadline.set(s.deadline_after(deadline))
+    return await s.eutils_get("esearch", PARAMS)
+
+def test_coalesced_waiter_outlives_leader_deadline(run, mock):
+    mock.args.latency_ms = 300
+
+    async def scenario():
+        leader = asyncio.create_task(esearch_by(0.1))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(esearch_by(0))
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    leader, follower = run(scenario())
+    assert isinstance(leader, s.DeadlineExceeded)
+    assert follower.status_code == 200
+    assert mock.stats()["by_endpoint"] == {"esearch": 1}
+
+def test_waiter_deadline_applies_to_shared_fetch(run, mock):
+    mock.args.latency_ms = 300
+
+    async def scenario():
+        leader = asyncio.create_task(esearch_by(0))
+        await asyncio.sleep(0.01)
+        return leader, await asyncio.gather(esearch_by(0.1), return_exceptions=True)
+
+    leader, (follower,) = run(scenario())
+    assert isinstance(follower, s.DeadlineExceeded)
+    assert run(leader).status_code == 200
+
+def test_tool_call_without_results_reports_the_deadline(run, mock, monkeypatch):
+    mock.args.latency_ms = 300
+    monkeypatch.setattr(s, "TOOL_DEADLINE", 0.1)
+    message = {"jsonrpc": "2.0", "id": 1, "method": "tools/call",
+               "params": {"name": "get_paper_details", "arguments": {"pmid": "10000001"}}}
+    response = run(s.handle_message(message))
+    assert response["result"]["content"][0]["text"].startswith("Error: No results within the 0.1s deadline")
+
+class SlowFirstSend:
+    """send_eutils stand-in: the first request stalls, later copies answer at once"""
+
+    def __init__(self):
+        self.sent = 0
+        self.cancelled = 0
+
+    async def __call__(self, endpoint, url, params, key):
+        self.sent += 1
+        attempt = self.sent
+        try:
+            await asyncio.sleep(2 if attempt == 1 else 0.01)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return key, f"response {attempt}"
+
+def test_slow_request_is_hedged(run, monkeypatch):
+    send = SlowFirstSend()
+    monkeypatch.setattr(s, "send_eutils", send)
+    monkeypatch.setattr(s, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(s, "hedge_delay", lambda endpoint: 0.05)
+
+    _, resp = run(s.hedged_send("efetch", "http://mock/efetch.fcgi", {"id": "1"}))
+    assert resp == "response 2"
+    # The losing original request is cancelled
+    assert send.sent == 2 and send.cancelled == 1
+
+def test_background_requests_are_not_hedged(run, monkeypatch):
+    monkeypatch.setattr(s, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(s, "HEDGE_MIN_SAMPLES", 1)
+    s.metrics.observe("upstream_ms", 120, endpoint="efetch")
+
+    async def delays():
+        foreground = s.hedge_delay("efetch")
+        s.background_request.set(asyncio.Event())
+        return foreground, s.hedge_delay("efetch")
+
+    foreground, background = run(delays())
+    assert foreground is not None and background is None
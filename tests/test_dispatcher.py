@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import server_stdio as s
+
+class Writer:
+    def __init__(self):
+        self.responses = []
+
+    def send(self, response: dict):
+        self.responses.append(response)
+
+def search_call(msg_id, query: str) -> dict:
+    return {"jsonrpc": "2.0", "id": msg_id, "method": "tools/call",
+            "params": {"name": "search_pubmed", "arguments": {"query": query}}}
+
+def test_responses_are_sent_in_completion_order(run, mock):
+    mock.args.latency_ms = 200
+    writer = Writer()
+    dispatcher = s.Dispatcher(writer)
+
+    async def scenario():
+        dispatcher.submit(search_call(1, "slow query"))
+        dispatcher.submit({"jsonrpc": "2.0", "id": 2, "method": "tools/list"})
+        await dispatcher.drain()
+
+    run(scenario())
+    assert [r["id"] for r in writer.responses] == [2, 1]
+    assert "result" in writer.responses[1]
+
+def test_concurrency_is_capped(run, mock):
+    mock.args.latency_ms = 150
+    writer = Writer()
+    dispatcher = s.Dispatcher(writer, max_concurrent=2)
+
+    async def scenario():
+        started = time.perf_counter()
+        for i in range(4):
+            dispatcher.submit(search_call(i, f"capped query {i}"))
+        await dispatcher.drain()
+        return time.perf_counter() - started
+
+    elapsed = run(scenario())
+    assert len(writer.responses) == 4
+    # Two at a time, each an esearch plus an esummary: two rounds of ~300 ms
+    assert 0.55 < elapsed < 1.1
+
+def test_cancelled_request_gets_no_response(run, mock):
+    mock.args.latency_ms = 300
+    writer = Writer()
+    dispatcher = s.Dispatcher(writer)
+
+    async def scenario():
+        dispatcher.submit(search_call(7, "cancelled query"))
+        await asyncio.sleep(0.05)
+        dispatcher.submit({"jsonrpc": "2.0", "method": "notifications/cancelled", "params": {"requestId": 7}})
+        await dispatcher.drain()
+
+    run(scenario())
+    assert writer.responses == []
+    assert dispatcher.in_flight == {}
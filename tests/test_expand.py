@@ -0,0 +1,33 @@
+import json
+
+import server_stdio as s
+
+SEEDS = ["31000001", "31000002", "31000003"]
+
+def expand(run, **kwargs):
+    return json.loads(run(s.expand_related_articles(SEEDS, **kwargs)))
+
+def test_budget_caps_upstream_requests(run, mock, monkeypatch):
+    monkeypatch.setattr(s, "ELINK_BATCH_SIZE", 1)
+    result = expand(run, hops=2, max_results=10, max_api_calls=2)
+    assert mock.stats()["total"] == 2
+    assert result["api_calls"] == 2
+    assert result["partial"] is True
+    assert "max_api_calls=2" in result["partial_reason"]
+    # Score-only ranking: no summaries were fetched
+    assert result["results"] and set(result["results"][0]) == {"pmid", "score", "hop", "linked_from"}
+
+def test_summaries_are_fetched_within_budget(run, mock):
+    result = expand(run, hops=1, max_results=10, max_api_calls=2)
+    assert mock.stats()["by_endpoint"] == {"elink": 1, "esummary": 1}
+    assert result["api_calls"] == 2
+    assert "partial" not in result
+    assert all("title" in r for r in result["results"])
+
+def test_cached_responses_do_not_count(run, mock):
+    expand(run, hops=1, max_results=10, max_api_calls=2)
+    mock.reset()
+    result = expand(run, hops=1, max_results=10, max_api_calls=2)
+    assert mock.stats()["total"] == 0
+    assert result["api_calls"] == 0
+    assert "partial" not in result
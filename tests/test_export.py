@@ -0,0 +1,45 @@
+import json
+
+import server_stdio as s
+
+def test_paged_export_reports_missing_pmids(run):
+    pmids = ["10000001", "99000001", "10000002"]
+    result = json.loads(run(s.export_citations(pmids=pmids, citation_format="csl-json")))
+    assert [item["PMID"] for item in result["citations"]] == ["10000001", "10000002"]
+    assert result["missing"] == ["99000001"]
+    assert result["next_cursor"] is None
+
+def test_paged_export_continues_with_cursor(run):
+    pmids = [str(10000001 + i) for i in range(5)]
+    first = json.loads(run(s.export_citations(pmids=pmids, citation_format="ris", page_size=3)))
+    assert first["citations"].count("ER  - ") == 3 and first["missing"] == []
+    second = json.loads(run(s.export_citations(pmids=pmids, cursor=first["next_cursor"])))
+    assert second["retstart"] == 3 and second["citations"].count("ER  - ") == 2
+    assert "AN  - 10000005" in second["citations"]
+
+def test_conversion_failure_is_reported_per_pmid(run, monkeypatch):
+    def convert(fields, raw):
+        if fields["PMID"][0] == "10000002":
+            raise ValueError("bad record")
+        return s.medline_to_bibtex(fields, raw)
+
+    monkeypatch.setitem(s.CITATION_CONVERTERS, "bibtex", convert)
+    result = json.loads(run(s.export_citations(pmids=["10000001", "10000002"], citation_format="bibtex")))
+    assert "@article{pmid10000001," in result["citations"]
+    assert result["errors"] == {"10000002": "Failed to convert record: bad record"}
+    assert result["missing"] == []
+
+def test_export_to_file(run, tmp_path, monkeypatch):
+    monkeypatch.setattr(s, "EXPORT_DIR", str(tmp_path))
+    result = json.loads(run(s.export_citations(pmids=["10000001", "99000001"], citation_format="medline",
+                                               output_path="out.nbib")))
+    assert result["exported"] == 1 and result["missing"] == ["99000001"]
+    with open(tmp_path / "out.nbib", encoding="utf-8") as f:
+        assert f.read().startswith("PMID- 10000001")
+
+def test_export_follows_output_options(run):
+    async def export():
+        s.output_options.set(s.OutputOptions("compact"))
+        return await s.export_citations(pmids=["10000001"], citation_format="ris")
+
+    assert run(export()).startswith('{"count":1,"retstart":0,')
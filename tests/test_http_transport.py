@@ -0,0 +1,135 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import server_stdio as s
+
+INITIALIZE = {"jsonrpc": "2.0", "id": 1, "method": "initialize",
+              "params": {"protocolVersion": "2025-03-26", "capabilities": {}, "clientInfo": {"name": "test"}}}
+
+def search_call(msg_id, query: str) -> dict:
+    return {"jsonrpc": "2.0", "id": msg_id, "method": "tools/call",
+            "params": {"name": "search_pubmed", "arguments": {"query": query}}}
+
+@pytest.fixture
+def server(loop, run):
+    transport = s.StreamableHttpServer()
+    transport.loop = loop
+    tcp = run(asyncio.start_server(transport.handle_connection, "127.0.0.1", 0))
+    transport.port = tcp.sockets[0].getsockname()[1]
+    yield transport
+    tcp.close()
+    run(tcp.wait_closed())
+
+async def exchange(port: int, raw: bytes) -> tuple:
+    """Send raw bytes on a fresh connection; returns (status, headers, body) of the first reply"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+    lines = head.decode("latin-1").strip().split("\r\n")
+    headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(":") for line in lines[1:])}
+    if "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        # SSE: the stream ends when the server closes the connection
+        body = await asyncio.wait_for(reader.read(), 5)
+    writer.close()
+    return int(lines[0].split()[1]), headers, body
+
+def post(server, payload, session=None, headers=None) -> tuple:
+    """POST a JSON-RPC payload to /mcp and wait for the reply"""
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    lines = ["POST /mcp HTTP/1.1", "Host: localhost", "Accept: application/json, text/event-stream",
+             "Connection: close", f"Content-Length: {len(body)}"]
+    if session:
+        lines.append(f"Mcp-Session-Id: {session}")
+    lines.extend(f"{k}: {v}" for k, v in (headers or {}).items())
+    raw = ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+    return server.loop.run_until_complete(exchange(server.port, raw))
+
+def open_session(server) -> str:
+    status, headers, body = post(server, INITIALIZE)
+    assert status == 200
+    assert json.loads(body)["result"]["serverInfo"]
+    return headers["mcp-session-id"]
+
+def test_initialize_creates_a_session(server):
+    session = open_session(server)
+    assert session in server.sessions
+    status, _, body = post(server, {"jsonrpc": "2.0", "id": 2, "method": "tools/list"}, session)
+    assert status == 200
+    assert json.loads(body)["result"]["tools"]
+
+def test_session_id_is_required_and_checked(server):
+    status, _, body = post(server, {"jsonrpc": "2.0", "id": 2, "method": "tools/list"})
+    assert status == 400
+    assert "Mcp-Session-Id" in json.loads(body)["error"]["message"]
+    status, _, _ = post(server, {"jsonrpc": "2.0", "id": 2, "method": "tools/list"}, "no-such-session")
+    assert status == 404
+
+def test_origin_and_token_checks(server, monkeypatch):
+    status, _, _ = post(server, INITIALIZE, headers={"Origin": "https://evil.example"})
+    assert status == 403
+    status, _, _ = post(server, INITIALIZE, headers={"Origin": "http://localhost:3000"})
+    assert status == 200
+
+    monkeypatch.setattr(s, "HTTP_TOKEN", "secret")
+    status, _, _ = post(server, INITIALIZE)
+    assert status == 401
+    status, _, _ = post(server, INITIALIZE, headers={"Authorization": "Bearer secret"})
+    assert status == 200
+
+def test_batch_returns_one_response_per_request(server, mock):
+    session = open_session(server)
+    batch = [search_call(2, "batch one"), {"jsonrpc": "2.0", "method": "notifications/initialized"},
+             {"jsonrpc": "2.0", "id": 3, "method": "tools/list"}]
+    status, _, body = post(server, batch, session)
+    assert status == 200
+    assert sorted(r["id"] for r in json.loads(body)) == [2, 3]
+
+def test_notifications_only_are_acknowledged(server):
+    session = open_session(server)
+    status, _, body = post(server, {"jsonrpc": "2.0", "method": "notifications/initialized"}, session)
+    assert (status, body) == (202, b"")
+
+def test_sse_streams_responses_in_completion_order(server, mock):
+    mock.args.latency_ms = 150
+    session = open_session(server)
+    batch = [search_call(2, "slow sse query"), {"jsonrpc": "2.0", "id": 3, "method": "tools/list"}]
+    status, headers, body = post(server, batch, session, {"Accept": "text/event-stream"})
+    assert status == 200
+    assert headers["content-type"] == "text/event-stream"
+    events = [json.loads(line[len("data: "):]) for line in body.decode().splitlines() if line.startswith("data: ")]
+    assert [e["id"] for e in events] == [3, 2]
+
+@pytest.mark.parametrize("quota, low, high", [(1, 0.55, 1.2), (2, 0.25, 0.55)])
+def test_per_session_concurrency_quota(server, mock, monkeypatch, quota, low, high):
+    mock.args.latency_ms = 150
+    monkeypatch.setattr(s, "HTTP_CLIENT_CONCURRENCY", quota)
+    session = open_session(server)
+    started = time.perf_counter()
+    status, _, body = post(server, [search_call(i, f"quota {quota} query {i}") for i in range(2)], session)
+    elapsed = time.perf_counter() - started
+    assert status == 200 and len(json.loads(body)) == 2
+    # Each call is an esearch plus an esummary (~300 ms): serial under a quota of 1
+    assert low < elapsed < high
+
+@pytest.mark.parametrize("raw, status", [
+    (b"POST /mcp HTTP/1.1\r\nContent-Length: 4\r\n\r\n\x80\x81{}", 400),
+    (b"POST /mcp HTTP/1.1\r\nContent-Length: 4\r\n\r\n{oops", 400),
+    (b"POST /mcp HTTP/1.1\r\nContent-Length: abc\r\n\r\n", 400),
+    (b"POST /mcp HTTP/1.1\r\nContent-Length: -1\r\n\r\n", 400),
+    (b"POST /mcp HTTP/1.1\r\n\r\n", 411),
+    (b"GARBAGE\r\n\r\n", 400),
+    (b"GET /other HTTP/1.1\r\n\r\n", 404),
+])
+def test_malformed_requests_get_an_error_response(server, run, raw, status):
+    assert run(exchange(server.port, raw))[0] == status
+
+def test_slow_request_times_out(server, run, monkeypatch):
+    monkeypatch.setattr(s, "HTTP_REQUEST_TIMEOUT", 0.1)
+    status, _, _ = run(exchange(server.port, b"POST /mcp HTTP/1.1\r\nContent-Length: 10\r\n\r\n{"))
+    assert status == 408
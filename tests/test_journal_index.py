@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+import server_stdio as s
+
+@pytest.mark.parametrize("journal, issn, tier", [
+    ("Brain", None, 1),
+    ("Brain : a journal of neurology", None, 1),
+    ("Brain Res", None, None),
+    ("Brain Stimul", None, None),
+    ("Lancet", None, 1),
+    ("Lancet (London, England)", None, 1),
+    ("The Lancet", None, 1),
+    ("Lancet Neurol", None, 1),
+    ("Lancet Oncol", None, None),
+    ("Lancet Psychiatry", None, None),
+    ("Parkinsonism & Related Disorders", None, 2),
+    ("Parkinsonism and related disorders", None, 2),
+    ("J Parkinsons Dis", None, 2),
+    ("Journal of Parkinson's Disease", None, 2),
+    ("Neurology", None, 1),
+    ("Neurology India", None, None),
+    # ISSN lookup, with or without the hyphen, wins over an unlisted or odd name
+    ("Some Renamed Journal", "0006-8950", 1),
+    ("", "13538020", 2),
+    ("Lancet", "0000-0000", 1),
+    ("", "1474-547x", 1),
+    ("Unlisted Journal", "1234-5678", None),
+])
+def test_journal_tiers(journal, issn, tier):
+    assert s.journal_tier(journal, issn) == tier
+
+def test_summary_tier_uses_issn_then_name():
+    assert s.summary_journal_tier({"source": "Brain Res", "issn": "0006-8950"}) == 1
+    assert s.summary_journal_tier({"source": "Mov Disord", "issn": "", "essn": ""}) == 2
+    assert not s.is_high_impact_summary({"source": "Brain Res", "issn": "0006-8993"})
+
+def test_tiers_load_from_an_external_file(tmp_path, monkeypatch):
+    path = tmp_path / "tiers.json"
+    path.write_text(json.dumps({"1": [["Brain Res", "0006-8993"]], "3": ["Lancet", "Brain Res"]}))
+    monkeypatch.setattr(s, "JOURNAL_TIERS_PATH", str(path))
+    index = s.load_journal_index()
+    assert index.tier("Brain Res") == 1
+    assert index.tier("", "00068993") == 1
+    assert index.tier("Lancet") == 3
+    # Only the file's journals are listed
+    assert index.tier("Brain") is None
+
+def test_unreadable_tier_file_falls_back_to_the_built_in_list(tmp_path, monkeypatch):
+    path = tmp_path / "tiers.json"
+    path.write_text("{not json")
+    monkeypatch.setattr(s, "JOURNAL_TIERS_PATH", str(path))
+    assert s.load_journal_index().tier("Brain") == 1
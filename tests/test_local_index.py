@@ -0,0 +1,77 @@
+import json
+import os
+
+import pytest
+
+import server_stdio as s
+from local_index import LocalIndex
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+BASELINE = os.path.join(DATA, "pubmed_baseline.xml.gz")
+UPDATE = os.path.join(DATA, "pubmed_update.xml.gz")
+
+@pytest.fixture
+def index(tmp_path):
+    index = LocalIndex(str(tmp_path / "index.sqlite3"))
+    yield index
+    index.close()
+
+def test_ingest_baseline(index):
+    assert index.apply_file(BASELINE) == (3, 0)
+    record = index.details(["1001"])["1001"]
+    assert record["title"] == "Melatonin for insomnia in older adults: a randomized trial"
+    assert record["authors"] == ["Tanaka Hiroshi", "Smith Jane"]
+    assert record["abstract"] == "Insomnia is common in later life.\nMelatonin shortened sleep latency."
+    assert record["links"]["pmc"].endswith("/PMC900101/")
+    summary = index.summaries(["1003"])["1003"]
+    assert summary["pubdate"] == "2018 Winter"
+    assert summary["authors"] == [{"name": "Heart Study Group", "authtype": "Author"}]
+
+def test_reingest_is_skipped_unless_forced(index):
+    index.apply_file(BASELINE)
+    assert index.apply_file(BASELINE) is None
+    assert index.apply_file(BASELINE, force=True) == (3, 0)
+    assert index.search("insomnia")[0] == 2
+
+def test_update_replaces_and_deletes(index):
+    index.apply_file(BASELINE)
+    assert index.apply_file(UPDATE) == (1, 1)
+    assert index.details(["1003"]) == {}
+    assert index.search("statins") == (0, [])
+    # The old title is gone from the full-text index, the new one is searchable
+    assert index.search("hygiene") == (0, [])
+    assert index.search("cognitive behavioral therapy") == (1, ["1002"])
+
+def test_fts_search(index):
+    index.apply_file(BASELINE)
+    count, pmids = index.search("insomnia")
+    assert count == 2 and set(pmids) == {"1001", "1002"}
+    assert index.search("melatonin[ti] AND insomnia") == (1, ["1001"])
+    assert index.search("insomnia NOT melatonin") == (1, ["1002"])
+    assert index.search("insom*", author="Garcia L") == (1, ["1002"])
+    assert index.search("insomnia", date_from="2020/01/01") == (1, ["1001"])
+    # Unbalanced input falls back to a plain-word query instead of failing
+    assert index.search('melatonin AND ("older') == (1, ["1001"])
+
+def test_publication_type_filter(index):
+    index.apply_file(BASELINE)
+    index.apply_file(UPDATE)
+    assert index.search("insomnia", pub_types=["Randomized Controlled Trial"]) == (1, ["1001"])
+    assert index.search("insomnia", pub_types=["Systematic Review"]) == (1, ["1002"])
+    count, _ = index.search(pub_types=["Journal Article", "Review"])
+    assert count == 2
+
+def test_search_pubmed_uses_local_backend(run, index, monkeypatch):
+    index.apply_file(BASELINE)
+    monkeypatch.setattr(s, "SEARCH_BACKEND", "local")
+    monkeypatch.setattr(s, "_local_index", index)
+    result = json.loads(run(s.search_pubmed("melatonin")))
+    assert [paper["pmid"] for paper in result] == ["1001"]
+
+def test_no_results_message_matches_eutils_backend(run, index, monkeypatch):
+    index.apply_file(BASELINE)
+    monkeypatch.setattr(s, "SEARCH_BACKEND", "local")
+    monkeypatch.setattr(s, "_local_index", index)
+    assert run(s.search_pubmed("zebrafish")) == "No results found."
+    assert run(s.advanced_search_pubmed("zebrafish", author="Tanaka H")) == \
+        "No results found for query: (zebrafish) AND (Tanaka H[Author])"
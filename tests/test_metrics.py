@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+import server_stdio as s
+
+@pytest.fixture
+def fresh_metrics(monkeypatch):
+    metrics = s.Metrics()
+    monkeypatch.setattr(s, "metrics", metrics)
+    monkeypatch.setattr(s, "prefetcher", None)
+    return metrics
+
+def call(run, name: str, args: dict) -> str:
+    message = {"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"name": name, "arguments": args}}
+    return run(s.handle_message(message))["result"]["content"][0]["text"]
+
+def test_histogram_buckets_and_quantiles():
+    histogram = s.Histogram()
+    for value in (0.5, 3, 3, 40, 700, 50000):
+        histogram.observe(value)
+    counts = dict(zip(s.HISTOGRAM_BUCKETS, histogram.counts))
+    assert counts[1] == 1 and counts[5] == 2 and counts[50] == 1 and counts[1000] == 1
+    assert counts[float("inf")] == 1 and sum(histogram.counts) == 6
+    summary = histogram.summary()
+    assert summary["count"] == 6 and summary["max"] == 50000
+    # The median falls in the (2.5, 5] bucket; the top quantile is capped by the observed max
+    assert 2.5 < summary["p50"] <= 5
+    assert summary["p99"] <= 50000
+    assert s.Histogram().summary()["p95"] == 0.0
+
+def test_prometheus_rendering():
+    metrics = s.Metrics()
+    metrics.inc("upstream_requests_total", endpoint="esearch", status=200)
+    metrics.inc("upstream_requests_total", endpoint="esearch", status=200)
+    metrics.observe("tool_ms", 3, tool="search_pubmed")
+    metrics.observe("tool_ms", 700, tool="search_pubmed")
+    lines = metrics.prometheus().splitlines()
+    assert 'pubmed_upstream_requests_total{endpoint="esearch",status="200"} 2' in lines
+    buckets = [l for l in lines if l.startswith("pubmed_tool_ms_bucket")]
+    assert len(buckets) == len(s.HISTOGRAM_BUCKETS)
+    # Buckets are cumulative
+    assert 'pubmed_tool_ms_bucket{tool="search_pubmed",le="2.5"} 0' in buckets
+    assert 'pubmed_tool_ms_bucket{tool="search_pubmed",le="5"} 1' in buckets
+    assert 'pubmed_tool_ms_bucket{tool="search_pubmed",le="1000"} 2' in buckets
+    assert buckets[-1] == 'pubmed_tool_ms_bucket{tool="search_pubmed",le="+Inf"} 2'
+    assert 'pubmed_tool_ms_sum{tool="search_pubmed"} 703.0' in lines
+    assert 'pubmed_tool_ms_count{tool="search_pubmed"} 2' in lines
+
+def test_server_stats_reports_a_tool_call(run, mock, fresh_metrics):
+    call(run, "search_pubmed", {"query": "metrics"})
+    stats = json.loads(call(run, "server_stats", {}))
+    upstream = stats["counters"]["upstream_requests_total"]
+    assert upstream == {"endpoint=esearch,status=200": 1, "endpoint=esummary,status=200": 1}
+    assert stats["counters"]["upstream_calls_total"] == {"tool=search_pubmed": 2}
+    assert stats["histograms_ms"]["tool_ms"]["tool=search_pubmed"]["count"] == 1
+    assert stats["histograms_ms"]["upstream_ms"]["endpoint=esearch"]["count"] == 1
+    assert stats["cache"]["stores"] == 2
+
+    text = call(run, "server_stats", {"format": "prometheus"})
+    lines = text.splitlines()
+    assert 'pubmed_upstream_requests_total{endpoint="esummary",status="200"} 1' in lines
+    assert 'pubmed_tool_ms_count{tool="search_pubmed"} 1' in lines
+    assert "pubmed_cache_stores 2" in lines
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import server_stdio as s
+
+def call(run, name: str, args: dict) -> str:
+    message = {"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"name": name, "arguments": args}}
+    return run(s.handle_message(message))["result"]["content"][0]["text"]
+
+def record(i: int, abstract_words: int = 200) -> dict:
+    return {"pmid": str(30000000 + i), "title": f"Article {i}", "abstract": " ".join(["word"] * abstract_words)}
+
+def test_prometheus_format_is_only_for_server_stats(run):
+    assert call(run, "search_pubmed", {"query": "x", "format": "prometheus"}).startswith("Error: format 'prometheus'")
+    assert "pubmed_tool_ms_bucket" in call(run, "server_stats", {"format": "prometheus"})
+
+@pytest.mark.parametrize("tool, fields, valid", [
+    ("search_pubmed", ["bogus"], "source"),
+    ("search_pubmed", ["pmid", "journal"], "source"),
+    ("get_paper_details", ["source"], "journal"),
+    ("list_saved_searches", ["title"], "new_since"),
+])
+def test_unknown_fields_list_the_valid_ones(run, mock, tool, fields, valid):
+    text = call(run, tool, {"query": "x", "pmid": "30000001", "fields": fields})
+    assert text.startswith(f"Error: Unknown fields: {fields[-1]}.")
+    assert valid in text.split("Valid fields:")[1]
+    assert mock.stats()["total"] == 0
+
+def test_fields_select_result_keys(run, mock):
+    results = json.loads(call(run, "search_pubmed", {"query": "fields", "fields": ["title", "source"]}))
+    assert results and all(set(r) == {"pmid", "title", "source"} for r in results)
+
+def test_fields_on_a_tool_without_result_records(run):
+    assert call(run, "server_stats", {"fields": ["pmid"]}).startswith("Error: server_stats returns no result records")
+
+def test_budget_shrinks_abstracts_before_dropping_results():
+    records = [record(i) for i in range(3)]
+    options = s.OutputOptions(budget=400)
+    text = options.render(records)
+    results = json.loads(text)
+    assert len(text) <= 400 * s.CHARS_PER_TOKEN
+    assert [r["pmid"] for r in results] == [r["pmid"] for r in records]
+    assert all(r["abstract"].endswith("…") and len(r["abstract"]) >= s.MIN_ABSTRACT_CHARS for r in results)
+
+def test_budget_omits_trailing_results_and_counts_them():
+    records = [record(i) for i in range(10)]
+    text = s.OutputOptions(budget=200).render({"count": 10, "results": records})
+    doc = json.loads(text)
+    assert len(text) <= 200 * s.CHARS_PER_TOKEN
+    kept = [r["pmid"] for r in doc["results"]]
+    # The top of the ranking survives, abstracts at their floor
+    assert kept == [r["pmid"] for r in records[:len(kept)]]
+    assert doc["omitted"] == 10 - len(kept) > 0
+    assert all(len(r["abstract"]) <= s.MIN_ABSTRACT_CHARS for r in doc["results"])
+
+def test_grouped_results_keep_the_same_count_per_group():
+    groups = [{"query": "a", "results": [record(i, 20) for i in range(6)]},
+              {"query": "b", "results": [record(i, 20) for i in range(10, 13)]},
+              {"query": "c", "error": "failed"}]
+    obj = {"queries": groups, "overlap": {}}
+    full = s.OutputOptions(format="compact").render(obj)
+    budget = len(full) // s.CHARS_PER_TOKEN // 2
+    doc = json.loads(s.OutputOptions(format="compact", budget=budget).render(obj))
+    keep = len(doc["queries"][0]["results"])
+    assert 0 < keep < 6
+    assert len(doc["queries"][1]["results"]) == min(keep, 3)
+    assert doc["queries"][2] == {"query": "c", "error": "failed"}
+    assert doc["omitted"] == 9 - keep - min(keep, 3)
@@ -0,0 +1,52 @@
+import json
+
+from mock_eutils import search_ids
+
+import server_stdio as s
+
+def search(run, query="history paging", **kwargs):
+    text = run(s.search_pubmed(query, **kwargs))
+    return json.loads(text) if text.startswith("{") else text
+
+def pmids(result) -> set:
+    return {r["pmid"] for r in result["results"]}
+
+def test_cursor_returns_the_next_page(run, mock):
+    first = search(run, max_results=10, use_history=True)
+    count, _ = search_ids("history paging", 0, 0)
+    assert first["count"] == count and first["retstart"] == 0
+    assert pmids(first) == set(search_ids("history paging", 0, 10)[1])
+
+    mock.reset()
+    second = search(run, cursor=first["next_cursor"])
+    assert second["retstart"] == 10
+    assert pmids(second) == set(search_ids("history paging", 10, 10)[1])
+    # The WebEnv travels in the cursor: no second esearch
+    assert mock.stats()["by_endpoint"] == {"esummary": 1}
+
+def test_malformed_cursor_is_an_error(run, mock):
+    for cursor in ("not a cursor!", s.encode_cursor({"term": "missing start and size"})):
+        assert search(run, cursor=cursor).startswith("Error: Invalid cursor")
+    assert mock.stats()["total"] == 0
+
+def test_history_paging_starts_above_the_threshold(run, mock, monkeypatch):
+    monkeypatch.setattr(s, "HISTORY_THRESHOLD", 5)
+    monkeypatch.setattr(s, "HISTORY_PAGE_SIZE", 4)
+    assert "next_cursor" not in search(run, max_results=5)
+
+    mock.reset()
+    paged = search(run, max_results=10)
+    assert len(paged["results"]) == 10 and paged["next_cursor"]
+    # One esearch with usehistory, then pages of 4, 4 and 2 fetched concurrently
+    assert mock.stats()["by_endpoint"] == {"esearch": 1, "esummary": 3}
+
+def test_expired_webenv_reruns_the_search(run, mock):
+    first = search(run, max_results=10, use_history=True)
+    mock.webenvs.clear()
+    mock.reset()
+
+    second = search(run, cursor=first["next_cursor"])
+    assert pmids(second) == set(search_ids("history paging", 10, 10)[1])
+    assert second["next_cursor"]
+    # The failed page, a fresh esearch and the page again
+    assert mock.stats()["by_endpoint"] == {"esummary": 2, "esearch": 1}
@@ -0,0 +1,46 @@
+import json
+import time
+
+import pytest
+from mock_eutils import MISSING_PMID_MIN
+
+import server_stdio as s
+
+@pytest.fixture(autouse=True)
+def no_prefetch(monkeypatch):
+    """Every record comes from get_papers_details' own efetch chunks"""
+    monkeypatch.setattr(s, "prefetcher", None)
+
+def details(run, pmids):
+    text = run(s.get_papers_details(pmids))
+    return json.loads(text) if text[:1] in "[{" else text
+
+def test_chunks_are_fetched_concurrently(run, mock, monkeypatch):
+    mock.args.latency_ms = 150
+    monkeypatch.setattr(s, "EFETCH_BATCH_SIZE", 3)
+    pmids = [str(30000001 + i) for i in range(8)]
+    started = time.perf_counter()
+    results = details(run, pmids)
+    elapsed = time.perf_counter() - started
+    assert mock.stats()["by_endpoint"] == {"efetch": 3}
+    assert [r["pmid"] for r in results] == pmids
+    assert all(r["title"] and "abstract" in r for r in results)
+    # Three chunks of 150 ms in parallel, not one after another
+    assert elapsed < 0.4
+
+def test_order_is_kept_and_missing_pmids_are_reported(run, mock):
+    missing = str(MISSING_PMID_MIN + 1)
+    results = details(run, "30000009, 30000001 abc " + missing + " 30000005 30000001")
+    assert [r["pmid"] for r in results] == ["30000009", "30000001", "abc", missing, "30000005"]
+    by_pmid = {r["pmid"]: r for r in results}
+    assert by_pmid["abc"] == {"pmid": "abc", "error": "Invalid PMID"}
+    assert by_pmid[missing] == {"pmid": missing, "error": "PMID not found"}
+    assert "error" not in by_pmid["30000005"]
+    # The invalid PMID never goes upstream; the rest share one chunk
+    assert mock.stats()["by_endpoint"] == {"efetch": 1}
+
+def test_request_limits(run, mock, monkeypatch):
+    monkeypatch.setattr(s, "MAX_BATCH_PMIDS", 2)
+    assert details(run, []) == "Error: No PMIDs given."
+    assert details(run, ["1", "2", "3"]) == "Error: Too many PMIDs (3). The maximum is 2 per call."
+    assert mock.stats()["total"] == 0
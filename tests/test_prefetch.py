@@ -0,0 +1,35 @@
+import asyncio
+import json
+
+import server_stdio as s
+
+def test_prefetched_record_is_served_without_refetch(run, mock, monkeypatch):
+    prefetcher = s.Prefetcher(top_k=2)
+    monkeypatch.setattr(s, "prefetcher", prefetcher)
+
+    async def scenario():
+        prefetcher.schedule(["101", "102"])
+        await asyncio.gather(*prefetcher.batches)
+        return await s.get_paper_details("102")
+
+    assert json.loads(run(scenario()))["pmid"] == "102"
+    assert mock.stats()["by_endpoint"] == {"efetch": 1}
+    assert prefetcher.counters["hits"] == 1
+
+def test_caller_falls_back_when_awaited_batch_is_evicted(run, mock, monkeypatch):
+    mock.args.latency_ms = 300
+    prefetcher = s.Prefetcher(top_k=2, max_pending=1)
+    monkeypatch.setattr(s, "prefetcher", prefetcher)
+
+    async def scenario():
+        prefetcher.schedule(["101", "102"])
+        waiter = asyncio.create_task(s.get_paper_details("101"))
+        await asyncio.sleep(0.05)
+        # A newer search evicts the batch the waiter is waiting on
+        prefetcher.schedule(["201", "202"])
+        result = await asyncio.wait_for(waiter, 5)
+        await asyncio.gather(*prefetcher.batches)
+        return result
+
+    assert json.loads(run(scenario()))["pmid"] == "101"
+    assert prefetcher.counters["cancelled"] == 1
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from mock_eutils import search_ids
+
+import server_stdio as s
+
+def summary(pmid: str, *pub_types) -> dict:
+    return {"uid": pmid, "title": f"Article {pmid}", "source": "J Test", "pubtype": ["Journal Article", *pub_types]}
+
+def test_tags_are_ordered_by_evidence():
+    assert s.publication_type_tags(["Review", "Meta-Analysis", "Journal Article", "Systematic Review"]) == \
+        ["meta-analysis", "systematic review", "review"]
+    assert s.publication_type_tags(["Clinical Trial, Phase III", "Controlled Clinical Trial"]) == ["clinical trial"]
+    assert s.publication_type_tags(["Journal Article"]) == []
+
+def test_parse_publication_types():
+    assert s.parse_publication_types(None) == []
+    assert s.parse_publication_types("RCT, meta-analysis") == ["rct", "meta-analysis"]
+    with pytest.raises(ValueError, match="Unknown publication type\\(s\\): trial. Valid: guideline"):
+        s.parse_publication_types(["rct", "trial"])
+
+def test_query_clause_covers_every_matching_type():
+    assert s.publication_type_names(["meta-analysis"]) == ["Meta-Analysis", "Network Meta-Analysis"]
+    assert s.publication_type_query(["guideline", "rct"]) == \
+        '("Practice Guideline"[pt] OR "Guideline"[pt] OR "Randomized Controlled Trial"[pt])'
+
+def test_ranked_by_type_orders_by_evidence_and_keeps_ties_stable():
+    uid_data = {
+        "1": summary("1", "Case Reports"),
+        "2": summary("2"),
+        "3": summary("3", "Randomized Controlled Trial"),
+        "4": summary("4", "Review"),
+        "5": summary("5", "Meta-Analysis", "Retracted Publication"),
+        "6": summary("6"),
+        "7": summary("7", "Practice Guideline"),
+    }
+    ids = list(uid_data)
+    ranked = s.ranked_by_type(s.format_search_results)(ids, uid_data)
+    # Untagged articles sit between primary studies and reviews; a retraction outranks every other tag
+    assert [r["pmid"] for r in ranked] == ["7", "3", "2", "6", "4", "1", "5"]
+
+def test_search_filters_with_a_pt_clause(run, mock):
+    results = json.loads(run(s.search_pubmed("tremor", max_results=4, publication_types=["rct"])))
+    term = f'(tremor) AND {s.publication_type_query(["rct"])}'
+    assert {r["pmid"] for r in results} == set(search_ids(term, 0, 4)[1])
+
+def test_unknown_type_is_an_error_before_any_request(run, mock):
+    text = run(s.search_pubmed("tremor", publication_types=["anecdote"]))
+    assert text.startswith("Error: Unknown publication type(s): anecdote.")
+    assert mock.stats()["total"] == 0
+
+def test_rank_by_type_in_a_search(run, mock):
+    results = json.loads(run(s.search_pubmed("evidence ranking", max_results=20, rank_by_type=True)))
+    ranks = [s.evidence_rank(r.get("types", ())) for r in results]
+    assert ranks == sorted(ranks)
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+import server_stdio as s
+
+def esearch(term: str):
+    return s.eutils_get("esearch", {"db": "pubmed", "term": term, "retmode": "json"})
+
+def test_requests_follow_the_configured_rate(run, mock, monkeypatch):
+    monkeypatch.setattr(s, "rate_limiter", s.RateLimiter([], rate=20, burst=1))
+
+    async def scenario():
+        started = time.perf_counter()
+        await asyncio.gather(*(esearch(f"paced {i}") for i in range(11)))
+        return time.perf_counter() - started
+
+    elapsed = run(scenario())
+    assert mock.stats()["total"] == 11
+    # Ten intervals of 50 ms after the first token
+    assert 0.45 < elapsed < 0.9
+
+def test_retry_after_is_honored(run, mock):
+    mock.args.max_rps = 1
+    mock.args.retry_after = 1
+
+    async def scenario():
+        await esearch("first in window")
+        started = time.perf_counter()
+        await esearch("second in window")
+        return time.perf_counter() - started
+
+    elapsed = run(scenario())
+    assert mock.stats()["by_status"] == {"esearch:200": 2, "esearch:429": 1}
+    # The backoff alone would be a few milliseconds
+    assert 0.95 < elapsed < 1.5
+
+@pytest.mark.parametrize("setting, status", [("rate_429", 429), ("error_rate", 503)])
+def test_backoff_is_jittered_and_exponential(run, mock, monkeypatch, setting, status):
+    setattr(mock.args, setting, 1.0)
+    mock.args.retry_after = 0
+    monkeypatch.setattr(s, "MAX_RETRIES", 3)
+    monkeypatch.setattr(s, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(s, "BACKOFF_MAX", 0.03)
+    bounds = []
+
+    def uniform(low, high):
+        bounds.append((low, high))
+        return high
+
+    monkeypatch.setattr(s.random, "uniform", uniform)
+    with pytest.raises(s.EutilsError):
+        run(esearch(f"failing {setting}"))
+    assert mock.stats()["by_status"] == {f"esearch:{status}": 4}
+    # Full jitter over a doubling window, capped at BACKOFF_MAX
+    assert bounds == [(0, 0.01), (0, 0.02), (0, 0.03), (0, 0.03)]
+
+def test_load_is_spread_across_api_keys(run, mock, monkeypatch):
+    monkeypatch.setattr(s, "rate_limiter", s.RateLimiter(["key-a", "key-b", "key-c"], rate=5, burst=1))
+
+    async def scenario():
+        started = time.perf_counter()
+        await asyncio.gather(*(esearch(f"keyed {i}") for i in range(9)))
+        return time.perf_counter() - started
+
+    elapsed = run(scenario())
+    assert mock.stats()["by_key"] == {"key-a": 3, "key-b": 3, "key-c": 3}
+    # Three requests per key at 5/s; one key alone would need 1.6 s
+    assert elapsed < 0.7
+
+def test_background_requests_yield_to_tool_calls(run, mock, monkeypatch):
+    monkeypatch.setattr(s, "rate_limiter", s.RateLimiter([], rate=5, burst=1))
+    finished = []
+
+    async def background():
+        s.background_request.set(asyncio.Event())
+        await esearch("background")
+        finished.append("background")
+
+    async def foreground():
+        await esearch("foreground")
+        finished.append("foreground")
+
+    async def scenario():
+        # Spend the only token so both requests have to wait
+        await esearch("warm-up")
+        prefetch = asyncio.create_task(background())
+        await asyncio.sleep(0)
+        await asyncio.gather(prefetch, foreground())
+
+    run(scenario())
+    assert finished == ["foreground", "background"]
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import re
+
+import pytest
+
+import server_stdio as s
+
+class FakeWindows:
+    """esearch_window stand-in: PMIDs per query word, ORed probe terms return the union"""
+
+    def __init__(self, delay: float = 0):
+        self.entries = {}
+        self.terms = []
+        self.delay = delay
+
+    async def __call__(self, term: str, mindate: str, maxdate: str) -> tuple:
+        self.terms.append(term)
+        await asyncio.sleep(self.delay)
+        ids = list(dict.fromkeys(pmid for word in re.findall(r"[a-z]+", term) for pmid in self.entries.get(word, [])))
+        return len(ids), ids
+
+@pytest.fixture
+def windows(tmp_path, monkeypatch):
+    store = s.WatchStore(str(tmp_path / "watches.sqlite3"))
+    monkeypatch.setattr(s, "_watch_store", store)
+    fake = FakeWindows()
+    monkeypatch.setattr(s, "esearch_window", fake)
+    yield fake
+    store.close()
+
+def new_pmids(result: str) -> dict:
+    return {w["name"]: sorted(r["pmid"] for r in w["results"]) for w in json.loads(result)["watches"]}
+
+def test_last_checked_is_never_until_first_check(run, windows):
+    saved = json.loads(run(s.save_search("alpha", "alpha")))
+    assert saved["last_checked"] == "never"
+    run(s.check_updates())
+    listed = json.loads(run(s.list_saved_searches()))
+    assert listed[0]["last_checked"] != "never"
+
+def test_reports_new_pmids_once(run, windows):
+    run(s.save_search("alpha", "alpha"))
+    windows.entries["alpha"] = ["20000001", "20000002"]
+    assert new_pmids(run(s.check_updates())) == {"alpha": ["20000001", "20000002"]}
+    windows.entries["alpha"].append("20000003")
+    assert new_pmids(run(s.check_updates())) == {"alpha": ["20000003"]}
+    assert json.loads(run(s.check_updates()))["unchanged"] == ["alpha"]
+
+def test_pmid_seen_by_one_search_is_new_for_another(run, windows):
+    run(s.save_search("alpha", "alpha"))
+    run(s.save_search("beta", "beta"))
+    windows.entries["alpha"] = ["20000001"]
+    assert new_pmids(run(s.check_updates())) == {"alpha": ["20000001"]}
+    # The group probe finds only PMIDs alpha has seen, but beta has not
+    windows.entries["beta"] = ["20000001"]
+    result = json.loads(run(s.check_updates()))
+    assert new_pmids(json.dumps(result)) == {"beta": ["20000001"]}
+    assert result["unchanged"] == ["alpha"]
+
+def test_quiet_group_needs_only_the_probe(run, windows):
+    for name in ("alpha", "beta", "gamma"):
+        run(s.save_search(name, name))
+    result = json.loads(run(s.check_updates()))
+    assert result["unchanged"] == ["alpha", "beta", "gamma"]
+    assert result["requests"] == 1 and len(windows.terms) == 1
+
+def test_overlapping_checks_do_not_report_twice(run, windows):
+    run(s.save_search("alpha", "alpha"))
+    windows.entries["alpha"] = ["20000001"]
+    windows.delay = 0.05
+
+    async def both():
+        return await asyncio.gather(s.check_updates(), s.check_updates())
+
+    first, second = run(both())
+    assert new_pmids(first) == {"alpha": ["20000001"]}
+    assert json.loads(second)["unchanged"] == ["alpha"]
+
+def test_listing_follows_output_options(run, windows):
+    run(s.save_search("alpha", "alpha"))
+    run(s.save_search("beta", "beta", author="Smith J"))
+
+    async def listing():
+        s.output_options.set(s.OutputOptions("text", fields=["name", "term"]))
+        return await s.list_saved_searches()
+
+    assert run(listing()).splitlines() == ["name\tterm", "alpha\t(alpha)", "beta\t(beta) AND (Smith J[Author])"]
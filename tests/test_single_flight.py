@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+import server_stdio as s
+
+PARAMS = {"db": "pubmed", "term": "coalesced query", "retmode": "json"}
+
+def test_identical_requests_share_one_upstream_call(run, mock):
+    mock.args.latency_ms = 100
+
+    async def scenario():
+        return await asyncio.gather(*(s.eutils_get("esearch", PARAMS) for _ in range(5)))
+
+    responses = run(scenario())
+    assert len({r.content for r in responses}) == 1
+    assert mock.stats()["by_endpoint"] == {"esearch": 1}
+    assert s.single_flight.stats() == {"leaders": 1, "coalesced": 4, "in_flight": 0}
+
+def test_cancelled_waiter_does_not_cancel_the_fetch(run, mock):
+    mock.args.latency_ms = 200
+
+    async def scenario():
+        first = asyncio.create_task(s.eutils_get("esearch", PARAMS))
+        second = asyncio.create_task(s.eutils_get("esearch", PARAMS))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        return await second
+
+    assert run(scenario()).status_code == 200
+    assert mock.stats()["by_endpoint"] == {"esearch": 1}
+
+def test_failure_is_shared_by_every_waiter(run, mock, monkeypatch):
+    mock.args.error_rate = 1.0
+    monkeypatch.setattr(s, "MAX_RETRIES", 1)
+
+    async def scenario():
+        return await asyncio.gather(*(s.eutils_get("esearch", PARAMS) for _ in range(3)), return_exceptions=True)
+
+    errors = run(scenario())
+    assert all(isinstance(e, s.EutilsError) for e in errors)
+    # One request and its retry, not one per waiter
+    assert mock.stats()["by_status"] == {"esearch:503": 2}